@@ -0,0 +1,32 @@
+"""
+Gunicorn configuration of the production server profile.
+
+    $ DJANGO_SETTINGS_MODULE=mysite.settings_production gunicorn -c gunicorn.conf.py
+"""
+import multiprocessing
+import os
+
+wsgi_app = 'mysite.wsgi:application'
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# The workers are tied to the number of cores, WEB_CONCURRENCY overrides it
+workers = int(os.environ.get(
+    'WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1
+))
+
+# Importing the project once in the master, so the workers fork with
+# the already loaded application and share its memory pages
+preload_app = True
+
+# Recycling the workers after a number of requests, randomized so they do
+# not restart all at once, bounds the memory growth of long-lived workers
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = 100
+
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 import os
+import importlib.util
+from datetime import timedelta
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,13 +47,13 @@ INSTALLED_APPS = [
     # Third-Party Apps
     'rest_framework',
     'rest_framework.authtoken',
-    'debug_toolbar',
 
     # Local Apps
     'social_network',
 ]
 
 MIDDLEWARE = [
+    'social_network.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,9 +61,46 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'social_network.middleware.QueryBudgetMiddleware',
 ]
 
+# The debug toolbar imports its panels together with the database driver
+# and the test utilities, so it is only loaded for the development server,
+# see manage.py, and can be turned off with DEBUG_TOOLBAR=0
+
+DEBUG_TOOLBAR = DEBUG and os.environ.get('DEBUG_TOOLBAR', '1') == '1' \
+    and importlib.util.find_spec('debug_toolbar') is not None
+
+if DEBUG_TOOLBAR:
+    INSTALLED_APPS.insert(INSTALLED_APPS.index('social_network'),
+                          'debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+
+# The token-only API profile skips the session, CSRF, authentication and
+# message middleware for the API_URL_PREFIX routes, which authenticate with
+# the tokens. The admin keeps using the sessions.
+
+API_URL_PREFIX = '/api/'
+
+API_TOKEN_ONLY = os.environ.get('API_TOKEN_ONLY') == '1'
+
+TOKEN_ONLY_API_MIDDLEWARE = {
+    'django.contrib.sessions.middleware.SessionMiddleware':
+        'social_network.middleware.NonApiSessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware':
+        'social_network.middleware.NonApiCsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware':
+        'social_network.middleware.NonApiAuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware':
+        'social_network.middleware.NonApiMessageMiddleware',
+}
+
+if API_TOKEN_ONLY:
+    MIDDLEWARE = [
+        TOKEN_ONLY_API_MIDDLEWARE.get(middleware, middleware)
+        for middleware in MIDDLEWARE
+    ]
+
 ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
@@ -133,10 +172,165 @@ PASSWORD_HASHERS = [
 ]
 
 
+# Signed access tokens
+# With ENABLED, the API authenticates the requests with the short-lived
+# HMAC-signed access tokens which expire after ACCESS_TTL, obtained from the
+# token-refresh endpoint with the login Authentication Token as the refresh
+# token. Otherwise the API authenticates the Authentication Tokens directly.
+
+SIGNED_TOKEN_AUTH = {
+    'ENABLED': os.environ.get('SIGNED_TOKEN_AUTH') == '1',
+    'ACCESS_TTL': timedelta(minutes=5),
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
-    ]
+        'social_network.authentication.SignedTokenAuthentication'
+        if SIGNED_TOKEN_AUTH['ENABLED'] else
+        'social_network.authentication.ExpiringTokenAuthentication',
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'social_network.throttling.TokenBucketThrottle',
+    ],
+    # The number of the trusted reverse proxies in front of the workers
+    # appending to the X-Forwarded-For header. With 0 the throttling keys the
+    # clients by the REMOTE_ADDR and ignores the header, which anyone could
+    # forge.
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
+}
+
+
+# Authentication Tokens
+# The tokens expire after TTL of inactivity, the None TTL issues the tokens
+# which never expire. The expiry of the used token is extended at most once
+# per REFRESH_INTERVAL.
+
+AUTH_TOKEN = {
+    'TTL': timedelta(days=int(os.environ['AUTH_TOKEN_TTL_DAYS']))
+    if os.environ.get('AUTH_TOKEN_TTL_DAYS') else None,
+    'REFRESH_INTERVAL': timedelta(hours=1),
+}
+
+
+# Throttling
+# Every client gets token buckets keyed by its User, Authentication Token and
+# IP address, refilled with RATE tokens per second up to CAPACITY tokens.
+# The requests take COSTS tokens keyed by the URL name, 1 by default.
+# The LocalBucketStore is per process, the CacheBucketStore shares the
+# buckets between the workers through the shared cache.
+
+THROTTLING = {
+    'ENABLED': True,
+    'STORE': os.environ.get(
+        'THROTTLING_STORE', 'social_network.throttling.LocalBucketStore'
+    ),
+    'RATE': 10,
+    'CAPACITY': 100,
+    'COSTS': {
+        'register': 20,
+        'login': 20,
+        'token-refresh': 5,
+        'api-token-auth': 20,
+        'users': 5,
+        'users-batch': 10,
+        'top-twenty-users': 5,
+        'my-export': 20,
+        'user-export': 20,
+    },
+}
+
+
+# Counters
+# The Users' counters, such as the number of their subscribers, are split
+# into SHARDS rows, so the concurrent writes to a popular User's counter do
+# not wait for each other. The compact_counters command folds the shards.
+# The conditional GETs showing the counters are stale for at most MAX_AGE.
+
+COUNTERS = {
+    'SHARDS': 16,
+    'MAX_AGE': timedelta(minutes=1),
+}
+
+
+# Query budgets
+# The API views declare their query_budget and time_budget, in seconds.
+# The SAMPLE_RATE of the requests are checked and the exceeded budgets are
+# logged with their SQL. The test runner sets ENFORCE, failing the requests
+# exceeding their budgets, see the query_budget_report command.
+
+QUERY_BUDGETS = {
+    'ENABLED': True,
+    'ENFORCE': False,
+    'SAMPLE_RATE': 0.01,
+}
+
+TEST_RUNNER = 'social_network.test_runner.QueryBudgetTestRunner'
+
+
+# Profiling
+# The staff sending the X-Profile header or the ProfilingWindows created in
+# the admin profile the requests by sampling their Python stacks every
+# INTERVAL seconds. The workers check for the open windows every
+# WINDOW_POLL seconds. The profiles are written to the PROFILE_DIR.
+
+PROFILING = {
+    'ENABLED': True,
+    'HEADER': 'HTTP_X_PROFILE',
+    'INTERVAL': 0.005,
+    'WINDOW_POLL': 5,
+}
+
+
+# Trending
+# The Posts are scored by the followers of their author, decaying by half
+# every HALF_LIFE, and the SIZE best Posts younger than MAX_AGE are kept
+# per Country by the refresh_trending command.
+
+TRENDING = {
+    'SIZE': 100,
+    'HALF_LIFE': timedelta(hours=6),
+    'MAX_AGE': timedelta(days=3),
+}
+
+
+# Caches
+# The recent-posts cache keeps the newest Posts of the Users rendered, the
+# least recently used entries are evicted over its MAX_ENTRIES.
+# The shared cache is seen by all the workers, so it keeps the state which
+# has to take effect everywhere at once, such as the revoked access tokens.
+# It is the Redis at REDIS_URL if set, which needs the redis package,
+# otherwise the database table created by the createcachetable command.
+# The revocations cache keeps the revocations read from the shared cache in
+# every worker for TIMEOUT seconds, so the signed tokens are checked without
+# a round trip on every request.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    } if os.environ.get('REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'social_network_cache',
+    },
+    'revocations': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'revocations',
+        'TIMEOUT': 5,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+    'recent-posts': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'recent-posts',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
 }
 
 
@@ -162,3 +356,17 @@ STATIC_ROOT = BASE_DIR / 'static'
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Archived Posts
+# The directory of the compressed columnar segments written by the
+# archive_posts management command
+
+POST_ARCHIVE_DIR = os.environ.get('POST_ARCHIVE_DIR', BASE_DIR / 'archive')
+
+
+# Request profiles
+# The directory of the collapsed stacks and the speedscope files written by
+# the ProfilingMiddleware
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', BASE_DIR / 'profiles')
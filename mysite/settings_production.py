@@ -0,0 +1,61 @@
+"""
+Django production settings for mysite project.
+
+Runs the project with DEBUG turned off, without the debug toolbar, with the
+static files served by WhiteNoise and with the token-only API profile.
+The SECRET_KEY and the ALLOWED_HOSTS are read from the environment.
+"""
+from .settings import *  # noqa: F401, F403
+from .settings import INSTALLED_APPS, MIDDLEWARE, TOKEN_ONLY_API_MIDDLEWARE, \
+    DATABASES, THROTTLING
+
+import os
+
+DEBUG = False
+
+DEBUG_TOOLBAR = False
+
+SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+
+ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', '*').split(',')
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app != 'debug_toolbar']
+
+MIDDLEWARE = [
+    TOKEN_ONLY_API_MIDDLEWARE.get(middleware, middleware)
+    for middleware in MIDDLEWARE
+    if middleware != 'debug_toolbar.middleware.DebugToolbarMiddleware'
+]
+
+# Serving the compressed static files with the far-future cache headers
+# straight from the workers
+MIDDLEWARE.insert(
+    MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1,
+    'whitenoise.middleware.WhiteNoiseMiddleware'
+)
+STATICFILES_STORAGE = \
+    'whitenoise.storage.CompressedManifestStaticFilesStorage'
+
+API_TOKEN_ONLY = True
+
+# With Redis the gunicorn workers share the throttling buckets through the
+# shared cache, the same one which keeps the revoked access tokens. The
+# database cache would cost a few queries per bucket on every request, so
+# without Redis every worker keeps its own buckets.
+THROTTLING = {
+    **THROTTLING,
+    'STORE': os.environ.get(
+        'THROTTLING_STORE',
+        'social_network.throttling.CacheBucketStore'
+        if os.environ.get('REDIS_URL') else
+        'social_network.throttling.LocalBucketStore'
+    ),
+}
+
+# Keeping the database connections open between the requests of a worker
+DATABASES['default']['CONN_MAX_AGE'] = 60
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# The CSRF protection is still on for the admin through the
+# NonApiCsrfViewMiddleware subclass
+SILENCED_SYSTEM_CHECKS = ['security.W003']
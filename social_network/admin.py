@@ -1,4 +1,11 @@
+from datetime import timedelta
+
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils import timezone
+from django.utils.functional import cached_property
+
 from .models import \
     User, \
     Interest, \
@@ -6,13 +13,151 @@ from .models import \
     Country, \
     City, \
     Post, \
-    Subscription
+    Subscription, \
+    DeletionJob, \
+    ProfilingWindow
+from .fields import bump_reference_version
+from .deletion import enqueue_deletion
+
+
+def estimate_count(model):
+    """
+    Reads the number of the model's rows estimated by the PostgreSQL
+    statistics, kept up to date by autovacuum and ANALYZE.
+
+    Returns:
+        int: The estimated number of rows or None if it is not known.
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [model._meta.db_table]
+        )
+        row = cursor.fetchone()
+    # The tables never analyzed have -1 reltuples since PostgreSQL 14
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Avoids the COUNT(*) over the large tables on every changelist page.
+
+    The unfiltered changelists of the tables estimated to have more than
+    the threshold rows are counted from the PostgreSQL statistics. The
+    searched and filtered changelists are counted only up to the threshold,
+    so a broad search does not count the whole table either.
+    """
+    threshold = 100000
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            estimate = estimate_count(self.object_list.model)
+            if estimate is not None and estimate > self.threshold:
+                return estimate
+        return self.object_list.order_by()[:self.threshold + 1].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    The base of the admins of the tables too large to be counted exactly.
+    The search fields have to be served by indexes, such as the
+    varchar_pattern_ops indexes PostgreSQL has for the unique CharFields.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class ReferenceDataAdmin(admin.ModelAdmin):
+    """
+    Invalidates the cached reference data on every change, see
+    CachedPrimaryKeyRelatedField. The deletions are queued as DeletionJobs,
+    which also clear the rows referring to the deleted data.
+    """
+    search_fields = ('name__startswith', )
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        bump_reference_version(self.model)
+
+    def delete_model(self, request, obj):
+        enqueue_deletion(self.model._meta.model_name, obj.pk, request.user.id)
+
+    def delete_queryset(self, request, queryset):
+        for pk in queryset.values_list('pk', flat=True):
+            enqueue_deletion(self.model._meta.model_name, pk, request.user.id)
+
+
+class CityAdmin(ReferenceDataAdmin):
+    list_display = ('name', 'country', 'is_capital')
+    list_select_related = ('country', )
+
+
+class UserAdmin(LargeTableAdmin):
+    list_display = ('id', 'username', 'email', 'country', 'city',
+                    'is_active')
+    list_select_related = ('country', 'city')
+    search_fields = ('username__startswith', )
+
+
+class UserInterestAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'interest')
+    list_select_related = ('user', 'interest')
+    raw_id_fields = ('user', )
+    search_fields = ('user__username__startswith', )
+
+
+class PostAdmin(LargeTableAdmin):
+    list_display = ('id', 'title', 'user', 'created_datetime')
+    list_select_related = ('user', )
+    raw_id_fields = ('user', )
+    search_fields = ('user__username__startswith', )
+
+
+class SubscriptionAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'subscribed_to_user', 'created_datetime')
+    list_select_related = ('user', 'subscribed_to_user')
+    raw_id_fields = ('user', 'subscribed_to_user')
+    search_fields = ('user__username__startswith',
+                     'subscribed_to_user__username__startswith')
+
+
+class DeletionJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'target_type', 'target_id', 'status', 'stage',
+                    'created_datetime', 'finished_datetime')
+    list_filter = ('status', 'target_type')
+
+
+class ProfilingWindowAdmin(admin.ModelAdmin):
+    """
+    Turns the profiling of the requests on for all the workers until the
+    window ends, see ProfilingMiddleware.
+    """
+    list_display = ('id', 'path_prefix', 'started_datetime', 'ends_datetime',
+                    'requested_by')
+    readonly_fields = ('requested_by', )
+
+    def get_changeform_initial_data(self, request):
+        now = timezone.now()
+        return {'started_datetime': now,
+                'ends_datetime': now + timedelta(minutes=5)}
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.requested_by = request.user.id
+        super().save_model(request, obj, form, change)
 
-admin.site.register(User)
-admin.site.register(Interest)
-admin.site.register(UserInterest)
-admin.site.register(Country)
-admin.site.register(City)
-admin.site.register(Post)
-admin.site.register(Subscription)
 
+admin.site.register(User, UserAdmin)
+admin.site.register(Interest, ReferenceDataAdmin)
+admin.site.register(UserInterest, UserInterestAdmin)
+admin.site.register(Country, ReferenceDataAdmin)
+admin.site.register(City, CityAdmin)
+admin.site.register(Post, PostAdmin)
+admin.site.register(Subscription, SubscriptionAdmin)
+admin.site.register(DeletionJob, DeletionJobAdmin)
+admin.site.register(ProfilingWindow, ProfilingWindowAdmin)
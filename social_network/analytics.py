@@ -0,0 +1,169 @@
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Count, DateTimeField, Value
+from django.db.models.functions import Least, TruncHour
+from django.utils import timezone
+
+from rest_framework import serializers
+
+from .models import Post, Subscription, HourlyActivity, DailyActivity, \
+    RollupWatermark
+
+POSTS = 'posts'
+SUBSCRIPTIONS = 'subscriptions'
+
+# The rolled up tables with the lookup of the Country each row is counted for
+ROLLUP_SOURCES = {
+    POSTS: (Post, 'user__country'),
+    SUBSCRIPTIONS: (Subscription, 'subscribed_to_user__country'),
+}
+
+# The country_id of the totals of all the Countries
+ALL_COUNTRIES = 0
+# The country_id of the Users without a Country
+NO_COUNTRY = -1
+
+# The periods of the rollups, see HourlyActivity and DailyActivity
+ACTIVITY_INTERVALS = ('day', 'hour', )
+
+# The rows younger than this are left for the next run, so the rows
+# committed late with lower ids than the already counted ones are not missed
+ROLLUP_LAG = timedelta(minutes=1)
+
+
+def is_unsettled(created_datetime, now):
+    """
+    Checks if the row is younger than the ROLLUP_LAG, so the rows with the
+    lower ids may still be committed. The rows dated in the future are not,
+    or they would stop the watermarks until their created datetime.
+    """
+    return now - ROLLUP_LAG < created_datetime <= now
+
+
+def roll_up_batch(metric, batch_size=10000):
+    """
+    Counts the next batch of the rows created since the metric's watermark
+    into the hourly and daily rollups.
+
+    The watermark is locked for the whole transaction, so the concurrent
+    runs of the command wait for each other and every row is counted once.
+    Both rollups are only incremented, so the rows imported with an old
+    created datetime are counted as well, and the old hourly rows can be
+    removed without breaking the daily ones. The rows created in the
+    future, such as the mistyped imports, are counted at the current hour.
+
+    Args:
+        metric (str): One of the ROLLUP_SOURCES
+        batch_size (int): The highest number of the rows counted
+
+    Returns:
+        int: The number of the counted rows, 0 once the rollups are up to
+        date.
+    """
+    model, country_lookup = ROLLUP_SOURCES[metric]
+
+    with transaction.atomic():
+        watermark, _ = RollupWatermark.objects.select_for_update(
+        ).get_or_create(metric=metric)
+
+        # Stopping before the first row which is still too young
+        now = timezone.now()
+        last_id, count = watermark.last_id, 0
+        for row_id, created_datetime in model.objects.filter(
+                id__gt=watermark.last_id
+        ).order_by('id').values_list('id', 'created_datetime')[:batch_size]:
+            if is_unsettled(created_datetime, now):
+                break
+            last_id, count = row_id, count + 1
+        if not count:
+            return 0
+
+        hourly = {}
+        rows = model.objects.filter(
+            id__gt=watermark.last_id, id__lte=last_id
+        ).annotate(
+            hour=TruncHour(
+                Least('created_datetime',
+                      Value(now, output_field=DateTimeField())),
+                tzinfo=dt_timezone.utc
+            )
+        ).values_list('hour', country_lookup).annotate(
+            value=Count('id')
+        ).order_by()
+        for hour, country_id, value in rows:
+            for key in ((hour, country_id or NO_COUNTRY),
+                        (hour, ALL_COUNTRIES)):
+                hourly[key] = hourly.get(key, 0) + value
+
+        daily = {}
+        for (hour, country_id), value in hourly.items():
+            key = (timezone.localdate(hour), country_id)
+            daily[key] = daily.get(key, 0) + value
+
+        increment_rollup(HourlyActivity, 'hour', metric, hourly)
+        increment_rollup(DailyActivity, 'day', metric, daily)
+
+        watermark.last_id = last_id
+        watermark.updated_datetime = timezone.now()
+        watermark.save(update_fields=['last_id', 'updated_datetime'])
+        return count
+
+
+def increment_rollup(model, period_field, metric, deltas):
+    """
+    Adds the deltas keyed by the (period, country id) to the rollup rows.
+    Must be called under the metric's watermark lock.
+    """
+    periods = {period for period, _ in deltas}
+    existing = model.objects.filter(
+        metric=metric, **{f'{period_field}__in': periods}
+    ).values_list(period_field, 'country_id', 'value')
+
+    values = dict(deltas)
+    for period, country_id, value in existing:
+        if (period, country_id) in values:
+            values[period, country_id] += value
+
+    model.objects.bulk_create([
+        model(metric=metric, country_id=country_id, value=value,
+              **{period_field: period})
+        for (period, country_id), value in values.items()
+    ], batch_size=1000, update_conflicts=True,
+        unique_fields=['metric', period_field, 'country_id'],
+        update_fields=['value'])
+
+
+def parse_interval(query_params):
+    interval = query_params.get('interval') or 'day'
+    if interval not in ACTIVITY_INTERVALS:
+        raise serializers.ValidationError({
+            'interval': [f'The interval must be one of: '
+                         f'{", ".join(ACTIVITY_INTERVALS)}.']
+        })
+    return interval
+
+
+def parse_limit(query_params, default=10, maximum=100):
+    try:
+        limit = int(query_params.get('limit') or default)
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= maximum:
+        raise serializers.ValidationError({
+            'limit': [f'The limit must be a number from 1 to {maximum}.']
+        })
+    return limit
+
+
+def prune_hourly_activity(days):
+    """
+    Removes the hourly rollups older than the given number of days, which
+    are kept in the daily rollups.
+
+    Returns:
+        int: The number of the removed rows.
+    """
+    before = timezone.now() - timedelta(days=days)
+    deleted, _ = HourlyActivity.objects.filter(hour__lt=before).delete()
+    return deleted
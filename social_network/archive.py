@@ -0,0 +1,397 @@
+import os
+import json
+import struct
+import zlib
+import logging
+from array import array
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+
+
+SEGMENT_MAGIC = b'PSEG1\n'
+
+# The columns of the Post table stored in every segment and their types
+SEGMENT_COLUMNS = (
+    ('id', 'int'),
+    ('user_id', 'int'),
+    ('title', 'str'),
+    ('text', 'str'),
+    ('created_datetime', 'datetime'),
+    ('created_by', 'int'),
+    ('modified_datetime', 'datetime'),
+    ('modified_by', 'int'),
+)
+
+# Stored in the integer columns instead of NULL
+NULL_VALUE = -(2 ** 63)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# The parsed manifests by their path with their modification times
+_manifests = {}
+
+
+def _encode_datetime(value):
+    if value is None:
+        return NULL_VALUE
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _decode_datetime(value):
+    if value == NULL_VALUE:
+        return None
+    return datetime.fromtimestamp(value // 1000000, tz=dt_timezone.utc) \
+        .replace(microsecond=value % 1000000)
+
+
+def _encode_column(values, column_type):
+    """
+    Encodes the column values into bytes.
+
+    The integer and datetime columns are stored as arrays of signed 64-bit
+    integers. The string columns are stored as an array of the end offsets
+    followed by the UTF-8 encoded values.
+    """
+    if column_type == 'int':
+        return array(
+            'q', [NULL_VALUE if v is None else v for v in values]
+        ).tobytes()
+
+    if column_type == 'datetime':
+        return array('q', [_encode_datetime(v) for v in values]).tobytes()
+
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = array('q')
+    end = 0
+    for value in encoded:
+        end += len(value)
+        offsets.append(end)
+    return offsets.tobytes() + b''.join(encoded)
+
+
+def _decode_column(data, column_type, rows):
+    if column_type in ('int', 'datetime'):
+        values = array('q')
+        values.frombytes(data)
+        if column_type == 'datetime':
+            return [_decode_datetime(v) for v in values]
+        return [None if v == NULL_VALUE else v for v in values]
+
+    offsets = array('q')
+    offsets.frombytes(data[:rows * 8])
+    blob = data[rows * 8:]
+    values = []
+    start = 0
+    for end in offsets:
+        values.append(blob[start:end].decode('utf-8'))
+        start = end
+    return values
+
+
+def write_segment(path, rows):
+    """
+    Writes the Post rows into a compressed columnar segment file.
+
+    The file consists of the magic bytes, the length of the JSON header,
+    the JSON header and the zlib compressed columns. The rows are sorted by
+    their User and created datetime and the header keeps the range of the
+    rows of every User and the offset of each column, so the readers skip
+    the segments without the User's Posts after reading the header only and
+    read and decompress only the columns they need.
+
+    Args:
+        path (str): The path of the segment file
+        rows (list): The Post rows as tuples ordered as SEGMENT_COLUMNS
+
+    Returns:
+        dict: The manifest entry describing the segment.
+    """
+    rows = sorted(rows, key=lambda row: (row[1], row[4], row[0]))
+    users = {}
+    for index, row in enumerate(rows):
+        first, count = users.get(row[1], (index, 0))
+        users[row[1]] = (first, count + 1)
+
+    columns = {}
+    blobs = []
+    offset = 0
+    raw_bytes = 0
+    for index, (name, column_type) in enumerate(SEGMENT_COLUMNS):
+        raw = _encode_column([row[index] for row in rows], column_type)
+        compressed = zlib.compress(raw, 6)
+        columns[name] = {
+            'type': column_type,
+            'offset': offset,
+            'length': len(compressed),
+        }
+        blobs.append(compressed)
+        offset += len(compressed)
+        raw_bytes += len(raw)
+
+    header = json.dumps({
+        'rows': len(rows),
+        'columns': columns,
+        'users': {str(user_id): rows_range
+                  for user_id, rows_range in users.items()},
+    }).encode()
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as segment_file:
+        segment_file.write(SEGMENT_MAGIC)
+        segment_file.write(struct.pack('<Q', len(header)))
+        segment_file.write(header)
+        for blob in blobs:
+            segment_file.write(blob)
+        segment_file.flush()
+        os.fsync(segment_file.fileno())
+    os.replace(tmp_path, path)
+
+    created = [row[4] for row in rows]
+    ids = [row[0] for row in rows]
+    return {
+        'file': os.path.basename(path),
+        'rows': len(rows),
+        'min_id': min(ids),
+        'max_id': max(ids),
+        'min_user_id': rows[0][1],
+        'max_user_id': rows[-1][1],
+        'min_created': _encode_datetime(min(created)),
+        'max_created': _encode_datetime(max(created)),
+        'raw_bytes': raw_bytes,
+        'stored_bytes': os.path.getsize(path),
+    }
+
+
+class Segment:
+    """
+    The read-only view of a single segment file, reading only the header
+    and the compressed bytes of the requested columns.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self._file = open(self.path, 'rb')
+        prefix = self._file.read(len(SEGMENT_MAGIC) + 8)
+        if prefix[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+            self.__exit__()
+            raise ValueError(f'{self.path} is not a Post archive segment')
+        header_length, = struct.unpack('<Q', prefix[len(SEGMENT_MAGIC):])
+        self._header = json.loads(self._file.read(header_length))
+        self._data_start = len(prefix) + header_length
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+    @property
+    def rows(self):
+        return self._header['rows']
+
+    def user_rows(self, user_id):
+        """
+        Returns:
+            The indexes of the User's rows.
+        """
+        users = self._header.get('users')
+        if users is None:
+            # The segments written before the rows were sorted by the User
+            return [index for index, value
+                    in enumerate(self.column('user_id')) if value == user_id]
+        first, count = users.get(str(user_id), (0, 0))
+        return range(first, first + count)
+
+    def column(self, name):
+        meta = self._header['columns'][name]
+        self._file.seek(self._data_start + meta['offset'])
+        data = zlib.decompress(self._file.read(meta['length']))
+        return _decode_column(data, meta['type'], self.rows)
+
+
+class PostArchive:
+    """
+    The cold storage of the archived Posts.
+
+    The archive is a directory of the columnar segment files and a
+    manifest.json file which keeps the id, user id and created datetime
+    ranges of each segment, so the reads skip the segments which can not
+    contain the requested Posts without opening them. The Posts are
+    archived in the order of their Users, so every segment holds a narrow
+    range of the Users and a read opens only the few segments of its User.
+    """
+    def __init__(self, directory=None):
+        self.directory = str(directory or settings.POST_ARCHIVE_DIR)
+        self.manifest_path = os.path.join(self.directory, 'manifest.json')
+
+    def load_manifest(self):
+        """
+        Reads the manifest, parsed once per process until the file changes.
+        """
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return {'segments': []}
+
+        # The manifest is replaced by a new file on every change
+        modified = (stat.st_ino, stat.st_mtime_ns)
+        cached = _manifests.get(self.manifest_path)
+        if cached is not None and cached[0] == modified:
+            return cached[1]
+        try:
+            with open(self.manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+        except FileNotFoundError:
+            return {'segments': []}
+        _manifests[self.manifest_path] = (modified, manifest)
+        return manifest
+
+    def _save_manifest(self, manifest):
+        tmp_path = f'{self.manifest_path}.tmp'
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def append(self, rows):
+        """
+        Writes the Post rows, best ordered by their User, into a new segment
+        and registers it in the manifest.
+
+        Returns:
+            dict: The manifest entry describing the new segment.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        ids = [row[0] for row in rows]
+        path = os.path.join(
+            self.directory, f'posts-{min(ids)}-{max(ids)}.seg'
+        )
+        entry = write_segment(path, rows)
+        manifest = dict(self.load_manifest())
+        manifest['segments'] = manifest['segments'] + [entry]
+        self._save_manifest(manifest)
+        return entry
+
+    def remove_user(self, user_id):
+        """
+        Rewrites the segments holding the User's Posts without them and
+        removes the segments left empty, such as when the User's account is
+        deleted. Removing the User's Posts again changes nothing.
+
+        Returns:
+            int: The number of the removed Posts.
+        """
+        manifest = dict(self.load_manifest())
+        segments, emptied, removed = [], [], 0
+        for entry in manifest['segments']:
+            if not entry['min_user_id'] <= user_id <= entry['max_user_id']:
+                segments.append(entry)
+                continue
+
+            path = os.path.join(self.directory, entry['file'])
+            with Segment(path) as segment:
+                matches = set(segment.user_rows(user_id))
+                if not matches:
+                    segments.append(entry)
+                    continue
+                columns = [segment.column(name)
+                           for name, _ in SEGMENT_COLUMNS]
+
+            rows = [row for index, row in enumerate(zip(*columns))
+                    if index not in matches]
+            removed += len(matches)
+            if rows:
+                segments.append(write_segment(path, rows))
+            else:
+                emptied.append(path)
+
+        if removed:
+            manifest['segments'] = segments
+            self._save_manifest(manifest)
+            for path in emptied:
+                os.remove(path)
+        return removed
+
+    def segments(self, user_id, start=None, end=None):
+        """
+        Lists the manifest entries of the segments which may contain the
+        User's Posts created in the given range.
+        """
+        start = None if start is None else _encode_datetime(start)
+        end = None if end is None else _encode_datetime(end)
+        return [
+            entry for entry in self.load_manifest()['segments']
+            if entry['min_user_id'] <= user_id <= entry['max_user_id']
+            and (end is None or entry['min_created'] <= end)
+            and (start is None or entry['max_created'] >= start)
+        ]
+
+    def covers(self, user_id, start=None, end=None):
+        """
+        Checks if the given created datetime range of the User overlaps with
+        any of the archived segments.
+        """
+        return bool(self.segments(user_id, start=start, end=end))
+
+    def read(self, user_id, start=None, end=None, title=None, text=None):
+        """
+        Reads the archived Posts of the User, see iterate().
+
+        Returns:
+            list: The Post rows as dictionaries.
+        """
+        return list(self.iterate(user_id, start=start, end=end, title=title,
+                                 text=text))
+
+    def iterate(self, user_id, start=None, end=None, title=None, text=None):
+        """
+        Reads the archived Posts of the User one segment at a time, so only
+        the columns of a single segment are held in the memory.
+
+        Args:
+            user_id (int): The id of the User
+            start (datetime): The lowest created datetime, inclusive
+            end (datetime): The highest created datetime, inclusive
+            title (str): The case-insensitive part of the title
+            text (str): The case-insensitive part of the text
+
+        Yields:
+            dict: The Post row.
+        """
+        title = title.lower() if title else None
+        text = text.lower() if text else None
+
+        for entry in self.segments(user_id, start=start, end=end):
+            path = os.path.join(self.directory, entry['file'])
+            try:
+                with Segment(path) as segment:
+                    matches = segment.user_rows(user_id)
+                    if not matches:
+                        continue
+                    columns = {
+                        name: segment.column(name)
+                        for name, _ in SEGMENT_COLUMNS
+                        if name != 'user_id'
+                    }
+            except (OSError, ValueError) as e:
+                logging.error(
+                    msg=f'Failed to read the Post archive segment {path} {e}',
+                    stacklevel=logging.CRITICAL
+                )
+                continue
+
+            for index in matches:
+                post = {name: values[index] for name, values in columns.items()}
+                post['user_id'] = user_id
+                created = post['created_datetime']
+                if start is not None and created < start:
+                    continue
+                if end is not None and created > end:
+                    continue
+                if title and title not in post['title'].lower():
+                    continue
+                if text and text not in post['text'].lower():
+                    continue
+                yield post
@@ -0,0 +1,210 @@
+import time
+import base64
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.crypto import salted_hmac, constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, \
+    BaseAuthentication, get_authorization_header
+
+from .models import AuthToken
+
+from django.contrib.auth import get_user_model
+User = get_user_model()
+
+ACCESS_TOKEN_SALT = 'social_network.authentication.access_token'
+
+
+class ExpiringTokenAuthentication(TokenAuthentication):
+    """
+    Authenticates the requests with the per-device AuthToken.
+
+    The token is looked up by its unique key together with its User in a
+    single query. The expiring tokens are extended on use by the AUTH_TOKEN
+    TTL, at most once per its REFRESH_INTERVAL, so the active clients stay
+    logged in without a write on every request.
+    """
+    model = AuthToken
+
+    def authenticate_credentials(self, key):
+        try:
+            token = AuthToken.objects.select_related('user').get(key=key)
+        except AuthToken.DoesNotExist:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        if token.expires_datetime is not None:
+            now = timezone.now()
+            if token.expires_datetime <= now:
+                raise exceptions.AuthenticationFailed('Token has expired.')
+
+            ttl = settings.AUTH_TOKEN['TTL']
+            refresh_interval = settings.AUTH_TOKEN['REFRESH_INTERVAL']
+            if ttl and token.expires_datetime - now < ttl - refresh_interval:
+                token.expires_datetime = now + ttl
+                AuthToken.objects.filter(id=token.id).update(
+                    expires_datetime=token.expires_datetime
+                )
+
+        return token.user, token
+
+
+class SignedAccessToken:
+    """
+    The short-lived access token carrying the User's id, device, issue and
+    expiry times in milliseconds, signed with the SECRET_KEY.
+    """
+    def __init__(self, user_id, device, issued, expires):
+        self.user_id = user_id
+        self.device = device
+        self.issued = issued
+        self.expires = expires
+
+    @staticmethod
+    def sign(value):
+        return salted_hmac(
+            ACCESS_TOKEN_SALT, value, algorithm='sha256'
+        ).hexdigest()
+
+    @classmethod
+    def issue(cls, user_id, device='default'):
+        now = int(time.time() * 1000)
+        ttl = settings.SIGNED_TOKEN_AUTH['ACCESS_TTL']
+        return cls(user_id, device, now,
+                   now + int(ttl.total_seconds() * 1000))
+
+    @classmethod
+    def parse(cls, key):
+        """
+        Verifies the signature and decodes the access token.
+
+        Returns:
+            SignedAccessToken: The token or None if its signature is invalid.
+        """
+        value, _, signature = key.rpartition('.')
+        if not value or not constant_time_compare(signature, cls.sign(value)):
+            return None
+        user_id, device, issued, expires = value.split(':')
+        return cls(int(user_id), base64.urlsafe_b64decode(device).decode(),
+                   int(issued), int(expires))
+
+    @property
+    def key(self):
+        device = base64.urlsafe_b64encode(self.device.encode()).decode()
+        value = f'{self.user_id}:{device}:{self.issued}:{self.expires}'
+        return f'{value}.{self.sign(value)}'
+
+
+def revocation_cache_key(user_id):
+    return f'auth-revoked:{user_id}'
+
+
+def revoke_access_tokens(user_id):
+    """
+    Revokes all the access tokens issued to the User until now.
+
+    Instead of keeping every revoked token, only the time of the User's
+    last revocation is kept, and only until the longest-lived access token
+    issued before it expires. It is kept in the shared cache, so the logout
+    takes effect in the other workers once their copies of the revocations
+    expire, within the revocations cache's TIMEOUT, and in this one at once.
+    """
+    ttl = settings.SIGNED_TOKEN_AUTH['ACCESS_TTL']
+    revoked = int(time.time() * 1000)
+    caches['shared'].set(revocation_cache_key(user_id), revoked,
+                         int(ttl.total_seconds()) + 1)
+    caches['revocations'].set(revocation_cache_key(user_id), revoked)
+
+
+def get_revocation(user_id):
+    """
+    Reads the time of the User's last revocation, kept for the TIMEOUT of
+    the revocations cache in the worker's memory, so the shared cache, on
+    the database without Redis, is not read on every request.
+
+    Returns:
+        int: The time in milliseconds or None if the User has no
+        revocations.
+    """
+    key = revocation_cache_key(user_id)
+    revoked = caches['revocations'].get(key)
+    if revoked is None:
+        revoked = caches['shared'].get(key) or 0
+        caches['revocations'].set(key, revoked)
+    return revoked or None
+
+
+class SignedTokenUser(SimpleLazyObject):
+    """
+    The User authenticated by the access token, loaded from the database
+    only when the view needs more than its id.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id):
+        self.__dict__['_user_id'] = user_id
+        super().__init__(lambda: self.load_user(user_id))
+
+    @staticmethod
+    def load_user(user_id):
+        # The User deleted or deactivated after the token has been issued
+        try:
+            return User.objects.get(id=user_id, is_active=True)
+        except User.DoesNotExist:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+    def __bool__(self):
+        return True
+
+    @property
+    def id(self):
+        return self.__dict__['_user_id']
+
+    pk = id
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """
+    Authenticates the requests with the short-lived signed access tokens
+    sent as: Authorization: Bearer <access token>
+
+    Validating the token costs only a signature check and a lookup of the
+    User's last revocation time, see get_revocation(). The access tokens
+    are obtained from the refresh endpoint with the AuthToken key as the
+    refresh token.
+    """
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+
+        try:
+            token = SignedAccessToken.parse(auth[1].decode())
+        except (UnicodeError, ValueError):
+            token = None
+        if token is None:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+
+        if token.expires <= time.time() * 1000:
+            raise exceptions.AuthenticationFailed('Token has expired.')
+
+        revoked = get_revocation(token.user_id)
+        if revoked is not None and token.issued <= revoked:
+            raise exceptions.AuthenticationFailed('Token has been revoked.')
+
+        return SignedTokenUser(token.user_id), token
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -0,0 +1,177 @@
+import io
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpRequest, QueryDict, Http404
+from django.urls import resolve
+
+from rest_framework.views import APIView
+
+# The highest number of the sub-requests of a single batch request
+BATCH_MAX_REQUESTS = 20
+
+# The highest number of the reads of a batch run at the same time
+BATCH_MAX_WORKERS = 4
+
+# The response headers passed back with the sub-responses
+BATCH_RESPONSE_HEADERS = ('ETag', 'Last-Modified', 'Location', 'Retry-After')
+
+READ_METHODS = ('GET', 'HEAD', )
+
+# The headers of the batch request kept in the sub-requests, the others,
+# such as the Authorization and the Cookie, are not used by them
+BATCH_SHARED_HEADERS = ('HTTP_HOST', 'HTTP_USER_AGENT', 'HTTP_X_FORWARDED_FOR')
+
+# The only headers the clients can set on the sub-requests, so they cannot
+# override the shared ones, such as the client's IP the throttling reads
+BATCH_REQUEST_HEADERS = ('If-None-Match', 'If-Modified-Since',
+                         'Accept-Language', )
+
+
+def build_sub_request(request, method, path, body=None, headers=None):
+    """
+    Builds the HttpRequest of the sub-request, authenticated as the batch
+    request was, so the token is not looked up again. Only the
+    BATCH_REQUEST_HEADERS of the given headers are set.
+    """
+    url = urlsplit(path)
+    sub_request = HttpRequest()
+    sub_request.method = method
+    sub_request.path = sub_request.path_info = url.path
+    sub_request.META = {
+        key: value for key, value in request.META.items()
+        if not key.startswith('HTTP_') or key in BATCH_SHARED_HEADERS
+    }
+    sub_request.META.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'HTTP_ACCEPT': 'application/json',
+        'CONTENT_TYPE': 'application/json',
+    })
+    allowed = {name.lower() for name in BATCH_REQUEST_HEADERS}
+    for name, value in (headers or {}).items():
+        if name.lower() in allowed:
+            key = f'HTTP_{name.upper().replace("-", "_")}'
+            sub_request.META[key] = value
+
+    payload = json.dumps(body).encode('utf-8') if body is not None else b''
+    sub_request._body = payload
+    sub_request._stream = io.BytesIO(payload)
+    sub_request._read_started = False
+    sub_request.META['CONTENT_LENGTH'] = str(len(payload))
+    sub_request.GET = QueryDict(url.query)
+
+    # Read by rest_framework.request.Request instead of the authenticators
+    sub_request._force_auth_user = request.user
+    sub_request._force_auth_token = request.auth
+    return sub_request
+
+
+def resolve_api_view(path):
+    """
+    Resolves the path of the sub-request into one of the API views.
+
+    Raises:
+        Http404: If the path is not of an API view or is of the batch view.
+    """
+    url_path = urlsplit(path).path
+    if not url_path.startswith(settings.API_URL_PREFIX):
+        raise Http404(path)
+
+    match = resolve(url_path)
+    view_class = getattr(match.func, 'view_class', None)
+    if view_class is None or not issubclass(view_class, APIView) \
+            or not getattr(view_class, 'batchable', True):
+        raise Http404(path)
+    return match
+
+
+def dispatch_sub_request(request, sub_request_data):
+    """
+    Runs the sub-request through its API view.
+
+    Returns:
+        dict: The status, the headers and the body of the sub-response.
+    """
+    path = sub_request_data['path']
+    try:
+        match = resolve_api_view(path)
+        sub_request = build_sub_request(
+            request, sub_request_data['method'], path,
+            sub_request_data.get('body'), sub_request_data.get('headers')
+        )
+        sub_request.resolver_match = match
+        response = match.func(sub_request, *match.args, **match.kwargs)
+    except Http404:
+        return {'status': 404, 'headers': {},
+                'body': {'detail': 'Not found.'}}
+    except Exception as e:
+        logging.error(msg=f'Batch sub-request {path} failed: {e}',
+                      stacklevel=logging.CRITICAL)
+        return {'status': 500, 'headers': {},
+                'body': {'detail': 'Internal server error.'}}
+
+    if response.streaming:
+        return {'status': 400, 'headers': {},
+                'body': {'detail': 'The streaming responses are not '
+                                   'supported in the batch.'}}
+
+    if hasattr(response, 'render'):
+        response.render()
+    body = None
+    if response.content:
+        try:
+            body = json.loads(response.content)
+        except ValueError:
+            body = response.content.decode('utf-8', errors='replace')
+
+    return {
+        'status': response.status_code,
+        'headers': {name: response[name] for name in BATCH_RESPONSE_HEADERS
+                    if response.has_header(name)},
+        'body': body,
+    }
+
+
+def dispatch_batch(request, sub_requests, parallel=False):
+    """
+    Runs the sub-requests of the batch in their order.
+
+    With parallel the batch of reads only runs them at the same time, each
+    thread with its own database connection. The batches with any writes
+    run one sub-request after another, so the reads see the writes before
+    them. The checked or profiled batches run one after another as well,
+    as the queries of the other threads' connections are not recorded.
+
+    Returns:
+        list: The sub-responses in the order of the sub-requests.
+    """
+    reads_only = all(sub_request['method'] in READ_METHODS
+                     for sub_request in sub_requests)
+    recorded = getattr(request, '_query_recorder', None) is not None \
+        or getattr(request, '_profiler', None) is not None
+    if not parallel or not reads_only or recorded or len(sub_requests) < 2:
+        responses = []
+        for sub_request in sub_requests:
+            responses.append(dispatch_sub_request(request, sub_request))
+            if sub_request['method'] not in READ_METHODS:
+                # The conditional GETs after the write need its new version
+                request.user.refresh_from_db(
+                    fields=['version', 'modified_datetime']
+                )
+        return responses
+
+    def run(sub_request):
+        try:
+            return dispatch_sub_request(request, sub_request)
+        finally:
+            connection.close()
+
+    workers = min(BATCH_MAX_WORKERS, len(sub_requests))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run, sub_requests))
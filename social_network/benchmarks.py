@@ -0,0 +1,662 @@
+import os
+import subprocess
+import sys
+import time
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.test import APIRequestFactory, APIClient
+from rest_framework.views import APIView
+
+# The benchmarks run by the benchmark management command keyed by name
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """
+    Registers the function as a benchmark.
+
+    The benchmark receives the number of iterations and returns the list of
+    the (label, value) rows to report.
+    """
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def measure(func, iterations):
+    """
+    Runs the function the given number of times.
+
+    Returns:
+        tuple: The average time of a single call in microseconds and the
+        number of the database queries of all the calls.
+    """
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed = time.perf_counter() - started
+    return elapsed / iterations * 1000000, len(queries)
+
+
+@benchmark('throttle')
+def throttle_benchmark(iterations):
+    from .models import User
+    from .throttling import TokenBucketThrottle, LocalBucketStore
+
+    throttle = TokenBucketThrottle()
+    throttle.store = LocalBucketStore()
+    throttle.config = {
+        **throttle.config, 'ENABLED': True, 'CAPACITY': float('inf')
+    }
+    view = APIView()
+
+    django_request = APIRequestFactory().get('/api/posts/')
+    request = view.initialize_request(django_request)
+    request.user = User(id=1)
+    request._request.resolver_match = None
+
+    per_call, queries = measure(
+        lambda: throttle.allow_request(request, view), iterations
+    )
+    return [
+        ('throttle check', f'{per_call:.2f} us'),
+        ('database queries', queries),
+    ]
+
+
+@benchmark('conditional-get')
+def conditional_get_benchmark(iterations):
+    from django.conf import settings
+    from django.db.models import Count
+    from django.test.utils import override_settings
+    from .models import User
+
+    user = User.objects.annotate(
+        number_of_posts=Count('posts')
+    ).order_by('-number_of_posts').first()
+    if user is None:
+        return [('skipped', 'no Users in the database')]
+
+    client = APIClient()
+    client.force_authenticate(user)
+    iterations = max(1, iterations // 100)
+
+    paths = ('/api/my-profile/', '/api/posts/', '/api/my-profile-details/')
+    rows = []
+    # The throttled 429 responses would be measured instead of the views
+    with override_settings(THROTTLING={**settings.THROTTLING,
+                                       'ENABLED': False}):
+        for path in paths:
+            response = client.get(path)
+            etag = response['ETag']
+            full, full_queries = measure(lambda: client.get(path), iterations)
+            not_modified, not_modified_queries = measure(
+                lambda: client.get(path, HTTP_IF_NONE_MATCH=etag), iterations
+            )
+            rows += [
+                (f'{path} 200', f'{full:.0f} us, '
+                                f'{len(response.content)} bytes, '
+                                f'{full_queries // iterations} queries'),
+                (f'{path} 304', f'{not_modified:.0f} us, 0 bytes, '
+                                f'{not_modified_queries // iterations} '
+                                f'queries'),
+            ]
+    return rows
+
+
+def legacy_create_or_update_auth_token(user):
+    """
+    The Token rotation used before the per-device AuthTokens, kept for the
+    comparison in the login benchmark.
+    """
+    import hashlib
+    from rest_framework.authtoken.models import Token
+
+    token = Token.objects.filter(user=user)
+    if not token:
+        return Token.objects.get_or_create(user=user)
+    token = Token.objects.filter(user=user)
+    new_key = token[0].generate_key()
+    first_level_value = hashlib.sha1(new_key.encode('utf-8')).hexdigest()
+    second_level_value = hashlib.md5(
+        first_level_value.encode('utf-8')
+    ).hexdigest()
+    token.update(key=second_level_value)
+    return token
+
+
+@benchmark('login')
+def login_benchmark(iterations):
+    from django.db import transaction
+    from .models import User
+    from .token_generator import create_or_update_auth_token
+
+    user = User.objects.order_by('id').first()
+    if user is None:
+        return [('skipped', 'no Users in the database')]
+
+    iterations = max(1, iterations // 10)
+    rows = []
+    # Rolling back, so the benchmark does not log out the User
+    with transaction.atomic():
+        for label, issue_token in (
+                ('legacy Token rotation', legacy_create_or_update_auth_token),
+                ('AuthToken upsert', create_or_update_auth_token)):
+            issue_token(user)
+            per_call, queries = measure(lambda: issue_token(user), iterations)
+            rows.append((label, f'{per_call:.0f} us, '
+                                f'{queries / iterations:.0f} queries'))
+        transaction.set_rollback(True)
+    return rows
+
+
+@benchmark('auth')
+def auth_benchmark(iterations):
+    from django.db import transaction
+    from .authentication import ExpiringTokenAuthentication, \
+        SignedTokenAuthentication, SignedAccessToken
+    from .models import User
+    from .token_generator import create_or_update_auth_token
+
+    user = User.objects.order_by('id').first()
+    if user is None:
+        return [('skipped', 'no Users in the database')]
+
+    factory = APIRequestFactory()
+    rows = []
+    with transaction.atomic():
+        token = create_or_update_auth_token(user, device='benchmark')
+        access_token = SignedAccessToken.issue(user.id)
+        for label, authentication, header in (
+                ('AuthToken lookup', ExpiringTokenAuthentication(),
+                 f'Token {token.key}'),
+                ('signed access token', SignedTokenAuthentication(),
+                 f'Bearer {access_token.key}')):
+            request = factory.get('/api/posts/', HTTP_AUTHORIZATION=header)
+            per_call, queries = measure(
+                lambda: authentication.authenticate(request), iterations
+            )
+            rows.append((label, f'{per_call:.1f} us, '
+                                f'{queries / iterations:.0f} queries'))
+        transaction.set_rollback(True)
+    return rows
+
+
+@benchmark('middleware')
+def middleware_benchmark(iterations):
+    from django.conf import settings
+    from django.db import transaction
+    from django.test import Client
+    from django.test.utils import override_settings
+    from .authentication import SignedAccessToken
+    from .models import User
+    from .token_generator import create_or_update_auth_token
+
+    user = User.objects.filter(is_active=True).order_by('id').first()
+    if user is None:
+        return [('skipped', 'no Users in the database')]
+
+    iterations = max(1, iterations // 10)
+    default_middleware = [
+        {value: key for key, value
+         in settings.TOKEN_ONLY_API_MIDDLEWARE.items()}.get(middleware,
+                                                            middleware)
+        for middleware in settings.MIDDLEWARE
+    ]
+    token_only_middleware = [
+        settings.TOKEN_ONLY_API_MIDDLEWARE.get(middleware, middleware)
+        for middleware in default_middleware
+    ]
+
+    rows = []
+    with transaction.atomic():
+        token = create_or_update_auth_token(user, device='benchmark')
+        if settings.SIGNED_TOKEN_AUTH['ENABLED']:
+            header = f'Bearer {SignedAccessToken.issue(user.id).key}'
+        else:
+            header = f'Token {token.key}'
+
+        # The throttled 429 responses would be measured instead of the view
+        throttling = {**settings.THROTTLING, 'ENABLED': False}
+        for label, middleware in (('session middleware', default_middleware),
+                                  ('token-only API', token_only_middleware)):
+            with override_settings(MIDDLEWARE=middleware,
+                                   THROTTLING=throttling):
+                client = Client(HTTP_AUTHORIZATION=header)
+                per_call, queries = measure(
+                    lambda: client.get('/api/my-profile/'), iterations
+                )
+            rows.append((label, f'{per_call:.0f} us per request, '
+                                f'{queries / iterations:.1f} queries'))
+        transaction.set_rollback(True)
+    return rows
+
+
+def parse_importtime(output):
+    """
+    Parses the output of python -X importtime.
+
+    Returns:
+        list: The (module, self microseconds, cumulative microseconds,
+        nesting depth) tuples in the import order.
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append(
+            (name.strip(), int(self_us), int(cumulative_us), depth)
+        )
+    return imports
+
+
+def run_python(code, *flags):
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, *flags, '-c', code],
+        capture_output=True, text=True, env=os.environ.copy(), check=True
+    )
+    return time.perf_counter() - started, result.stderr
+
+
+@benchmark('importtime')
+def importtime_benchmark(iterations):
+    from django.conf import settings
+
+    rows = []
+    for label, code in (
+            ('django.setup()', 'import django; django.setup()'),
+            ('django.setup() and URLs',
+             'import django; django.setup(); '
+             f'import {settings.ROOT_URLCONF}')):
+        runs = sorted(run_python(code)[0] for _ in range(5))
+        rows.append((f'{label} wall time', f'{runs[2] * 1000:.0f} ms'))
+
+        _, output = run_python(code, '-X', 'importtime')
+        imports = parse_importtime(output)
+        top_level = [entry for entry in imports if entry[3] == 0]
+        rows.append((f'{label} imports',
+                     f'{len(imports)} modules, '
+                     f'{sum(entry[2] for entry in top_level) / 1000:.0f} ms'))
+
+        # The self time summed by the top-level package shows which of
+        # the packages are worth loading lazily
+        packages = {}
+        for name, self_us, _, _ in imports:
+            package = name.split('.')[0]
+            packages[package] = packages.get(package, 0) + self_us
+        for package, self_us in sorted(
+                packages.items(), key=lambda item: -item[1])[:10]:
+            rows.append((f'  {package}', f'{self_us / 1000:.1f} ms'))
+    return rows
+
+
+@benchmark('shape')
+def shape_benchmark(iterations):
+    from django.conf import settings
+    from django.db.models import Count
+    from django.test.utils import override_settings
+    from .models import User
+
+    user = User.objects.annotate(
+        number_of_posts=Count('posts')
+    ).order_by('-number_of_posts').first()
+    if user is None:
+        return [('skipped', 'no Users in the database')]
+
+    client = APIClient()
+    client.force_authenticate(user)
+    iterations = max(1, iterations // 100)
+
+    rows = []
+    # The throttled 429 responses would be measured instead of the views
+    with override_settings(THROTTLING={**settings.THROTTLING,
+                                       'ENABLED': False}):
+        for path in ('/api/posts/', '/api/my-subscriptions/'):
+            for shape in ('legacy', 'compact'):
+                url = f'{path}?shape={shape}'
+                response = client.get(url)
+                per_call, queries = measure(lambda: client.get(url),
+                                            iterations)
+                rows.append((url, f'{per_call:.0f} us, '
+                                  f'{len(response.content)} bytes, '
+                                  f'{queries // iterations} queries'))
+    return rows
+
+
+@benchmark('subscribe')
+def subscribe_benchmark(iterations):
+    from concurrent.futures import ThreadPoolExecutor
+    from .models import User, Subscription, UserCounterShard
+    from .subscriptions import subscribe, unsubscribe, MAX_SUBSCRIPTIONS, \
+        SUBSCRIBED
+
+    User.objects.bulk_create([
+        User(username=f'benchmark-subscriber-{index}') for index in range(8)
+    ])
+    User.objects.bulk_create([
+        User(username=f'benchmark-target-{index}')
+        for index in range(MAX_SUBSCRIPTIONS + 20)
+    ])
+    subscribers = list(User.objects.filter(
+        username__startswith='benchmark-subscriber-'
+    ))
+    targets = list(User.objects.filter(
+        username__startswith='benchmark-target-'
+    ))
+
+    def run(subscriber):
+        try:
+            return [subscribe(subscriber.id, target.id)[0]
+                    for target in targets]
+        finally:
+            connection.close()
+
+    rows = []
+    try:
+        # SQLite allows a single writer only
+        concurrency = (1, 8) if connection.vendor == 'postgresql' else (1, )
+        for workers in concurrency:
+            Subscription.objects.filter(user__in=subscribers).delete()
+            # Every thread subscribes its own User to all the targets, over
+            # the limit
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                started = time.perf_counter()
+                results = [
+                    result for results in executor.map(
+                        run, subscribers[:workers]
+                    ) for result in results
+                ]
+                elapsed = time.perf_counter() - started
+
+            capped = all(
+                Subscription.objects.filter(user=subscriber).count()
+                <= MAX_SUBSCRIPTIONS for subscriber in subscribers
+            )
+            rows.append((
+                f'subscribe, {workers} threads',
+                f'{len(results) / elapsed:.0f} per second, '
+                f'{results.count(SUBSCRIBED)} subscribed, '
+                f'limit {"held" if capped else "EXCEEDED"}'
+            ))
+
+        started = time.perf_counter()
+        for target in targets:
+            unsubscribe(subscribers[0].id, target.id)
+        elapsed = time.perf_counter() - started
+        rows.append(('unsubscribe',
+                     f'{len(targets) / elapsed:.0f} per second'))
+    finally:
+        users = subscribers + targets
+        Subscription.objects.filter(user__in=users).delete()
+        Subscription.objects.filter(subscribed_to_user__in=users).delete()
+        UserCounterShard.objects.filter(user__in=users).delete()
+        User.objects.filter(id__in=[user.id for user in users]).delete()
+    return rows
+
+
+@benchmark('counters')
+def counters_benchmark(iterations):
+    from concurrent.futures import ThreadPoolExecutor
+    from django.conf import settings
+    from django.test.utils import override_settings
+    from .models import User, Subscription, UserCounterShard
+    from .counters import SUBSCRIBERS, get_counter, compact_counters
+    from .subscriptions import subscribe, SUBSCRIBED
+
+    # SQLite allows a single writer only
+    threads = 16 if connection.vendor == 'postgresql' else 1
+    count = max(threads, iterations // 10) // threads * threads
+    celebrity = User.objects.create(username='benchmark-celebrity')
+    User.objects.bulk_create([
+        User(username=f'benchmark-follower-{index}')
+        for index in range(count)
+    ])
+    followers = list(User.objects.filter(
+        username__startswith='benchmark-follower-'
+    ).values_list('id', flat=True))
+
+    def run(user_ids):
+        try:
+            return [subscribe(user_id, celebrity.id)[0]
+                    for user_id in user_ids]
+        finally:
+            connection.close()
+
+    rows = []
+    try:
+        for shards in (1, 4, 16):
+            Subscription.objects.filter(subscribed_to_user=celebrity).delete()
+            UserCounterShard.objects.filter(user=celebrity).delete()
+            # Every thread subscribes its own followers to the celebrity
+            chunks = [followers[index::threads] for index in range(threads)]
+            with override_settings(COUNTERS={**settings.COUNTERS,
+                                             'SHARDS': shards}):
+                with ThreadPoolExecutor(max_workers=threads) as executor:
+                    started = time.perf_counter()
+                    results = [result for results in executor.map(run, chunks)
+                               for result in results]
+                    elapsed = time.perf_counter() - started
+
+            compact_counters(celebrity.id, celebrity.id + 1)
+            rows.append((
+                f'subscribe, {shards} shards, {threads} threads',
+                f'{count / elapsed:.0f} per second, '
+                f'{results.count(SUBSCRIBED)} subscribed, counted '
+                f'{get_counter(celebrity.id, SUBSCRIBERS)} of {count}'
+            ))
+    finally:
+        users = followers + [celebrity.id]
+        Subscription.objects.filter(subscribed_to_user=celebrity).delete()
+        UserCounterShard.objects.filter(user__in=users).delete()
+        User.objects.filter(id__in=users).delete()
+    return rows
+
+
+@benchmark('admin')
+def admin_benchmark(iterations):
+    from django.test import Client
+    from .models import User
+
+    admin_user = User.objects.filter(is_superuser=True, is_active=True).first()
+    if admin_user is None:
+        return [('skipped', 'no superusers in the database')]
+
+    client = Client()
+    client.force_login(admin_user)
+    iterations = max(1, iterations // 100)
+
+    rows = []
+    for path in ('/admin/social_network/post/',
+                 '/admin/social_network/subscription/',
+                 '/admin/social_network/userinterest/',
+                 '/admin/social_network/user/',
+                 '/admin/social_network/post/?q=a'):
+        response = client.get(path)
+        if response.status_code != 200:
+            rows.append((path, f'status {response.status_code}'))
+            continue
+        per_call, queries = measure(lambda: client.get(path), iterations)
+        rows.append((path, f'{per_call / 1000:.1f} ms, '
+                           f'{queries // iterations} queries'))
+    return rows
+
+
+@benchmark('trending')
+def trending_benchmark(iterations):
+    from django.utils import timezone
+    from .models import Post, User
+    from .trending import refresh_trending, rebuild_trending
+
+    author = User.objects.order_by('id').first()
+    if author is None:
+        return [('skipped', 'no Users in the database')]
+
+    rows = []
+    started = time.perf_counter()
+    count = rebuild_trending()
+    rows.append(('rebuild', f'{(time.perf_counter() - started) * 1000:.1f} '
+                            f'ms, {count} Posts read'))
+
+    created = max(1, iterations // 10)
+    now = timezone.now()
+    posts = Post.objects.bulk_create([
+        Post(user=author, title=f'benchmark {index}', text='benchmark',
+             created_datetime=now, created_by=author.id)
+        for index in range(created)
+    ])
+    try:
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            while refresh_trending():
+                pass
+        rows.append((
+            f'refresh with {created} new Posts',
+            f'{(time.perf_counter() - started) * 1000:.1f} ms, '
+            f'{len(queries)} queries'
+        ))
+
+        client = APIClient()
+        client.force_authenticate(author)
+        iterations = max(1, iterations // 100)
+        for url in ('/api/trending/?limit=20', '/api/trending/?limit=100'):
+            per_call, queries = measure(lambda: client.get(url), iterations)
+            rows.append((url, f'{per_call:.0f} us, '
+                              f'{queries // iterations} queries'))
+    finally:
+        Post.objects.filter(id__in=[post.id for post in posts]).delete()
+        rebuild_trending()
+    return rows
+
+
+@benchmark('users-batch')
+def users_batch_benchmark(iterations):
+    from django.conf import settings
+    from django.test.utils import override_settings
+    from .models import User
+
+    users = list(User.objects.filter(is_active=True).order_by('id')[:100])
+    if not users:
+        return [('skipped', 'no Users in the database')]
+
+    client = APIClient()
+    client.force_authenticate(users[0])
+    ids = ','.join(str(user.id) for user in users)
+    iterations = max(1, iterations // 1000)
+
+    def single_calls(path):
+        return lambda: [client.get(path(user)) for user in users]
+
+    cases = (
+        (f'1 batch call of {len(users)} profiles',
+         lambda: client.get(f'/api/users/batch/?ids={ids}')),
+        (f'{len(users)} user-interests calls',
+         single_calls(lambda user: f'/api/user-interests/{user.id}/')),
+        (f'1 detailed batch call of {len(users)} profiles',
+         lambda: client.get(f'/api/users/batch/?ids={ids}&detailed=1')),
+        (f'{len(users)} users calls',
+         single_calls(lambda user: f'/api/users/?username={user.username}')),
+    )
+
+    rows = []
+    with override_settings(THROTTLING={**settings.THROTTLING,
+                                       'ENABLED': False}):
+        for label, func in cases:
+            func()
+            per_call, queries = measure(func, iterations)
+            rows.append((label, f'{per_call / 1000:.1f} ms, '
+                                f'{queries // iterations} queries'))
+    return rows
+
+
+@benchmark('batch')
+def batch_benchmark(iterations):
+    import json
+    from django.conf import settings
+    from django.test import Client
+    from django.test.utils import override_settings
+    from .models import User, AuthToken
+    from .token_generator import create_or_update_auth_token
+
+    user = User.objects.filter(is_active=True).order_by('id').first()
+    if user is None:
+        return [('skipped', 'no Users in the database')]
+
+    # The opening screen of the mobile clients
+    paths = ('/api/my-profile/', '/api/my-profile-details/', '/api/posts/',
+             '/api/my-subscriptions/')
+    token = create_or_update_auth_token(user, device='benchmark')
+    client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+    iterations = max(1, iterations // 100)
+
+    def batch(parallel):
+        payload = json.dumps({
+            'requests': [{'method': 'GET', 'path': path} for path in paths],
+            'parallel': parallel,
+        })
+        return lambda: client.post('/api/batch/', payload,
+                                   content_type='application/json')
+
+    # The queries of the parallel batch run in the other threads' connections
+    cases = (
+        (f'{len(paths)} separate requests',
+         lambda: [client.get(path) for path in paths], True),
+        ('1 batch request', batch(False), True),
+        ('1 parallel batch request', batch(True), False),
+    )
+
+    rows = []
+    try:
+        with override_settings(THROTTLING={**settings.THROTTLING,
+                                           'ENABLED': False}):
+            for label, func, queries_counted in cases:
+                func()
+                per_call, queries = measure(func, iterations)
+                result = f'{per_call / 1000:.1f} ms per screen'
+                if queries_counted:
+                    result += f', {queries // iterations} queries'
+                rows.append((label, result))
+    finally:
+        AuthToken.objects.filter(key=token.key).delete()
+    return rows
+
+
+@benchmark('profiling')
+def profiling_benchmark(iterations):
+    import tempfile
+    from django.conf import settings
+    from django.test.utils import override_settings
+    from .models import User
+
+    user = User.objects.filter(is_staff=True, is_active=True).first()
+    if user is None:
+        return [('skipped', 'no staff Users in the database')]
+
+    client = APIClient()
+    client.force_authenticate(user)
+    iterations = max(1, iterations // 1000)
+
+    cases = [('not profiled', {}, settings.PROFILING['INTERVAL'])]
+    for interval in (0.005, 0.001):
+        cases.append((f'profiled every {interval * 1000:g} ms',
+                      {'HTTP_X_PROFILE': '1'}, interval))
+
+    rows = []
+    with tempfile.TemporaryDirectory() as directory, override_settings(
+            THROTTLING={**settings.THROTTLING, 'ENABLED': False},
+            PROFILE_DIR=directory):
+        for label, headers, interval in cases:
+            with override_settings(PROFILING={**settings.PROFILING,
+                                              'INTERVAL': interval}):
+                def func():
+                    return client.get('/api/users/', **headers)
+                func()
+                per_call, _ = measure(func, iterations)
+            rows.append((label, f'{per_call / 1000:.1f} ms per request'))
+    return rows
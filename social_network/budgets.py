@@ -0,0 +1,212 @@
+import random
+import time
+
+from django.conf import settings
+
+
+class QueryBudgetExceeded(Exception):
+    """
+    Raised when the view runs more queries or takes more time than its
+    budget while the budgets are enforced, such as in the test suite.
+    """
+
+
+def get_budget(view_class, method, name='query_budget'):
+    """
+    Reads the budget the view declares for the HTTP method.
+
+    The budget is either a number applying to all the methods or a
+    dictionary keyed by the methods, for example:
+
+        query_budget = {'GET': 4, 'PUT': 8}
+        time_budget = 0.5
+
+    Returns:
+        The budget or None if the view declares none.
+    """
+    budget = getattr(view_class, name, None)
+    if isinstance(budget, dict):
+        return budget.get(method)
+    return budget
+
+
+class QueryRecorder:
+    """
+    The database execute wrapper recording the SQL of the queries.
+    """
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+
+class BudgetCheck:
+    """
+    The queries and the time of a single request compared to the budgets of
+    its view.
+    """
+    def __init__(self, view_class, method):
+        self.view_name = f'{view_class.__module__}.{view_class.__name__}'
+        self.method = method
+        self.query_budget = get_budget(view_class, method, 'query_budget')
+        self.time_budget = get_budget(view_class, method, 'time_budget')
+        self.recorder = None
+        self.first_query = 0
+        self.started = None
+        self.elapsed = None
+
+    @property
+    def declared(self):
+        return self.query_budget is not None or self.time_budget is not None
+
+    def start(self, recorder):
+        self.recorder = recorder
+        self.first_query = len(recorder.queries)
+        self.started = time.perf_counter()
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.started
+        self.queries = self.recorder.queries[self.first_query:]
+
+    def violations(self):
+        """
+        Must be called after the check has been stopped.
+
+        Returns:
+            list: The descriptions of the exceeded budgets.
+        """
+        violations = []
+        queries, elapsed = self.queries, self.elapsed
+        if self.query_budget is not None and len(queries) > self.query_budget:
+            violations.append(
+                f'{len(queries)} queries, the budget is {self.query_budget}'
+            )
+        if self.time_budget is not None and elapsed > self.time_budget:
+            violations.append(
+                f'{elapsed:.3f} seconds, the budget is {self.time_budget}'
+            )
+        return violations
+
+    def describe(self, violations):
+        statements = '\n'.join(f'  {sql}' for sql in self.queries)
+        return f'{self.method} {self.view_name} exceeded its budget: ' \
+               f'{"; ".join(violations)}\n{statements}'
+
+
+def is_sampled():
+    config = settings.QUERY_BUDGETS
+    if not config['ENABLED']:
+        return False
+    return config['ENFORCE'] or random.random() < config['SAMPLE_RATE']
+
+
+def seed_budget_dataset(users=5, posts=10):
+    """
+    Creates the small dataset the query budgets are measured on: a Country
+    with a City, Users with Interests, Posts and Subscriptions to each
+    other, and a staff User to make the requests.
+
+    Returns:
+        User: The staff User.
+    """
+    from django.utils import timezone
+    from .counters import recount_subscribers
+    from .fields import bump_reference_version
+    from .models import Country, City, Interest, UserInterest, Post, \
+        Subscription, User
+
+    now = timezone.now()
+    country = Country.objects.create(name='Budget Country')
+    city = City.objects.create(name='Budget City', country=country)
+    interests = Interest.objects.bulk_create([
+        Interest(name=f'Budget Interest {index}') for index in range(3)
+    ])
+    for model in (Country, City, Interest):
+        bump_reference_version(model)
+
+    staff = User.objects.create(username='budget-staff', is_staff=True,
+                                country=country, city=city)
+    members = [staff] + [
+        User.objects.create(username=f'budget-user-{index}',
+                            country=country, city=city)
+        for index in range(users)
+    ]
+    UserInterest.objects.bulk_create([
+        UserInterest(user=user, interest=interest)
+        for user in members for interest in interests
+    ])
+    Post.objects.bulk_create([
+        Post(user=user, title=f'Post {index}', text='Text',
+             created_datetime=now, created_by=user.id)
+        for user in members for index in range(posts)
+    ])
+    Subscription.objects.bulk_create([
+        Subscription(user=user, subscribed_to_user=other,
+                     created_datetime=now)
+        for user in members for other in members if user != other
+    ])
+    recount_subscribers([user.id for user in members])
+    return staff
+
+
+def get_api_routes():
+    """
+    Lists the routes of the API views.
+
+    Returns:
+        list: The (name, pattern, view class) tuples.
+    """
+    from rest_framework.views import APIView
+    from .urls import urlpatterns
+
+    routes = []
+    for pattern in urlpatterns:
+        view_class = getattr(pattern.callback, 'view_class', None)
+        if view_class is not None and issubclass(view_class, APIView):
+            routes.append((pattern.name, pattern, view_class))
+    return routes
+
+
+def measure_get_routes(client, user):
+    """
+    Requests every GET route of the API as the User with the budgets
+    checked, but not enforced, and without the throttling.
+
+    Returns:
+        list: The (route, view class, response, BudgetCheck) tuples.
+    """
+    from django.test.utils import override_settings
+    from django.urls import reverse
+    from .models import Subscription
+
+    user_ids = [user.id] + list(Subscription.objects.filter(
+        user=user
+    ).order_by('id').values_list('subscribed_to_user_id', flat=True)[:99])
+    arguments = {'user_id': user_ids[-1],
+                 'subscribed_to_user_id': user_ids[-1]}
+    user_ids = ','.join(str(user_id) for user_id in user_ids)
+    query_strings = {'users-batch': f'ids={user_ids}&detailed=1'}
+
+    client.force_authenticate(user)
+    results = []
+    budgets = {**settings.QUERY_BUDGETS, 'ENABLED': True, 'ENFORCE': False,
+               'SAMPLE_RATE': 1}
+    throttling = {**settings.THROTTLING, 'ENABLED': False}
+    with override_settings(QUERY_BUDGETS=budgets, THROTTLING=throttling):
+        for name, pattern, view_class in get_api_routes():
+            if not hasattr(view_class, 'get'):
+                continue
+            path = reverse(name, kwargs={
+                key: arguments[key] for key in pattern.pattern.converters
+            })
+            if name in query_strings:
+                path = f'{path}?{query_strings[name]}'
+
+            response = client.get(path)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            check = getattr(response.wsgi_request, '_budget_check', None)
+            results.append((path, view_class, response, check))
+    return results
@@ -0,0 +1,110 @@
+import hashlib
+from datetime import datetime, timezone as dt_timezone
+from functools import wraps
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date_safe, \
+    parse_etags
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from django.contrib.auth import get_user_model
+User = get_user_model()
+
+
+def bump_user_versions(*user_ids):
+    """
+    Bumps the version of the Users whose profile, interests, posts or
+    subscriptions have been changed, so their cached responses become stale.
+
+    Args:
+        *user_ids (int): The ids of the Users
+
+    Returns:
+        None.
+    """
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if user_ids:
+        User.objects.filter(id__in=user_ids).update(
+            version=F('version') + 1,
+            modified_datetime=timezone.now()
+        )
+
+
+def counters_period():
+    """
+    Returns:
+        datetime: The start of the current COUNTERS['MAX_AGE'] period, the
+        responses showing the counters are stale for at most until its end.
+    """
+    max_age = settings.COUNTERS['MAX_AGE'].total_seconds()
+    now = timezone.now().timestamp()
+    return datetime.fromtimestamp(now - now % max_age, tz=dt_timezone.utc)
+
+
+def user_etag(request, view_name, period=None):
+    """
+    Computes the ETag of the User-scoped response from the User's version,
+    the view, the query parameters and the counters' period, if the view
+    shows the counters, without touching the database.
+    """
+    value = f'{view_name}:{request.user.id}:{request.user.version}:' \
+            f'{request.get_full_path()}'
+    if period is not None:
+        value = f'{value}:{period.timestamp()}'
+    return f'"{hashlib.md5(value.encode("utf-8")).hexdigest()}"'
+
+
+def is_not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags
+
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since and last_modified is not None:
+        since = parse_http_date_safe(if_modified_since)
+        return since is not None and int(last_modified.timestamp()) <= since
+
+    return False
+
+
+def conditional_user_get(get):
+    """
+    Decorates the GET method of the view returning the data of the current
+    User with the ETag and Last-Modified validators.
+
+    If the client's copy is still current, the view responds with
+    304 Not Modified before running any query or serialization.
+
+    The subscribes do not bump the version of the User subscribed to, so
+    the views with shows_counters set, whose responses show the User's
+    counters, are only current until the end of the COUNTERS['MAX_AGE']
+    period.
+    """
+    @wraps(get)
+    def wrapper(self, request, *args, **kwargs):
+        period = counters_period() \
+            if getattr(self, 'shows_counters', False) else None
+        etag = user_etag(request, type(self).__name__, period)
+        last_modified = request.user.modified_datetime
+        if period is not None and (last_modified is None
+                                   or last_modified < period):
+            last_modified = period
+
+        if is_not_modified(request, etag, last_modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = get(self, request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        return response
+    return wrapper
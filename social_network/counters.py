@@ -0,0 +1,217 @@
+import random
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+
+from .models import UserCounterShard, Subscription
+
+SUBSCRIBERS = 'subscribers'
+
+# The first key of the advisory locks of the Users' counters, shared by the
+# increments and exclusive for the recounts
+COUNTER_LOCK_NAMESPACE = 42
+
+INCREMENT_SQL = '''
+INSERT INTO social_network_usercountershard (user_id, name, shard, value)
+VALUES {values}
+ON CONFLICT (user_id, name, shard)
+DO UPDATE SET value = social_network_usercountershard.value + EXCLUDED.value
+'''
+
+COMPACT_SQL = '''
+WITH removed AS (
+    DELETE FROM social_network_usercountershard
+    WHERE shard <> 0 AND user_id >= %(start)s AND user_id < %(end)s
+    RETURNING user_id, name, value
+)
+INSERT INTO social_network_usercountershard (user_id, name, shard, value)
+SELECT user_id, name, 0, sum(value) FROM removed GROUP BY user_id, name
+ON CONFLICT (user_id, name, shard)
+DO UPDATE SET value = social_network_usercountershard.value + EXCLUDED.value
+'''
+
+
+RECOUNT_SQL = '''
+WITH removed AS (
+    DELETE FROM social_network_usercountershard
+    WHERE user_id = ANY(%(user_ids)s) AND name = %(counter)s AND shard <> 0
+), counted AS (
+    SELECT target.id AS user_id, count(subscription.id) AS value
+    FROM unnest(%(user_ids)s::bigint[]) AS target(id)
+    LEFT JOIN social_network_subscription subscription
+    ON subscription.subscribed_to_user_id = target.id
+    GROUP BY target.id
+)
+INSERT INTO social_network_usercountershard (user_id, name, shard, value)
+SELECT user_id, %(counter)s, 0, value FROM counted
+ON CONFLICT (user_id, name, shard) DO UPDATE SET value = EXCLUDED.value
+'''
+
+
+def counter_lock_key(user_id):
+    return user_id % 2 ** 31
+
+
+def lock_counters(user_ids, shared=True):
+    """
+    Takes the advisory locks of the Users' counters held until the end of
+    the transaction, in the order of the ids, so the concurrent callers do
+    not deadlock. The increments take the shared locks, so they never wait
+    for each other, and the recounts the exclusive ones, so they wait for
+    the increments in progress and no increment lands between the count
+    and the rewrite of the shards. The other databases serialize the write
+    transactions anyway.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    function = 'pg_advisory_xact_lock_shared' if shared \
+        else 'pg_advisory_xact_lock'
+    with connection.cursor() as cursor:
+        for lock_key in sorted({counter_lock_key(user_id)
+                                for user_id in user_ids}):
+            cursor.execute(f'SELECT {function}(%s, %s)',
+                           [COUNTER_LOCK_NAMESPACE, lock_key])
+
+
+def choose_shard():
+    return random.randrange(settings.COUNTERS['SHARDS'])
+
+
+def increment_counters(deltas):
+    """
+    Adds the deltas to the Users' counters, each to one of the counter's
+    shards chosen at random.
+
+    Args:
+        deltas (dict): The deltas keyed by the (user id, counter name)
+
+    Returns:
+        None.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    if connection.vendor == 'postgresql':
+        params = []
+        for (user_id, name), delta in deltas.items():
+            params += [user_id, name, choose_shard(), delta]
+        values = ', '.join(['(%s, %s, %s, %s)'] * len(deltas))
+        with transaction.atomic():
+            lock_counters(user_id for user_id, _ in deltas)
+            with connection.cursor() as cursor:
+                cursor.execute(INCREMENT_SQL.format(values=values), params)
+        return
+
+    with transaction.atomic():
+        for (user_id, name), delta in deltas.items():
+            shard = choose_shard()
+            updated = UserCounterShard.objects.filter(
+                user_id=user_id, name=name, shard=shard
+            ).update(value=F('value') + delta)
+            if not updated:
+                UserCounterShard.objects.create(
+                    user_id=user_id, name=name, shard=shard, value=delta
+                )
+
+
+def increment_counter(user_id, name, delta=1):
+    increment_counters({(user_id, name): delta})
+
+
+def get_counters(user_ids, name):
+    """
+    Sums the shards of the Users' counters with a single query.
+
+    Returns:
+        dict: The counter values keyed by the User's id, 0 for the Users
+        without any shards.
+    """
+    counters = dict.fromkeys(user_ids, 0)
+    counters.update(
+        UserCounterShard.objects.filter(
+            user_id__in=user_ids, name=name
+        ).values_list('user_id').annotate(total=Sum('value')).order_by()
+    )
+    return counters
+
+
+def get_counter(user_id, name):
+    return get_counters([user_id], name)[user_id]
+
+
+def compact_counters(start, end):
+    """
+    Folds all the shards of the counters of the Users with the ids from the
+    start up to the end, exclusive, into their shard 0.
+
+    On PostgreSQL the shards are folded by a single statement, the writes
+    racing with it either land before the shards are removed or recreate
+    them afterwards, so no increment is lost.
+
+    Returns:
+        None.
+    """
+    params = {'start': start, 'end': end}
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(COMPACT_SQL, params)
+        return
+
+    with transaction.atomic():
+        shards = UserCounterShard.objects.filter(
+            user_id__gte=start, user_id__lt=end
+        ).exclude(shard=0)
+        totals = shards.values_list('user_id', 'name').annotate(
+            total=Sum('value')
+        ).order_by()
+        deltas = {(user_id, name): total for user_id, name, total in totals}
+        shards.delete()
+
+        for (user_id, name), delta in deltas.items():
+            updated = UserCounterShard.objects.filter(
+                user_id=user_id, name=name, shard=0
+            ).update(value=F('value') + delta)
+            if not updated:
+                UserCounterShard.objects.create(
+                    user_id=user_id, name=name, shard=0, value=delta
+                )
+
+
+def recount_subscribers(user_ids):
+    """
+    Resets the subscribers counters of the Users to their number of
+    Subscriptions, after the Subscriptions have been written in bulk.
+
+    The counters are locked for the whole transaction, see lock_counters(),
+    and on PostgreSQL the Subscriptions are counted and the shards are
+    rewritten by a single statement, so no concurrent increment is lost.
+    """
+    user_ids = list(user_ids)
+    if connection.vendor == 'postgresql':
+        with transaction.atomic():
+            lock_counters(user_ids, shared=False)
+            with connection.cursor() as cursor:
+                cursor.execute(RECOUNT_SQL, {'user_ids': user_ids,
+                                             'counter': SUBSCRIBERS})
+        return
+
+    with transaction.atomic():
+        lock_counters(user_ids, shared=False)
+        counts = dict.fromkeys(user_ids, 0)
+        counts.update(
+            Subscription.objects.filter(
+                subscribed_to_user__in=user_ids
+            ).values_list('subscribed_to_user').annotate(
+                count=Count('id')
+            ).order_by()
+        )
+        UserCounterShard.objects.filter(
+            user__in=user_ids, name=SUBSCRIBERS
+        ).delete()
+        UserCounterShard.objects.bulk_create([
+            UserCounterShard(user_id=user_id, name=SUBSCRIBERS, shard=0,
+                             value=count)
+            for user_id, count in counts.items()
+        ], batch_size=1000)
@@ -0,0 +1,291 @@
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+
+from .models import Country, City, Interest, UserInterest, Post, \
+    Subscription, AuthToken, UserCounterShard, DeletionJob
+from .archive import PostArchive
+from .conditional import bump_user_versions
+from .counters import SUBSCRIBERS, increment_counters
+from .fields import bump_reference_version
+from .recent_posts import forget_recent_posts
+
+from django.contrib.auth import get_user_model
+User = get_user_model()
+
+# The running jobs not updated for longer are taken over by another runner
+STALE_JOB_TIMEOUT = timedelta(minutes=5)
+
+
+def enqueue_deletion(target_type, target_id, requested_by=None):
+    """
+    Enqueues the deletion of the target, unless it is already queued.
+
+    Args:
+        target_type (str): One of the DeletionJob.TARGET_TYPES
+        target_id (int): The id of the target
+        requested_by (int): The id of the User requesting the deletion
+
+    Returns:
+        DeletionJob: The queued job.
+    """
+    with transaction.atomic():
+        job = DeletionJob.objects.filter(
+            target_type=target_type, target_id=target_id,
+            status__in=(DeletionJob.PENDING, DeletionJob.RUNNING)
+        ).first()
+        if job is None:
+            job = DeletionJob.objects.create(
+                target_type=target_type,
+                target_id=target_id,
+                requested_by=requested_by,
+                created_datetime=timezone.now()
+            )
+        return job
+
+
+def delete_rows(model):
+    def apply(ids):
+        deleted, _ = model.objects.filter(pk__in=ids).delete()
+        return deleted
+    return apply
+
+
+def clear_user_fields(**fields):
+    # The Users' profiles change, so their cached responses become stale
+    def apply(ids):
+        return User.objects.filter(pk__in=ids).update(
+            version=F('version') + 1,
+            modified_datetime=timezone.now(),
+            **fields
+        )
+    return apply
+
+
+def delete_subscriptions(ids):
+    # The deleted User's Subscriptions, counted by the Users subscribed to
+    target_ids = list(Subscription.objects.filter(
+        pk__in=ids
+    ).values_list('subscribed_to_user_id', flat=True))
+    deleted, _ = Subscription.objects.filter(pk__in=ids).delete()
+
+    deltas = {}
+    for target_id in target_ids:
+        key = (target_id, SUBSCRIBERS)
+        deltas[key] = deltas.get(key, 0) - 1
+    increment_counters(deltas)
+    bump_user_versions(*target_ids)
+    return deleted
+
+
+def delete_subscribers(ids):
+    # The deleted User's counter shards are removed by a later stage
+    user_ids = list(Subscription.objects.filter(
+        pk__in=ids
+    ).values_list('user_id', flat=True))
+    deleted, _ = Subscription.objects.filter(pk__in=ids).delete()
+    bump_user_versions(*user_ids)
+    return deleted
+
+
+def delete_user_interests(ids):
+    user_ids = list(UserInterest.objects.filter(
+        pk__in=ids
+    ).values_list('user_id', flat=True))
+    deleted, _ = UserInterest.objects.filter(pk__in=ids).delete()
+    bump_user_versions(*user_ids)
+    return deleted
+
+
+def delete_archived_posts(user_id):
+    def apply():
+        return PostArchive().remove_user(user_id)
+    return apply
+
+
+def get_stages(job):
+    """
+    Lists the stages of the job in their order.
+
+    Returns:
+        list: The (name, queryset, apply) tuples. The rows of the queryset
+        are processed in batches by the apply function receiving their ids
+        and returning the number of the processed rows. The stages without
+        a queryset, such as the removal of the archived Posts, are applied
+        once with no arguments.
+    """
+    target_id = job.target_id
+
+    if job.target_type == 'user':
+        return [
+            ('auth_tokens', AuthToken.objects.filter(user=target_id),
+             delete_rows(AuthToken)),
+            ('tokens', Token.objects.filter(user=target_id),
+             delete_rows(Token)),
+            ('user_interests', UserInterest.objects.filter(user=target_id),
+             delete_rows(UserInterest)),
+            ('subscriptions', Subscription.objects.filter(user=target_id),
+             delete_subscriptions),
+            ('subscribers',
+             Subscription.objects.filter(subscribed_to_user=target_id),
+             delete_subscribers),
+            ('posts', Post.objects.filter(user=target_id),
+             delete_rows(Post)),
+            ('archived_posts', None, delete_archived_posts(target_id)),
+            ('counter_shards',
+             UserCounterShard.objects.filter(user=target_id),
+             delete_rows(UserCounterShard)),
+            ('user', User.objects.filter(id=target_id), delete_rows(User)),
+        ]
+
+    if job.target_type == 'country':
+        return [
+            # Without a join, PostgreSQL does not lock the nullable side of
+            # the outer joins
+            ('users',
+             User.objects.filter(
+                 Q(country=target_id) | Q(city__in=City.objects.filter(
+                     country=target_id
+                 ).values('id'))
+             ),
+             clear_user_fields(country=None, city=None)),
+            ('cities', City.objects.filter(country=target_id),
+             delete_rows(City)),
+            ('country', Country.objects.filter(id=target_id),
+             delete_rows(Country)),
+        ]
+
+    if job.target_type == 'city':
+        return [
+            ('users', User.objects.filter(city=target_id),
+             clear_user_fields(city=None)),
+            ('city', City.objects.filter(id=target_id), delete_rows(City)),
+        ]
+
+    if job.target_type == 'interest':
+        return [
+            ('user_interests',
+             UserInterest.objects.filter(interest=target_id),
+             delete_user_interests),
+            ('interest', Interest.objects.filter(id=target_id),
+             delete_rows(Interest)),
+        ]
+
+    raise ValueError(f'Unknown deletion target: {job.target_type}')
+
+
+def claim_job(job):
+    """
+    Marks the pending, the failed or the stale running job as running by
+    this runner. The failed job resumes with the rows left over by its
+    last batch.
+
+    Returns:
+        bool: Whether the job has been claimed, False if another runner
+        has claimed it first.
+    """
+    now = timezone.now()
+    claimable = Q(status__in=(DeletionJob.PENDING, DeletionJob.FAILED)) | Q(
+        status=DeletionJob.RUNNING,
+        updated_datetime__lt=now - STALE_JOB_TIMEOUT
+    )
+    claimed = DeletionJob.objects.filter(claimable, id=job.id).update(
+        status=DeletionJob.RUNNING,
+        error='',
+        started_datetime=job.started_datetime or now,
+        updated_datetime=now
+    )
+    if claimed:
+        job.refresh_from_db()
+    return bool(claimed)
+
+
+def lock_batch(queryset, batch_size):
+    """
+    Locks the next batch of the stage's rows, skipping the rows locked by
+    the live requests.
+
+    Returns:
+        list: The primary keys of the locked rows.
+    """
+    return list(
+        queryset.select_for_update(
+            skip_locked=True
+        ).order_by('pk').values_list('pk', flat=True)[:batch_size]
+    )
+
+
+def run_job(job, batch_size=1000, sleep=0.05, log=None):
+    """
+    Runs the claimed job stage by stage.
+
+    Every batch is processed together with the update of the job's progress
+    in a single short transaction, so an interrupted job resumes with the
+    rows left over by its last batch. The runner sleeps between the batches
+    to leave the database to the live traffic. A stage ends only once none
+    of its rows are left; while the remaining ones are locked by the live
+    requests, the runner sleeps and tries them again.
+
+    Args:
+        job (DeletionJob): The claimed job
+        batch_size (int): The number of the rows processed in a batch
+        sleep (float): The number of seconds slept between the batches
+        log (callable): Receives the progress messages
+
+    Returns:
+        None.
+    """
+    for name, queryset, apply in get_stages(job):
+        if queryset is None:
+            job.stage = name
+            job.progress[name] = job.progress.get(name, 0) + apply()
+            job.updated_datetime = timezone.now()
+            job.save(update_fields=['stage', 'progress', 'updated_datetime'])
+            if log:
+                log(f'Job {job.id}: {name} {job.progress[name]}')
+            continue
+
+        while True:
+            with transaction.atomic():
+                ids = lock_batch(queryset, batch_size)
+                if ids:
+                    count = apply(ids)
+                    job.stage = name
+                    job.progress[name] = job.progress.get(name, 0) + count
+                # Also saved while waiting for the locked rows, so the job
+                # is not taken over as stale
+                job.updated_datetime = timezone.now()
+                job.save(update_fields=['stage', 'progress',
+                                        'updated_datetime'])
+
+            if ids:
+                if log:
+                    log(f'Job {job.id}: {name} {job.progress[name]}')
+            elif not queryset.exists():
+                break
+            time.sleep(sleep)
+
+    finish_job(job)
+
+
+def finish_job(job):
+    if job.target_type == 'user':
+        forget_recent_posts(job.target_id)
+    elif job.target_type == 'country':
+        bump_reference_version(Country)
+        bump_reference_version(City)
+    elif job.target_type == 'city':
+        bump_reference_version(City)
+    elif job.target_type == 'interest':
+        bump_reference_version(Interest)
+
+    job.status = DeletionJob.DONE
+    job.stage = ''
+    job.finished_datetime = job.updated_datetime = timezone.now()
+    job.save(update_fields=['status', 'stage', 'finished_datetime',
+                            'updated_datetime'])
@@ -0,0 +1,147 @@
+import csv
+import io
+import json
+import time
+import zlib
+import logging
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .archive import PostArchive
+from .models import UserInterest, Post, Subscription
+
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+# The number of rows fetched from the database at once
+EXPORT_CHUNK_SIZE = 2000
+
+# The size of the buffer flushed to the client
+EXPORT_BUFFER_SIZE = 64 * 1024
+
+PROFILE_FIELDS = (
+    'id', 'username', 'first_name', 'last_name', 'email', 'biography',
+    'country_id', 'city_id', 'birth_date', 'date_joined',
+)
+INTEREST_FIELDS = ('id', 'interest_id', 'interest__name', )
+POST_FIELDS = (
+    'id', 'title', 'text', 'created_datetime', 'created_by',
+    'modified_datetime', 'modified_by',
+)
+SUBSCRIPTION_FIELDS = (
+    'id', 'subscribed_to_user_id', 'subscribed_to_user__username',
+    'created_datetime',
+)
+
+
+def export_records(user):
+    """
+    Yields the User's profile, interests, posts and subscriptions.
+
+    The rows are read with the server-side cursors in chunks and the
+    archived Posts one segment at a time, so the memory usage does not
+    depend on how many Posts the User has.
+
+    Args:
+        user (User): The User
+
+    Yields:
+        tuple: The record type and the record as a dictionary.
+    """
+    yield 'profile', {field: getattr(user, field) for field in PROFILE_FIELDS}
+
+    interests = UserInterest.objects.filter(
+        user=user.id
+    ).order_by('id').values(*INTEREST_FIELDS)
+    for interest in interests.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield 'interest', interest
+
+    posts = Post.objects.filter(
+        user=user.id
+    ).order_by('id').values(*POST_FIELDS)
+    for post in posts.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield 'post', post
+
+    for post in PostArchive().iterate(user.id):
+        yield 'post', {field: post[field] for field in POST_FIELDS}
+
+    subscriptions = Subscription.objects.filter(
+        user=user.id
+    ).order_by('id').values(*SUBSCRIPTION_FIELDS)
+    for subscription in subscriptions.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield 'subscription', subscription
+
+
+def _ndjson_lines(records):
+    encoder = DjangoJSONEncoder()
+    for record_type, record in records:
+        yield encoder.encode({'type': record_type, **record}) + '\n'
+
+
+def _csv_lines(records):
+    # Each record type gets its own header row, because the types have
+    # different columns
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    current_type = None
+    for record_type, record in records:
+        if record_type != current_type:
+            writer.writerow(['type', *record.keys()])
+            current_type = record_type
+        writer.writerow([record_type, *record.values()])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def stream_export(user, file_format='ndjson', compress=False, stats=None):
+    """
+    Streams the User's data as NDJSON or CSV.
+
+    Args:
+        user (User): The User
+        file_format (str): Either ndjson or csv
+        compress (bool): Whether to gzip the output on the fly
+        stats (dict): Receives the number of rows and the elapsed seconds
+        when the export finishes
+
+    Yields:
+        bytes: The chunks of the export of about EXPORT_BUFFER_SIZE bytes.
+    """
+    lines = _csv_lines if file_format == 'csv' else _ndjson_lines
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) \
+        if compress else None
+
+    started = time.perf_counter()
+    rows = 0
+    buffer = []
+    buffered = 0
+
+    for line in lines(export_records(user)):
+        rows += 1
+        data = line.encode('utf-8')
+        buffer.append(data)
+        buffered += len(data)
+        if buffered >= EXPORT_BUFFER_SIZE:
+            chunk = b''.join(buffer)
+            buffer = []
+            buffered = 0
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+
+    chunk = b''.join(buffer)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+    elapsed = time.perf_counter() - started
+    logging.info(
+        f'Exported {rows} rows of the User {user.id} in {elapsed:.2f}s '
+        f'({rows / elapsed if elapsed else 0:.0f} rows/sec)'
+    )
+    if stats is not None:
+        stats['rows'] = rows
+        stats['seconds'] = elapsed
@@ -0,0 +1,191 @@
+import time
+import threading
+
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, MANY_RELATION_KWARGS
+
+from .recent_posts import get_recent_posts
+
+
+def reference_version_key(model):
+    return f'reference-version:{model._meta.label_lower}'
+
+
+def bump_reference_version(model):
+    """
+    Invalidates the cached reference data of the model, such as the
+    Countries, Cities and Interests, after it has been changed, in all the
+    workers at once through the shared cache.
+
+    Args:
+        model (Model): The model class
+
+    Returns:
+        None.
+    """
+    caches['shared'].set(reference_version_key(model), time.time_ns(), None)
+
+
+class ReferenceData:
+    """
+    The in-process copy of the small, rarely changing table keyed by the
+    primary key.
+
+    The whole table is loaded at once and reloaded when its version in the
+    shared cache has been bumped, which every lookup checks, so the deleted
+    rows are rejected by all the workers right away. The ids missing from
+    the copy are looked up in the database, so the newly created rows are
+    always found.
+    """
+    _tables = {}
+    _lock = threading.Lock()
+
+    def __init__(self, model):
+        self.model = model
+        self.version = None
+        self.instances = {}
+
+    @classmethod
+    def get(cls, model):
+        table = cls._tables.get(model)
+        if table is None:
+            with cls._lock:
+                table = cls._tables.setdefault(model, cls(model))
+        return table
+
+    def resolve(self, pks, refresh=True):
+        """
+        Resolves the primary keys into the model instances.
+
+        Args:
+            pks (list): The primary keys
+            refresh (bool): Whether the version is checked, False if it
+                has just been checked by the same request
+
+        Returns:
+            dict: The found instances keyed by their primary keys.
+        """
+        if refresh:
+            self.refresh()
+        instances = self.instances
+        found = {pk: instances[pk] for pk in pks if pk in instances}
+
+        missing = [pk for pk in pks if pk not in found]
+        if missing:
+            found.update(self.model.objects.in_bulk(missing))
+        return found
+
+    def refresh(self):
+        cache = caches['shared']
+        version = cache.get(reference_version_key(self.model))
+        if version is None:
+            # The evicted version is replaced by a new one, so every worker
+            # reloads its copy
+            version = time.time_ns()
+            if not cache.add(reference_version_key(self.model), version,
+                             None):
+                version = cache.get(reference_version_key(self.model),
+                                    version)
+
+        if version == self.version:
+            return
+
+        # The new dictionary replaces the old one at once, so the threads
+        # reading it concurrently need no lock
+        self.instances = self.model.objects.in_bulk()
+        self.version = version
+
+
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    The PrimaryKeyRelatedField resolving the ids of the reference data
+    from the ReferenceData instead of a query per value.
+
+    Used for the small, rarely changing tables only, whose writes call
+    bump_reference_version(). The version of every table is checked once
+    per serializer tree, so the nested serializers of a list, such as the
+    User's Interests, do not check it for every item.
+    """
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return CachedManyRelatedField(**list_kwargs)
+
+    def to_pk(self, data):
+        if self.pk_field is not None:
+            data = self.pk_field.to_internal_value(data)
+        if isinstance(data, bool):
+            raise TypeError
+        return self.get_queryset().model._meta.pk.to_python(data)
+
+    def resolve(self, data_list):
+        pks = []
+        for data in data_list:
+            try:
+                pks.append(self.to_pk(data))
+            except (TypeError, ValueError, ValidationError):
+                self.fail('incorrect_type', data_type=type(data).__name__)
+
+        model = self.get_queryset().model
+        refreshed = self.root.__dict__.setdefault('_refreshed_reference_data',
+                                                  set())
+        found = ReferenceData.get(model).resolve(
+            pks, refresh=model not in refreshed
+        )
+        refreshed.add(model)
+        for data, pk in zip(data_list, pks):
+            if pk not in found:
+                self.fail('does_not_exist', pk_value=data)
+        return [found[pk] for pk in pks]
+
+    def to_internal_value(self, data):
+        if isinstance(data, (list, dict)):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        return self.resolve([data])[0]
+
+
+class CachedManyRelatedField(ManyRelatedField):
+    """
+    Resolves all the ids of the list with a single ReferenceData lookup.
+    """
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        return self.child_relation.resolve(list(data))
+
+
+class RecentPostsField(serializers.Field):
+    """
+    The newest Posts of the User read from the recent posts cache, rendered
+    in full or, once collapsed by the sparse fieldsets, as their ids.
+
+    The list serializers prefetch the Posts of all their Users with a single
+    multi-get, see UserDetailedListSerializer.
+    """
+    # The model fields the field reads besides the primary key
+    required_model_fields = ('version', )
+
+    def __init__(self, ids_only=False, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+        self.ids_only = ids_only
+
+    def collapse(self):
+        return type(self)(ids_only=True)
+
+    def to_representation(self, user):
+        posts = getattr(user, '_recent_posts', None)
+        if posts is None:
+            posts = get_recent_posts([user])[user.id]
+        if self.ids_only:
+            return [post['id'] for post in posts]
+        return posts
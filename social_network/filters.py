@@ -0,0 +1,304 @@
+from datetime import datetime
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+
+from rest_framework import serializers
+
+
+def parse_datetime_bound(value):
+    """
+    Parses the start_date or end_date query parameter the same way the
+    database does, so the date-only values mean midnight.
+
+    Args:
+        value (str): The date or datetime
+
+    Returns:
+        datetime: The timezone aware datetime or None.
+    """
+    if not value:
+        return None
+
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            date = parse_date(value)
+            if date is None:
+                return None
+            parsed = datetime.combine(date, datetime.min.time())
+    except ValueError:
+        return None
+
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def parse_id_list(query_params, name='ids', max_values=100):
+    """
+    Parses the ids given as the comma separated or the repeated query
+    parameter, keeping their order.
+
+    Returns:
+        list: The unique ids.
+
+    Raises:
+        ValidationError: If there are no ids, too many or invalid ones.
+    """
+    values = [value for param in query_params.getlist(name)
+              for value in param.split(',') if value.strip()]
+    try:
+        ids = list(dict.fromkeys(int(value) for value in values))
+    except ValueError:
+        raise serializers.ValidationError(
+            {name: ['The values must be of int.']}
+        )
+
+    if not ids or len(ids) > max_values:
+        raise serializers.ValidationError(
+            {name: [f'From 1 to {max_values} values are required.']}
+        )
+    return ids
+
+
+class Filter:
+    """
+    The query parameter compiled into the ORM lookups.
+
+    The indexed filters are served by an index of the filtered table, the
+    related filters join a multi-valued relation and so need the rows to
+    be made distinct.
+    """
+    def __init__(self, lookup, indexed=False, related=False):
+        self.lookup = lookup
+        self.indexed = indexed
+        self.related = related
+        self.name = None
+
+    @property
+    def params(self):
+        return (self.name, )
+
+    def parse(self, query_params):
+        """
+        Parses the filter's query parameters.
+
+        Returns:
+            The cleaned value or None if the filter is not used.
+
+        Raises:
+            ValueError: If the value is invalid.
+        """
+        value = query_params.get(self.name)
+        return value if value else None
+
+    def compile(self, value):
+        return {self.lookup: value}
+
+
+class CharFilter(Filter):
+    pass
+
+
+class ListFilter(Filter):
+    """
+    Filters by any of the values of the repeated query parameter with
+    a single IN lookup.
+    """
+    def __init__(self, lookup, cast=str, max_values=10, **kwargs):
+        super().__init__(lookup, **kwargs)
+        self.cast = cast
+        self.max_values = max_values
+
+    def parse(self, query_params):
+        values = [value for value in query_params.getlist(self.name) if value]
+        if not values:
+            return None
+
+        if len(values) > self.max_values:
+            raise ValueError(
+                f'At most {self.max_values} values are allowed.'
+            )
+
+        try:
+            return sorted(set(self.cast(value) for value in values))
+        except (TypeError, ValueError):
+            raise ValueError(f'The values must be of {self.cast.__name__}.')
+
+    def compile(self, value):
+        return {f'{self.lookup}__in': value}
+
+
+class DateTimeRangeFilter(Filter):
+    """
+    Filters by the inclusive range given by the start and end query
+    parameters, compiled into a single BETWEEN when both are given.
+    """
+    def __init__(self, lookup, start_param='start_date',
+                 end_param='end_date', **kwargs):
+        super().__init__(lookup, **kwargs)
+        self.start_param = start_param
+        self.end_param = end_param
+
+    @property
+    def params(self):
+        return (self.start_param, self.end_param, )
+
+    def parse(self, query_params):
+        bounds = []
+        for param in self.params:
+            value = query_params.get(param)
+            bound = parse_datetime_bound(value)
+            if value and bound is None:
+                raise ValueError(f'The {param} must be a date or datetime.')
+            bounds.append(bound)
+
+        start, end = bounds
+        if start is None and end is None:
+            return None
+        if start is not None and end is not None and start > end:
+            raise ValueError(
+                f'The {self.start_param} must not be after the '
+                f'{self.end_param}.'
+            )
+        return start, end
+
+    def compile(self, value):
+        start, end = value
+        if start is None:
+            return {f'{self.lookup}__lte': end}
+        if end is None:
+            return {f'{self.lookup}__gte': start}
+        return {f'{self.lookup}__range': (start, end)}
+
+
+class FilterSet:
+    """
+    The declarative set of the filters of a list view.
+
+    The query parameters are parsed and validated once and compiled into
+    a single filter() call, so all the predicates end up in one WHERE and
+    the predicates on a multi-valued relation share one join.
+
+    The unknown parameters are rejected. Unless the view has already scoped
+    the queryset, for example to the current User, the filters which are
+    not served by an index are only allowed together with an indexed one,
+    so they never scan the whole table.
+    """
+    # The query parameters handled by the views rather than the filters,
+    # see SparseFieldsetMixin
+    ignored_params = frozenset(('format', 'fields', 'expand', 'shape', ))
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.filters = {}
+        for klass in reversed(cls.__mro__):
+            for name, value in vars(klass).items():
+                if isinstance(value, Filter):
+                    value.name = name
+                    cls.filters[name] = value
+
+    def __init__(self, query_params, scoped=False):
+        self.query_params = query_params
+        self.scoped = scoped
+        self.cleaned_data = {}
+        self.errors = {}
+
+    def is_valid(self, raise_exception=False):
+        self.cleaned_data = {}
+        self.errors = {}
+
+        known_params = set(self.ignored_params)
+        for name, filter_ in self.filters.items():
+            known_params.update(filter_.params)
+            try:
+                value = filter_.parse(self.query_params)
+            except ValueError as e:
+                self.errors[name] = [str(e)]
+                continue
+            if value is not None:
+                self.cleaned_data[name] = value
+
+        for param in self.query_params:
+            if param not in known_params:
+                self.errors[param] = ['Unknown filter.']
+
+        used = [self.filters[name] for name in self.cleaned_data]
+        if not self.scoped and used \
+                and not any(filter_.indexed for filter_ in used):
+            indexed = [name for name, filter_ in self.filters.items()
+                       if filter_.indexed]
+            self.errors['filters'] = [
+                f'The filters: {", ".join(self.cleaned_data)} must be '
+                f'combined with one of: {", ".join(indexed)}.'
+            ]
+
+        if self.errors and raise_exception:
+            raise serializers.ValidationError(self.errors)
+        return not self.errors
+
+    def filter(self, queryset):
+        lookups = {}
+        for name, value in self.cleaned_data.items():
+            lookups.update(self.filters[name].compile(value))
+        if not lookups:
+            return queryset
+
+        queryset = queryset.filter(**lookups)
+        if any(self.filters[name].related for name in self.cleaned_data):
+            queryset = queryset.distinct()
+        return queryset
+
+
+class PostFilterSet(FilterSet):
+    title = CharFilter('title__icontains')
+    text = CharFilter('text__icontains')
+    created = DateTimeRangeFilter('created_datetime', indexed=True)
+
+
+class SubscriptionFilterSet(FilterSet):
+    username = ListFilter('subscribed_to_user__username', indexed=True)
+    title = CharFilter('subscribed_to_user__posts__title__icontains',
+                       related=True)
+    text = CharFilter('subscribed_to_user__posts__text__icontains',
+                      related=True)
+    created = DateTimeRangeFilter(
+        'subscribed_to_user__posts__created_datetime', indexed=True,
+        related=True
+    )
+
+
+class UserFilterSet(FilterSet):
+    username = ListFilter('username', indexed=True)
+    country = ListFilter('country_id', cast=int, indexed=True)
+    city = ListFilter('city_id', cast=int, indexed=True)
+    interest = ListFilter('interests__interest_id', cast=int, indexed=True,
+                          related=True)
+    first_name = CharFilter('first_name__icontains')
+    last_name = CharFilter('last_name__icontains')
+
+
+class UserInterestFilterSet(FilterSet):
+    user = ListFilter('user_id', cast=int, indexed=True)
+    interest = ListFilter('interest_id', cast=int, indexed=True)
+
+
+class TopCountriesFilterSet(FilterSet):
+    ignored_params = FilterSet.ignored_params | {'limit'}
+    created = DateTimeRangeFilter('day', indexed=True)
+
+
+class DailyActivityFilterSet(FilterSet):
+    ignored_params = FilterSet.ignored_params | {'interval'}
+    created = DateTimeRangeFilter('day', indexed=True)
+    country = ListFilter('country_id', cast=int, max_values=1, indexed=True)
+
+
+class HourlyActivityFilterSet(DailyActivityFilterSet):
+    created = DateTimeRangeFilter('hour', indexed=True)
+
+
+class TrendingPostFilterSet(FilterSet):
+    ignored_params = FilterSet.ignored_params | {'limit'}
+    country = ListFilter('country_id', cast=int, max_values=1, indexed=True)
@@ -0,0 +1,160 @@
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+
+from social_network.archive import PostArchive, SEGMENT_COLUMNS
+from social_network.models import Post
+from social_network.recent_posts import forget_recent_posts
+
+
+class Command(BaseCommand):
+    help = 'Moves the Posts older than the cutoff from the Post table into ' \
+           'the compressed columnar archive segments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--before',
+            help='Archive the Posts created before this date or datetime.'
+        )
+        parser.add_argument(
+            '--older-than-days', type=int,
+            help='Archive the Posts created more than this many days ago.'
+        )
+        parser.add_argument(
+            '--segment-size', type=int, default=100000,
+            help='The number of Posts written into a single segment file.'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='The number of Posts fetched from the database at once.'
+        )
+        parser.add_argument(
+            '--delete-batch-size', type=int, default=1000,
+            help='The number of Posts deleted in a single transaction.'
+        )
+
+    def get_cutoff(self, options):
+        if options['older_than_days'] is not None:
+            return timezone.now() - timedelta(days=options['older_than_days'])
+
+        if not options['before']:
+            raise CommandError('Either --before or --older-than-days '
+                               'is required.')
+
+        cutoff = parse_datetime(options['before'])
+        if cutoff is None:
+            date = parse_date(options['before'])
+            if date is None:
+                raise CommandError(f'Invalid date: {options["before"]}')
+            cutoff = datetime.combine(date, datetime.min.time())
+        if timezone.is_naive(cutoff):
+            cutoff = timezone.make_aware(cutoff)
+        return cutoff
+
+    def relation_size(self):
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_total_relation_size(%s)', [Post._meta.db_table]
+            )
+            return cursor.fetchone()[0]
+
+    def handle(self, *args, **options):
+        cutoff = self.get_cutoff(options)
+        archive = PostArchive()
+        size_before = self.relation_size()
+
+        # Archived in the order of the Users, served by the index on the
+        # User and created datetime, so every segment holds a narrow range
+        # of the Users and the reads of a User open only a few segments
+        posts = Post.objects.filter(
+            created_datetime__lt=cutoff
+        ).order_by('user_id', 'created_datetime', 'id').values_list(
+            *[name for name, _ in SEGMENT_COLUMNS]
+        )
+
+        archived = 0
+        raw_bytes = 0
+        stored_bytes = 0
+        sample_user_id = None
+        rows = []
+        for row in posts.iterator(chunk_size=options['chunk_size']):
+            rows.append(row)
+            if len(rows) >= options['segment_size']:
+                entry = self.archive_segment(archive, rows, options)
+                archived += entry['rows']
+                raw_bytes += entry['raw_bytes']
+                stored_bytes += entry['stored_bytes']
+                sample_user_id = rows[0][1]
+                rows = []
+
+        if rows:
+            entry = self.archive_segment(archive, rows, options)
+            archived += entry['rows']
+            raw_bytes += entry['raw_bytes']
+            stored_bytes += entry['stored_bytes']
+            sample_user_id = rows[0][1]
+
+        self.stdout.write(f'Archived {archived} Posts created before {cutoff}')
+        if not archived:
+            return
+
+        self.stdout.write(
+            f'Raw column bytes: {raw_bytes}, stored segment bytes: '
+            f'{stored_bytes}, saved: {raw_bytes - stored_bytes} '
+            f'({stored_bytes / raw_bytes:.1%} of the raw size)'
+        )
+
+        size_after = self.relation_size()
+        if size_before is not None:
+            self.stdout.write(
+                f'Post table size: {size_before} -> {size_after} bytes '
+                f'(the space is reclaimed by the next VACUUM)'
+            )
+
+        self.report_latency(archive, sample_user_id, cutoff)
+
+    def archive_segment(self, archive, rows, options):
+        # The segment is written and registered in the manifest before the
+        # rows are deleted, so an interrupted run never loses Posts. The
+        # read path prefers the hot rows if a Post ends up in both places.
+        entry = archive.append(rows)
+
+        ids = [row[0] for row in rows]
+        batch_size = options['delete_batch_size']
+        for start in range(0, len(ids), batch_size):
+            with transaction.atomic():
+                Post.objects.filter(
+                    id__in=ids[start:start + batch_size]
+                ).delete()
+        forget_recent_posts(*{row[1] for row in rows})
+
+        self.stdout.write(
+            f'Wrote {entry["file"]}: {entry["rows"]} Posts, '
+            f'{entry["stored_bytes"]} bytes'
+        )
+        return entry
+
+    def report_latency(self, archive, user_id, cutoff):
+        started = time.perf_counter()
+        hot_count = len(list(
+            Post.objects.filter(
+                user_id=user_id, created_datetime__gte=cutoff
+            ).values_list('id', flat=True)
+        ))
+        hot_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        cold_count = len(archive.read(user_id, end=cutoff))
+        cold_time = time.perf_counter() - started
+
+        self.stdout.write(
+            f'Query latency for the User {user_id}: '
+            f'hot range {hot_time * 1000:.2f} ms ({hot_count} Posts), '
+            f'cold range {cold_time * 1000:.2f} ms ({cold_count} Posts)'
+        )
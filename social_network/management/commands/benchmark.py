@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from social_network.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = 'Runs the benchmarks of the social network app.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'names', nargs='*',
+            help='The benchmarks to run, all of them by default.'
+        )
+        parser.add_argument('--iterations', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        names = options['names'] or sorted(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError(
+                f'Unknown benchmarks: {", ".join(unknown)}. '
+                f'Available: {", ".join(sorted(BENCHMARKS))}'
+            )
+
+        # The benchmarks issue far more requests than the throttling allows
+        throttling = {**settings.THROTTLING, 'ENABLED': False}
+
+        for name in names:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            with override_settings(THROTTLING=throttling):
+                rows = BENCHMARKS[name](options['iterations'])
+            for label, value in rows:
+                self.stdout.write(f'  {label:<40} {value}')
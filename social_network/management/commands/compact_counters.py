@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from social_network.counters import compact_counters
+from social_network.models import UserCounterShard
+
+
+class Command(BaseCommand):
+    help = "Folds the shards of the Users' counters into a single row per " \
+           "counter. Meant to be run periodically, for example from cron."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='The number of the User ids compacted in a single statement.'
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rows_before = UserCounterShard.objects.count()
+
+        bounds = UserCounterShard.objects.exclude(shard=0).aggregate(
+            start=Min('user_id'), end=Max('user_id')
+        )
+        if bounds['start'] is not None:
+            batch_size = options['batch_size']
+            for start in range(bounds['start'], bounds['end'] + 1,
+                               batch_size):
+                compact_counters(start, start + batch_size)
+
+        rows_after = UserCounterShard.objects.count()
+        self.stdout.write(
+            f'Compacted the counter shards: {rows_before} -> {rows_after} '
+            f'rows in {time.perf_counter() - started:.2f} seconds'
+        )
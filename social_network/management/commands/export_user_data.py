@@ -0,0 +1,58 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from social_network.exporters import EXPORT_FORMATS, stream_export
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Streams the export of the User's profile, interests, posts and " \
+           "subscriptions as NDJSON or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('user', help='The id or the username of the User.')
+        parser.add_argument(
+            '--format', dest='file_format', choices=EXPORT_FORMATS,
+            default='ndjson'
+        )
+        parser.add_argument(
+            '--gzip', action='store_true',
+            help='Compress the export on the fly.'
+        )
+        parser.add_argument(
+            '--output',
+            help='The file to write the export into, stdout by default.'
+        )
+
+    def handle(self, *args, **options):
+        lookup = {'id': options['user']} if options['user'].isdigit() \
+            else {'username': options['user']}
+        try:
+            user = User.objects.get(**lookup)
+        except User.DoesNotExist:
+            raise CommandError(f'User {options["user"]} does not exist')
+
+        stats = {}
+        chunks = stream_export(
+            user, file_format=options['file_format'],
+            compress=options['gzip'], stats=stats
+        )
+
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+
+        rows_per_second = stats['rows'] / stats['seconds'] \
+            if stats['seconds'] else 0
+        self.stderr.write(
+            f'Exported {stats["rows"]} rows in {stats["seconds"]:.2f}s '
+            f'({rows_per_second:.0f} rows/sec)'
+        )
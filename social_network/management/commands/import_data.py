@@ -0,0 +1,473 @@
+import io
+import os
+import csv
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password, identify_hasher
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+
+from social_network.conditional import bump_user_versions
+from social_network.counters import recount_subscribers
+from social_network.subscriptions import MAX_SUBSCRIPTIONS, \
+    lock_subscriptions
+from social_network.models import Country, City, Interest, UserInterest, \
+    Post, Subscription
+
+User = get_user_model()
+
+RECORD_TYPES = ('user', 'post', 'subscription')
+
+USER_TEXT_FIELDS = ('first_name', 'last_name', 'email', 'biography')
+
+
+def _init_hash_worker():
+    # The spawned workers do not inherit the configured Django settings
+    django.setup()
+
+
+def _hash_password(password):
+    return make_password(password)
+
+
+class RowError(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Imports the Users, Posts and Subscriptions from the NDJSON or ' \
+           'CSV files in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='The NDJSON or CSV file.')
+        parser.add_argument(
+            '--format', dest='file_format', choices=('ndjson', 'csv'),
+            help='The input format, guessed from the extension by default.'
+        )
+        parser.add_argument(
+            '--type', dest='record_type', choices=RECORD_TYPES,
+            help='The type of the CSV rows. The NDJSON records carry their '
+                 'own type in the "type" key.'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='The number of processes hashing the passwords.'
+        )
+        parser.add_argument(
+            '--copy', action='store_true',
+            help='Write the Posts with the PostgreSQL COPY instead of the '
+                 'batched INSERT statements.'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='The file keeping the number of imported lines, so an '
+                 'interrupted import resumes where it stopped.'
+        )
+
+    def handle(self, *args, **options):
+        file_format = options['file_format'] or (
+            'csv' if options['input'].endswith('.csv') else 'ndjson'
+        )
+        if file_format == 'csv' and not options['record_type']:
+            raise CommandError('--type is required for the CSV input')
+        if options['copy'] and connection.vendor != 'postgresql':
+            raise CommandError('--copy is only supported on PostgreSQL')
+
+        self.options = options
+        self.username_validator = UnicodeUsernameValidator()
+        self.countries = dict(Country.objects.values_list('name', 'id'))
+        self.cities = dict(City.objects.values_list('name', 'id'))
+        self.interests = dict(Interest.objects.values_list('name', 'id'))
+        self.pool = ProcessPoolExecutor(
+            max_workers=options['workers'], initializer=_init_hash_worker
+        ) if options['workers'] > 1 else None
+
+        done_lines = self.load_checkpoint()
+        started = time.perf_counter()
+        imported = {record_type: 0 for record_type in RECORD_TYPES}
+        errors = 0
+
+        try:
+            batch = []
+            for line_number, record in self.read_records(file_format):
+                if line_number <= done_lines:
+                    continue
+                batch.append((line_number, record))
+                if len(batch) >= options['batch_size']:
+                    errors += self.import_batch(batch, imported)
+                    batch = []
+            if batch:
+                errors += self.import_batch(batch, imported)
+        finally:
+            if self.pool:
+                self.pool.shutdown()
+
+        elapsed = time.perf_counter() - started
+        total = sum(imported.values())
+        self.stdout.write(
+            f'Imported {imported["user"]} Users, {imported["post"]} Posts '
+            f'and {imported["subscription"]} Subscriptions, skipped {errors} '
+            f'invalid rows in {elapsed:.2f}s '
+            f'({total / elapsed if elapsed else 0:.0f} rows/sec)'
+        )
+
+    def read_records(self, file_format):
+        with open(self.options['input'], newline='') as input_file:
+            if file_format == 'csv':
+                # The header is the line 1
+                for line_number, row in enumerate(
+                        csv.DictReader(input_file), start=2):
+                    yield line_number, {
+                        'type': self.options['record_type'], **row
+                    }
+                return
+
+            for line_number, line in enumerate(input_file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Counted as an invalid row by import_batch
+                    record = None
+                yield line_number, record
+
+    def load_checkpoint(self):
+        path = self.options['checkpoint']
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        if checkpoint['input'] != os.path.abspath(self.options['input']):
+            raise CommandError(f'The checkpoint {path} belongs to '
+                               f'{checkpoint["input"]}')
+        self.stdout.write(f'Resuming after the line {checkpoint["line"]}')
+        return checkpoint['line']
+
+    def save_checkpoint(self, line_number):
+        path = self.options['checkpoint']
+        if not path:
+            return
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as checkpoint_file:
+            json.dump({
+                'input': os.path.abspath(self.options['input']),
+                'line': line_number,
+            }, checkpoint_file)
+        os.replace(tmp_path, path)
+
+    def import_batch(self, batch, imported):
+        """
+        Validates and writes a single batch in one transaction and moves
+        the checkpoint past it.
+
+        Returns:
+            int: The number of the invalid rows.
+        """
+        rows = {record_type: [] for record_type in RECORD_TYPES}
+        errors = 0
+        for line_number, record in batch:
+            if not isinstance(record, dict):
+                self.stderr.write(f'Line {line_number}: invalid JSON')
+                errors += 1
+                continue
+            record_type = record.get('type')
+            if record_type not in RECORD_TYPES:
+                self.stderr.write(f'Line {line_number}: unknown type '
+                                  f'{record_type!r}')
+                errors += 1
+                continue
+            rows[record_type].append((line_number, record))
+
+        with transaction.atomic():
+            for record_type in RECORD_TYPES:
+                if not rows[record_type]:
+                    continue
+                count, invalid = getattr(self, f'import_{record_type}s')(
+                    rows[record_type]
+                )
+                imported[record_type] += count
+                errors += invalid
+
+        self.save_checkpoint(batch[-1][0])
+        return errors
+
+    def validate(self, rows, clean):
+        valid = []
+        for line_number, record in rows:
+            try:
+                valid.append(clean(record))
+            except (RowError, ValidationError, ValueError) as e:
+                self.stderr.write(f'Line {line_number}: {e}')
+        return valid
+
+    def parse_datetime(self, value, field, required=False):
+        if not value:
+            if required:
+                raise RowError(f'{field} is required')
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise RowError(f'invalid {field}: {value!r}')
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    def lookup(self, mapping, value, name):
+        if not value:
+            return None
+        if value not in mapping:
+            raise RowError(f'unknown {name}: {value!r}')
+        return mapping[value]
+
+    def clean_user(self, record):
+        username = record.get('username')
+        if not username:
+            raise RowError('username is required')
+        self.username_validator(username)
+
+        password_hash = record.get('password_hash')
+        if password_hash:
+            # Raises ValueError for the unknown hash formats
+            identify_hasher(password_hash)
+        elif not record.get('password'):
+            raise RowError('either password or password_hash is required')
+
+        interests = record.get('interests') or []
+        if isinstance(interests, str):
+            interests = [name for name in interests.split(';') if name]
+
+        birth_date = record.get('birth_date')
+        if birth_date:
+            birth_date = parse_date(birth_date)
+            if birth_date is None:
+                raise RowError(f'invalid birth_date: '
+                               f'{record["birth_date"]!r}')
+
+        user = User(
+            username=username,
+            password=password_hash or None,
+            country_id=self.lookup(self.countries, record.get('country'),
+                                   'country'),
+            city_id=self.lookup(self.cities, record.get('city'), 'city'),
+            birth_date=birth_date or None,
+            date_joined=timezone.now(),
+            **{field: record.get(field) or '' for field in USER_TEXT_FIELDS}
+        )
+        user.biography = user.biography or None
+        interest_ids = [
+            self.lookup(self.interests, name, 'interest') for name in interests
+        ]
+        return user, record.get('password'), interest_ids
+
+    def import_users(self, rows):
+        users = self.validate(rows, self.clean_user)
+
+        # Skipping the duplicates within the batch and the existing Users
+        usernames = {user.username for user, _, _ in users}
+        existing = set(User.objects.filter(
+            username__in=usernames
+        ).values_list('username', flat=True))
+        unique = {}
+        for user, password, interest_ids in users:
+            if user.username in existing or user.username in unique:
+                self.stderr.write(f'User {user.username} already exists')
+                continue
+            unique[user.username] = (user, password, interest_ids)
+        users = list(unique.values())
+
+        plain = [(user, password) for user, password, _ in users
+                 if not user.password]
+        passwords = [password for _, password in plain]
+        if self.pool and len(passwords) > 1:
+            chunk_size = max(1, len(passwords) // (self.options['workers'] * 4))
+            hashes = self.pool.map(_hash_password, passwords,
+                                   chunksize=chunk_size)
+        else:
+            hashes = map(make_password, passwords)
+        for (user, _), password_hash in zip(plain, hashes):
+            user.password = password_hash
+
+        User.objects.bulk_create(
+            [user for user, _, _ in users], batch_size=1000
+        )
+
+        user_ids = dict(User.objects.filter(
+            username__in=[user.username for user, _, _ in users]
+        ).values_list('username', 'id'))
+        UserInterest.objects.bulk_create([
+            UserInterest(user_id=user_ids[user.username],
+                         interest_id=interest_id)
+            for user, _, interest_ids in users
+            for interest_id in set(interest_ids)
+        ], batch_size=1000, ignore_conflicts=True)
+        return len(users), len(rows) - len(users)
+
+    def resolve_usernames(self, rows, *fields):
+        usernames = {
+            record.get(field) for _, record in rows for field in fields
+        }
+        # The deactivated Users' accounts are being deleted
+        return dict(User.objects.filter(
+            username__in=usernames, is_active=True
+        ).values_list('username', 'id'))
+
+    def import_posts(self, rows):
+        user_ids = self.resolve_usernames(rows, 'username')
+
+        def clean_post(record):
+            user_id = self.lookup(user_ids, record.get('username'), 'username')
+            if user_id is None:
+                raise RowError('username is required')
+            title = record.get('title') or ''
+            text = record.get('text') or ''
+            if not title or len(title) > 100 or len(text) > 1000:
+                raise RowError('invalid title or text')
+            modified_datetime = self.parse_datetime(
+                record.get('modified_datetime'), 'modified_datetime'
+            )
+            return Post(
+                user_id=user_id,
+                title=title,
+                text=text,
+                created_datetime=self.parse_datetime(
+                    record.get('created_datetime'), 'created_datetime'
+                ) or timezone.now(),
+                created_by=user_id,
+                modified_datetime=modified_datetime,
+                modified_by=user_id if modified_datetime else None,
+            )
+
+        posts = self.validate(rows, clean_post)
+        if self.options['copy']:
+            self.copy(Post, posts, ('user_id', 'title', 'text',
+                                    'created_datetime', 'created_by',
+                                    'modified_datetime', 'modified_by'))
+        else:
+            Post.objects.bulk_create(posts, batch_size=1000)
+        bump_user_versions(*{post.user_id for post in posts})
+        return len(posts), len(rows) - len(posts)
+
+    def import_subscriptions(self, rows):
+        user_ids = self.resolve_usernames(rows, 'username', 'subscribed_to')
+
+        def clean_subscription(record):
+            user_id = self.lookup(user_ids, record.get('username'), 'username')
+            subscribed_to_user_id = self.lookup(
+                user_ids, record.get('subscribed_to'), 'subscribed_to'
+            )
+            if user_id is None or subscribed_to_user_id is None:
+                raise RowError('username and subscribed_to are required')
+            if user_id == subscribed_to_user_id:
+                raise RowError('the User can not subscribe to itself')
+            return Subscription(
+                user_id=user_id,
+                subscribed_to_user_id=subscribed_to_user_id,
+                created_datetime=self.parse_datetime(
+                    record.get('created_datetime'), 'created_datetime'
+                ) or timezone.now(),
+            )
+
+        subscriptions = self.validate(rows, clean_subscription)
+        invalid = len(rows) - len(subscriptions)
+        subscriptions, over_limit = self.limit_subscriptions(subscriptions)
+        invalid += over_limit
+
+        # COPY has no ON CONFLICT, so the Subscriptions are always inserted
+        # in batches skipping the already existing ones, which are counted
+        # as neither imported nor invalid
+        subscriber_ids = {
+            subscription.user_id for subscription in subscriptions
+        }
+        before = Subscription.objects.filter(
+            user_id__in=subscriber_ids
+        ).count()
+        Subscription.objects.bulk_create(
+            subscriptions, batch_size=1000, ignore_conflicts=True
+        )
+        inserted = Subscription.objects.filter(
+            user_id__in=subscriber_ids
+        ).count() - before
+
+        # The skipped Subscriptions are unknown, so the counters are
+        # recounted rather than incremented
+        recount_subscribers(list({
+            subscription.subscribed_to_user_id
+            for subscription in subscriptions
+        }))
+        bump_user_versions(*{
+            user_id for subscription in subscriptions
+            for user_id in (subscription.user_id,
+                            subscription.subscribed_to_user_id)
+        })
+        return inserted, invalid
+
+    def limit_subscriptions(self, subscriptions):
+        """
+        Drops the new Subscriptions over the MAX_SUBSCRIPTIONS of their User,
+        counting the User's existing ones, under the same locks as the
+        subscribes take.
+
+        Returns:
+            tuple: The kept Subscriptions and the number of the dropped ones.
+        """
+        user_ids = {subscription.user_id for subscription in subscriptions}
+        lock_subscriptions(user_ids)
+        counts = dict(Subscription.objects.filter(
+            user_id__in=user_ids
+        ).values_list('user_id').annotate(count=Count('id')).order_by())
+        existing = set(Subscription.objects.filter(
+            user_id__in=user_ids,
+            subscribed_to_user_id__in={
+                subscription.subscribed_to_user_id
+                for subscription in subscriptions
+            }
+        ).values_list('user_id', 'subscribed_to_user_id'))
+
+        kept, dropped = [], 0
+        for subscription in subscriptions:
+            key = (subscription.user_id, subscription.subscribed_to_user_id)
+            if key in existing:
+                continue
+            if counts.get(subscription.user_id, 0) >= MAX_SUBSCRIPTIONS:
+                self.stderr.write(
+                    f'The User {subscription.user_id} already has '
+                    f'{MAX_SUBSCRIPTIONS} Subscriptions'
+                )
+                dropped += 1
+                continue
+            existing.add(key)
+            counts[subscription.user_id] = \
+                counts.get(subscription.user_id, 0) + 1
+            kept.append(subscription)
+        return kept, dropped
+
+    def copy(self, model, instances, columns):
+        """
+        Writes the instances with a single PostgreSQL COPY statement.
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for instance in instances:
+            writer.writerow([
+                '\\N' if getattr(instance, column) is None
+                else getattr(instance, column)
+                for column in columns
+            ])
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {model._meta.db_table} ({", ".join(columns)}) '
+                f"FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                buffer
+            )
@@ -0,0 +1,67 @@
+import time
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Sends concurrent HTTP requests to a running server and reports ' \
+           'the throughput and the latency percentiles, for example to ' \
+           'compare the runserver and the production server profiles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='The URL to request.')
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument(
+            '--token',
+            help='The Authentication Token sent in the Authorization header.'
+        )
+
+    def send(self, url, headers):
+        request = Request(url, headers=headers)
+        started = time.perf_counter()
+        try:
+            with urlopen(request, timeout=30) as response:
+                response.read()
+                status = response.status
+        except HTTPError as e:
+            status = e.code
+        except URLError:
+            status = None
+        return status, time.perf_counter() - started
+
+    def handle(self, *args, **options):
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            results = list(pool.map(
+                lambda _: self.send(options['url'], headers),
+                range(options['requests'])
+            ))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for _, latency in results)
+        statuses = {}
+        for status, _ in results:
+            statuses[status] = statuses.get(status, 0) + 1
+        percentiles = statistics.quantiles(latencies, n=100) \
+            if len(latencies) > 1 else latencies * 99
+
+        self.stdout.write(
+            f'{options["requests"]} requests in {elapsed:.2f}s '
+            f'({options["requests"] / elapsed:.0f} req/s) '
+            f'with concurrency {options["concurrency"]}'
+        )
+        self.stdout.write(
+            f'Latency p50: {percentiles[49] * 1000:.1f} ms, '
+            f'p95: {percentiles[94] * 1000:.1f} ms, '
+            f'p99: {percentiles[98] * 1000:.1f} ms'
+        )
+        self.stdout.write(f'Status codes: {statuses}')
@@ -0,0 +1,27 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from social_network.profiling import merge_window_profiles, window_directory
+
+
+class Command(BaseCommand):
+    help = 'Merges the profiles of the requests profiled in the ' \
+           'ProfilingWindow by all the workers into a single collapsed ' \
+           'stacks and speedscope file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('window_id', type=int,
+                            help='The id of the ProfilingWindow.')
+
+    def handle(self, *args, **options):
+        window_id = options['window_id']
+        if not os.path.isdir(window_directory(window_id)):
+            raise CommandError(f'No requests were profiled in the window '
+                               f'{window_id}')
+
+        path, requests = merge_window_profiles(window_id)
+        self.stdout.write(
+            f'Merged {requests} requests into {path}.collapsed and '
+            f'{path}.speedscope.json'
+        )
@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from rest_framework.test import APIClient
+
+from social_network.budgets import seed_budget_dataset, get_api_routes, \
+    measure_get_routes, get_budget
+
+
+class Command(BaseCommand):
+    help = 'Lists the observed and the budgeted queries and time of every ' \
+           'API route, measured on a small seeded dataset which is rolled ' \
+           'back afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=5,
+            help='The number of the seeded Users.'
+        )
+        parser.add_argument(
+            '--posts', type=int, default=10,
+            help='The number of the seeded Posts of every User.'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = seed_budget_dataset(options['users'], options['posts'])
+            results = measure_get_routes(APIClient(), user)
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            f'{"Route":<45} {"Method":<7} {"Status":>6} {"Queries":>8} '
+            f'{"Budget":>7} {"Time, ms":>9} {"Budget":>7}  Result'
+        )
+        exceeded = 0
+        for path, view_class, response, check in results:
+            path = path.split('?')[0]
+            if check is None:
+                self.stdout.write(f'{path:<45} {"GET":<7} '
+                                  f'{response.status_code:>6}  not checked')
+                continue
+            violations = check.violations()
+            exceeded += bool(violations)
+            self.stdout.write(
+                f'{path:<45} {"GET":<7} {response.status_code:>6} '
+                f'{len(check.queries):>8} '
+                f'{self.format(check.query_budget):>7} '
+                f'{check.elapsed * 1000:>9.1f} '
+                f'{self.format(check.time_budget, 1000):>7}  '
+                f'{"OVER" if violations else "OK"}'
+            )
+
+        # The writes are not measured, their budgets are listed to review
+        for _, pattern, view_class in get_api_routes():
+            for method in view_class.http_method_names:
+                method = method.upper()
+                if method in ('GET', 'HEAD', 'OPTIONS') \
+                        or not hasattr(view_class, method.lower()):
+                    continue
+                query_budget = get_budget(view_class, method, 'query_budget')
+                time_budget = get_budget(view_class, method, 'time_budget')
+                route = f'{settings.API_URL_PREFIX}{pattern.pattern}'
+                self.stdout.write(
+                    f'{route:<45} {method:<7} '
+                    f'{"":>6} {"":>8} {self.format(query_budget):>7} '
+                    f'{"":>9} {self.format(time_budget, 1000):>7}  '
+                    f'not measured'
+                )
+
+        if exceeded:
+            raise CommandError(f'{exceeded} routes exceeded their budgets')
+
+    def format(self, budget, scale=1):
+        return '-' if budget is None else f'{budget * scale:g}'
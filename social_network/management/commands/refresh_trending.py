@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from social_network.trending import refresh_trending, rebuild_trending
+
+
+class Command(BaseCommand):
+    help = 'Adds the Posts created since the last run to the trending ' \
+           'lists. Meant to be run every minute or so, for example from ' \
+           'cron, and with --rebuild every few hours.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='The number of the Posts read in a single transaction.'
+        )
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Recomputes the lists with the current followers counts.'
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['rebuild']:
+            total = rebuild_trending(options['batch_size'])
+        else:
+            total = 0
+            while True:
+                count = refresh_trending(options['batch_size'])
+                if not count:
+                    break
+                total += count
+        self.stdout.write(
+            f'Read {total} Posts in '
+            f'{time.perf_counter() - started:.2f} seconds'
+        )
@@ -0,0 +1,79 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from social_network.deletion import claim_job, run_job
+from social_network.models import DeletionJob
+
+
+class Command(BaseCommand):
+    help = 'Runs the queued deletions of the accounts and of the reference ' \
+           'data in small throttled batches. Meant to be run periodically, ' \
+           'for example from cron. The interrupted jobs are resumed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='The number of the rows deleted in a single transaction.'
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=0.05,
+            help='The number of seconds slept between the batches.'
+        )
+        parser.add_argument(
+            '--job', type=int,
+            help='Runs only the job with the given id, retrying it if it '
+                 'has failed.'
+        )
+        parser.add_argument(
+            '--retry-failed', action='store_true',
+            help='Also retries the failed jobs, resuming them where they '
+                 'stopped.'
+        )
+        parser.add_argument(
+            '--status', action='store_true',
+            help='Lists the unfinished and the failed jobs with their '
+                 'progress instead of running them.'
+        )
+
+    def handle(self, *args, **options):
+        if options['status']:
+            self.show_status()
+            return
+
+        statuses = [DeletionJob.PENDING, DeletionJob.RUNNING]
+        if options['retry_failed'] or options['job'] is not None:
+            statuses.append(DeletionJob.FAILED)
+        jobs = DeletionJob.objects.filter(
+            status__in=statuses
+        ).order_by('created_datetime')
+        if options['job'] is not None:
+            jobs = jobs.filter(id=options['job'])
+
+        for job in jobs:
+            if not claim_job(job):
+                continue
+
+            self.stdout.write(f'Running job {job.id}: {job}')
+            try:
+                run_job(job, batch_size=options['batch_size'],
+                        sleep=options['sleep'], log=self.stdout.write)
+            except Exception as error:
+                logging.error(msg=f'Deletion job {job.id} failed: {error}',
+                              stacklevel=logging.CRITICAL)
+                DeletionJob.objects.filter(id=job.id).update(
+                    status=DeletionJob.FAILED, error=str(error)
+                )
+                continue
+            self.stdout.write(f'Finished job {job.id}: {job.progress}')
+
+    def show_status(self):
+        jobs = DeletionJob.objects.exclude(
+            status=DeletionJob.DONE
+        ).order_by('created_datetime')
+        for job in jobs:
+            columns = [job.id, f'{job.target_type} {job.target_id}',
+                       job.status, job.stage or '-', job.progress]
+            if job.error:
+                columns.append(job.error)
+            self.stdout.write('\t'.join(str(column) for column in columns))
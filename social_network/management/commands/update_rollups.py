@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from social_network.analytics import ROLLUP_SOURCES, roll_up_batch, \
+    prune_hourly_activity
+
+
+class Command(BaseCommand):
+    help = 'Counts the Posts and Subscriptions created since the last run ' \
+           'into the hourly and daily activity rollups. Meant to be run ' \
+           'periodically, for example from cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='The number of the rows counted in a single transaction.'
+        )
+        parser.add_argument(
+            '--hourly-retention-days', type=int,
+            help='Removes the hourly rollups older than the given number of '
+                 'days, the daily rollups are kept.'
+        )
+
+    def handle(self, *args, **options):
+        for metric in ROLLUP_SOURCES:
+            started = time.perf_counter()
+            total = 0
+            while True:
+                count = roll_up_batch(metric, options['batch_size'])
+                if not count:
+                    break
+                total += count
+            self.stdout.write(
+                f'Rolled up {total} {metric} in '
+                f'{time.perf_counter() - started:.2f} seconds'
+            )
+
+        if options['hourly_retention_days'] is not None:
+            deleted = prune_hourly_activity(options['hourly_retention_days'])
+            self.stdout.write(f'Removed {deleted} hourly rollups')
@@ -0,0 +1,153 @@
+import logging
+
+from django.conf import settings
+from django.db import connection
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.middleware.csrf import CsrfViewMiddleware
+
+from .budgets import QueryBudgetExceeded, QueryRecorder, BudgetCheck, \
+    is_sampled
+from .profiling import SamplingProfiler, get_active_window, \
+    get_profiling_user, save_request_profile, save_window_profile
+
+# The response header naming the saved profile of the request
+PROFILE_RESPONSE_HEADER = 'X-Profile-Id'
+
+
+def is_api_request(request):
+    return request.path_info.startswith(settings.API_URL_PREFIX)
+
+
+class SkipForApiMixin:
+    """
+    Skips the middleware for the token authenticated API requests, so only
+    the admin and the other browser pages pay for it.
+    """
+    def __call__(self, request):
+        if is_api_request(request):
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class NonApiSessionMiddleware(SkipForApiMixin, SessionMiddleware):
+    pass
+
+
+class NonApiCsrfViewMiddleware(SkipForApiMixin, CsrfViewMiddleware):
+    def process_view(self, request, *args, **kwargs):
+        if is_api_request(request):
+            return None
+        return super().process_view(request, *args, **kwargs)
+
+
+class NonApiAuthenticationMiddleware(SkipForApiMixin,
+                                     AuthenticationMiddleware):
+    pass
+
+
+class NonApiMessageMiddleware(SkipForApiMixin, MessageMiddleware):
+    pass
+
+
+class QueryBudgetMiddleware:
+    """
+    Checks the queries and the time of the sampled requests against the
+    budgets declared by their views, see social_network.budgets.
+
+    With QUERY_BUDGETS['ENFORCE'], as in the test suite, every request is
+    checked and the exceeded budget fails the request. Otherwise only the
+    SAMPLE_RATE of the requests are checked, the others pay nothing, and
+    the exceeded budgets are logged with the SQL of the queries.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not is_sampled():
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        request._query_recorder = recorder
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+
+        check = getattr(request, '_budget_check', None)
+        if check is None:
+            return response
+
+        check.stop()
+        violations = check.violations()
+        if violations:
+            message = check.describe(violations)
+            if settings.QUERY_BUDGETS['ENFORCE']:
+                raise QueryBudgetExceeded(message)
+            logging.warning(msg=message, stacklevel=logging.CRITICAL)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        recorder = getattr(request, '_query_recorder', None)
+        view_class = getattr(view_func, 'view_class', None)
+        if recorder is None or view_class is None:
+            return None
+
+        # The queries of the middleware before the view are not counted
+        check = BudgetCheck(view_class, request.method)
+        check.start(recorder)
+        request._budget_check = check
+        return None
+
+
+class ProfilingMiddleware:
+    """
+    Samples the Python stacks and the SQL time of the profiled requests,
+    see social_network.profiling. Meant to be the first middleware, so the
+    other middleware and the rendering are profiled as well.
+
+    A request is profiled when the staff sends the PROFILING['HEADER']
+    header or when its path starts with the path prefix of a
+    ProfilingWindow open right now, which the staff creates in the admin.
+    The header's requests are authenticated before the profiler starts, so
+    the other clients cannot make the workers sample their requests, and
+    the name of their profile is returned in the X-Profile-Id header. The
+    windows' profiles are saved per request and merged with the
+    merge_profiles command.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.PROFILING['ENABLED']:
+            return self.get_response(request)
+
+        requested = settings.PROFILING['HEADER'] in request.META
+        if requested:
+            user = get_profiling_user(request)
+            requested = user is not None and user.is_staff
+        window = get_active_window()
+        if window is not None and not request.path_info.startswith(window[1]):
+            window = None
+        if not requested and window is None:
+            return self.get_response(request)
+
+        profiler = SamplingProfiler()
+        request._profiler = profiler
+        profiler.start()
+        try:
+            with connection.execute_wrapper(profiler):
+                response = self.get_response(request)
+        finally:
+            profiler.stop()
+
+        try:
+            if window is not None:
+                save_window_profile(profiler, request, window[0])
+            if requested:
+                response[PROFILE_RESPONSE_HEADER] = save_request_profile(
+                    profiler, request
+                )
+        except OSError as e:
+            logging.error(msg=f'Saving the profile failed: {e}',
+                          stacklevel=logging.CRITICAL)
+        return response
@@ -0,0 +1,42 @@
+# Generated by Django 4.1.1 on 2026-10-19 12:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_existing_tokens(apps, schema_editor):
+    # Keeping the already issued tokens valid as the default device tokens
+    Token = apps.get_model('authtoken', 'Token')
+    AuthToken = apps.get_model('social_network', 'AuthToken')
+    AuthToken.objects.bulk_create([
+        AuthToken(key=token.key, user_id=token.user_id, device='default',
+                  created_datetime=token.created)
+        for token in Token.objects.all()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social_network', '0002_user_version'),
+        ('authtoken', '0003_tokenproxy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=40, unique=True)),
+                ('device', models.CharField(default='default', max_length=100)),
+                ('created_datetime', models.DateTimeField()),
+                ('expires_datetime', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='auth_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'device')},
+            },
+        ),
+        migrations.RunPython(copy_existing_tokens, migrations.RunPython.noop),
+    ]
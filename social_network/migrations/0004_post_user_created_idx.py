@@ -0,0 +1,17 @@
+# Generated by Django 4.1.1 on 2026-10-19 12:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social_network', '0003_authtoken'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['user', 'created_datetime'], name='post_user_created_idx'),
+        ),
+    ]
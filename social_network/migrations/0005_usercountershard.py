@@ -0,0 +1,45 @@
+# Generated by Django 4.1.1 on 2026-10-19 12:26
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_existing_subscribers(apps, schema_editor):
+    # Starting the subscribers counters from the existing Subscriptions
+    Subscription = apps.get_model('social_network', 'Subscription')
+    UserCounterShard = apps.get_model('social_network', 'UserCounterShard')
+    UserCounterShard.objects.bulk_create([
+        UserCounterShard(user_id=row['subscribed_to_user'],
+                         name='subscribers', shard=0, value=row['count'])
+        for row in Subscription.objects.filter(
+            subscribed_to_user__isnull=False
+        ).values('subscribed_to_user').annotate(
+            count=models.Count('id')
+        ).order_by()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social_network', '0004_post_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserCounterShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('value', models.BigIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='counter_shards', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'name', 'shard')},
+            },
+        ),
+        migrations.RunPython(count_existing_subscribers,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.1.1 on 2026-10-19 12:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social_network', '0006_deletionjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=20)),
+                ('day', models.DateField()),
+                ('country_id', models.BigIntegerField()),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'daily activities',
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=20, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_datetime', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HourlyActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=20)),
+                ('hour', models.DateTimeField()),
+                ('country_id', models.BigIntegerField()),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'hourly activities',
+                'unique_together': {('metric', 'hour', 'country_id')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='dailyactivity',
+            index=models.Index(fields=['metric', 'country_id', 'day'], name='dailyactivity_country_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailyactivity',
+            unique_together={('metric', 'day', 'country_id')},
+        ),
+    ]
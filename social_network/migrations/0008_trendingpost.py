@@ -0,0 +1,32 @@
+# Generated by Django 4.1.1 on 2026-10-19 12:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social_network', '0007_activity_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingPost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('country_id', models.BigIntegerField()),
+                ('score', models.FloatField()),
+                ('created_datetime', models.DateTimeField()),
+                ('post', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='social_network.post')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='trendingpost',
+            index=models.Index(fields=['country_id', '-score'], name='trendingpost_score_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='trendingpost',
+            unique_together={('country_id', 'post')},
+        ),
+    ]
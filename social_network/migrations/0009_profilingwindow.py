@@ -0,0 +1,23 @@
+# Generated by Django 4.1.1 on 2026-10-19 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social_network', '0008_trendingpost'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfilingWindow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path_prefix', models.CharField(default='/api/', max_length=200)),
+                ('started_datetime', models.DateTimeField()),
+                ('ends_datetime', models.DateTimeField()),
+                ('requested_by', models.BigIntegerField(blank=True, null=True)),
+            ],
+        ),
+    ]
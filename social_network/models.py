@@ -41,6 +41,10 @@ class User(AbstractUser):
                              blank=True, null=True)
     biography = models.CharField(max_length=255, blank=True, null=True)
     birth_date = models.DateField(blank=True, null=True)
+    # Bumped on every write to the User's profile, interests, posts and
+    # subscriptions, used for the conditional GET validators
+    version = models.PositiveBigIntegerField(default=0)
+    modified_datetime = models.DateTimeField(blank=True, null=True)
 
     def last_five_posts(self):
         return self.posts.all().order_by('-created_datetime')[:5]
@@ -69,6 +73,14 @@ class Post(models.Model):
     modified_datetime = models.DateTimeField(blank=True, null=True)
     modified_by = models.BigIntegerField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Serves the User's Posts ordered and filtered by the created
+            # datetime, see PostFilterSet
+            models.Index(fields=['user', 'created_datetime'],
+                         name='post_user_created_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -92,3 +104,190 @@ class Subscription(models.Model):
                f'{self.user.username} , to: ' \
                f'{self.subscribed_to_user.username}'
 
+
+class AuthToken(models.Model):
+    """
+    The Authentication Token of the User's device.
+
+    Every User has one token per device, so logging in on a new device does
+    not log out the others. The tokens with the expires_datetime are
+    extended on use, see the AUTH_TOKEN setting.
+    """
+    key = models.CharField(max_length=40, unique=True)
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING,
+                             related_name='auth_tokens')
+    device = models.CharField(max_length=100, default='default')
+    created_datetime = models.DateTimeField()
+    expires_datetime = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ('user', 'device', )
+
+    def __str__(self):
+        return f'{self.user_id} - {self.device}'
+
+
+class UserCounterShard(models.Model):
+    """
+    A shard of the User's counter, such as the number of their subscribers.
+
+    The counter is split into the shards chosen at random on every write,
+    so the bursts of writes to a popular User's counter do not queue up on
+    a single row lock. The counter is the sum of its shards, which are
+    periodically compacted into the shard 0, see social_network.counters.
+    """
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING,
+                             related_name='counter_shards')
+    name = models.CharField(max_length=50)
+    shard = models.PositiveSmallIntegerField()
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'name', 'shard', )
+
+    def __str__(self):
+        return f'{self.user_id} - {self.name} - {self.shard}'
+
+
+class DeletionJob(models.Model):
+    """
+    The queued deletion of a User's account or of a Country, City or
+    Interest together with the rows depending on it.
+
+    The API only enqueues the jobs, the run_deletion_jobs command deletes
+    the dependent rows in small batches, each in its own short transaction,
+    keeping the deleted rows counts per stage in the progress.
+    """
+    TARGET_TYPES = (
+        ('user', 'User'),
+        ('country', 'Country'),
+        ('city', 'City'),
+        ('interest', 'Interest'),
+    )
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    target_type = models.CharField(max_length=20, choices=TARGET_TYPES)
+    target_id = models.BigIntegerField()
+    status = models.CharField(max_length=20, choices=STATUSES,
+                              default=PENDING)
+    stage = models.CharField(max_length=50, blank=True)
+    progress = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    requested_by = models.BigIntegerField(blank=True, null=True)
+    created_datetime = models.DateTimeField()
+    started_datetime = models.DateTimeField(blank=True, null=True)
+    updated_datetime = models.DateTimeField(blank=True, null=True)
+    finished_datetime = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_datetime'],
+                         name='deletionjob_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.target_type} {self.target_id} - {self.status}'
+
+
+class HourlyActivity(models.Model):
+    """
+    The number of the Posts or Subscriptions created in an hour, per the
+    Country of their User, see the update_rollups command.
+
+    The country_id is ALL_COUNTRIES for the total of all the Countries and
+    NO_COUNTRY for the Users without one, see social_network.analytics.
+    """
+    metric = models.CharField(max_length=20)
+    hour = models.DateTimeField()
+    country_id = models.BigIntegerField()
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'hourly activities'
+        unique_together = ('metric', 'hour', 'country_id', )
+
+    def __str__(self):
+        return f'{self.metric} - {self.hour} - {self.country_id}'
+
+
+class DailyActivity(models.Model):
+    """
+    The HourlyActivity rolled up into the days of the TIME_ZONE.
+    """
+    metric = models.CharField(max_length=20)
+    day = models.DateField()
+    country_id = models.BigIntegerField()
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'daily activities'
+        unique_together = ('metric', 'day', 'country_id', )
+        indexes = [
+            # Serves the charts of a Country over a range of days
+            models.Index(fields=['metric', 'country_id', 'day'],
+                         name='dailyactivity_country_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.metric} - {self.day} - {self.country_id}'
+
+
+class RollupWatermark(models.Model):
+    """
+    The id of the last Post or Subscription counted in the rollups.
+    """
+    metric = models.CharField(max_length=20, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_datetime = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f'{self.metric} - {self.last_id}'
+
+
+class TrendingPost(models.Model):
+    """
+    A Post of the precomputed trending list of a Country, see
+    social_network.trending. The country_id is 0 for the list of all the
+    Countries.
+    """
+    country_id = models.BigIntegerField()
+    post = models.ForeignKey(Post, on_delete=models.DO_NOTHING,
+                             related_name='+', db_constraint=False)
+    score = models.FloatField()
+    # Copied from the Post, so the aged out Posts are removed without a join
+    created_datetime = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('country_id', 'post', )
+        indexes = [
+            models.Index(fields=['country_id', '-score'],
+                         name='trendingpost_score_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.country_id} - {self.post_id} - {self.score}'
+
+
+class ProfilingWindow(models.Model):
+    """
+    The time window in which the requests to the paths starting with the
+    path_prefix are profiled by every worker, see
+    social_network.profiling. Created by the staff in the admin.
+    """
+    path_prefix = models.CharField(max_length=200, default='/api/')
+    started_datetime = models.DateTimeField()
+    ends_datetime = models.DateTimeField()
+    requested_by = models.BigIntegerField(blank=True, null=True)
+
+    def __str__(self):
+        return f'{self.path_prefix} - {self.started_datetime} - ' \
+               f'{self.ends_datetime}'
@@ -0,0 +1,283 @@
+import os
+import re
+import sys
+import json
+import time
+import threading
+from collections import Counter
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.http import HttpRequest
+from django.utils import timezone
+
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+# The synthetic leaf frame of the samples taken while a query is running
+SQL_FRAME_PREFIX = '[SQL] '
+
+SQL_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+"?(\w+)"?', re.IGNORECASE)
+
+
+def describe_sql(sql):
+    """
+    Returns:
+        str: The statement's verb and first table, such as
+        "SELECT social_network_post", so the samples of the alike queries
+        are merged regardless of their parameters.
+    """
+    words = sql.split(None, 1)
+    verb = words[0].upper() if words else ''
+    table = SQL_TABLE.search(sql)
+    return f'{SQL_FRAME_PREFIX}{verb} {table.group(1)}' if table \
+        else f'{SQL_FRAME_PREFIX}{verb}'
+
+
+def frame_name(frame):
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', '?')
+    return f'{module}.{code.co_qualname}'
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stack of a single thread every INTERVAL seconds from
+    a background thread, so the profiled code runs unmodified and the cost
+    does not grow with the number of the calls.
+
+    Also a database execute wrapper: the samples taken while a query is
+    running end with its SQL frame, and the queries' count and time are
+    summed, so the flamegraph tells the ORM code from the database time.
+    """
+    def __init__(self, interval=None, thread_id=None):
+        self.interval = interval or settings.PROFILING['INTERVAL']
+        self.thread_id = thread_id or threading.get_ident()
+        self.samples = Counter()
+        self.sql_count = 0
+        self.sql_time = 0
+        self.elapsed = 0
+        self.current_sql = None
+        self._stopped = threading.Event()
+        self._thread = None
+        self._started = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.current_sql = describe_sql(sql)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.sql_count += 1
+            self.current_sql = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self.run, daemon=True,
+                                        name='sampling-profiler')
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self._started
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame))
+                frame = frame.f_back
+            stack.reverse()
+            sql = self.current_sql
+            if sql is not None:
+                stack.append(sql)
+            self.samples[tuple(stack)] += 1
+
+
+def write_collapsed(path, samples):
+    """
+    Writes the samples in the collapsed stacks format read by flamegraph.pl
+    and most of the flamegraph viewers: a line of the semicolon separated
+    frames, from the root, and the number of the samples per stack.
+    """
+    with open(path, 'w') as file:
+        for stack, count in sorted(samples.items()):
+            file.write(f'{";".join(stack)} {count}\n')
+
+
+def read_collapsed(path, samples=None):
+    samples = Counter() if samples is None else samples
+    with open(path) as file:
+        for line in file:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                samples[tuple(stack.split(';'))] += int(count)
+    return samples
+
+
+def write_speedscope(path, samples, interval, name):
+    """
+    Writes the samples as a sampled profile of the speedscope file format,
+    weighted by the sampling interval in seconds.
+    """
+    frames, frame_ids, stacks, weights = [], {}, [], []
+    for stack, count in sorted(samples.items()):
+        ids = []
+        for frame in stack:
+            if frame not in frame_ids:
+                frame_ids[frame] = len(frames)
+                frames.append({'name': frame})
+            ids.append(frame_ids[frame])
+        stacks.append(ids)
+        weights.append(count * interval)
+
+    with open(path, 'w') as file:
+        json.dump({
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'social_network.profiling',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': stacks,
+                'weights': weights,
+            }],
+        }, file)
+
+
+def get_profiling_user(request):
+    """
+    Authenticates the request asking to be profiled, before the other
+    middleware and the view do, with the API's authentication classes or
+    the session of the admin pages, so only the staff starts the profiler.
+
+    Returns:
+        User: The authenticated User or None.
+    """
+    api_request = Request(request, authenticators=[
+        authentication() for authentication
+        in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    ])
+    try:
+        user = api_request.user
+    except APIException:
+        user = None
+    # Set by the Request, the middleware and the view authenticate again
+    request.__dict__.pop('user', None)
+    if user is not None and user.is_authenticated:
+        return user
+
+    session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if session_key is None:
+        return None
+    session_request = HttpRequest()
+    session_request.session = import_module(
+        settings.SESSION_ENGINE
+    ).SessionStore(session_key)
+    user = get_user(session_request)
+    return user if user.is_authenticated else None
+
+
+def profile_name(request):
+    path = request.path_info.strip('/').replace('/', '-') or 'root'
+    return f'{timezone.now():%Y%m%d-%H%M%S-%f}-{os.getpid()}-' \
+           f'{threading.get_ident()}-{path}'
+
+
+def save_request_profile(profiler, request):
+    """
+    Writes the single request's profile as both the collapsed stacks and
+    the speedscope file to the PROFILE_DIR.
+
+    Returns:
+        str: The name of the files, without their extensions.
+    """
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    name = profile_name(request)
+    path = os.path.join(settings.PROFILE_DIR, name)
+    write_collapsed(f'{path}.collapsed', profiler.samples)
+    write_speedscope(
+        f'{path}.speedscope.json', profiler.samples, profiler.interval,
+        f'{request.method} {request.path}: {profiler.elapsed:.3f} seconds, '
+        f'{profiler.sql_count} queries in {profiler.sql_time:.3f} seconds'
+    )
+    return name
+
+
+def save_window_profile(profiler, request, window_id):
+    """
+    Writes the collapsed stacks of the request profiled in the window to
+    the window's directory, merged by the merge_profiles command.
+    """
+    directory = window_directory(window_id)
+    os.makedirs(directory, exist_ok=True)
+    write_collapsed(
+        os.path.join(directory, f'{profile_name(request)}.collapsed'),
+        profiler.samples
+    )
+
+
+def window_directory(window_id):
+    return os.path.join(settings.PROFILE_DIR, f'window-{window_id}')
+
+
+_active_window = {'checked': None, 'window': None}
+
+
+def get_active_window():
+    """
+    Reads the ProfilingWindow open right now, checked at most once every
+    PROFILING['WINDOW_POLL'] seconds by every worker process, so the
+    requests outside of the windows cost no queries.
+
+    Returns:
+        tuple: The (id, path prefix) of the window or None.
+    """
+    from .models import ProfilingWindow
+
+    checked = time.monotonic()
+    if _active_window['checked'] is not None and \
+            checked - _active_window['checked'] < \
+            settings.PROFILING['WINDOW_POLL']:
+        return _active_window['window']
+
+    now = timezone.now()
+    window = ProfilingWindow.objects.filter(
+        started_datetime__lte=now, ends_datetime__gt=now
+    ).order_by('-id').values_list('id', 'path_prefix').first()
+    _active_window.update(checked=checked, window=window)
+    return window
+
+
+def merge_window_profiles(window_id):
+    """
+    Merges the collapsed stacks of all the requests profiled in the window
+    by all the workers into a single collapsed and speedscope file.
+
+    Returns:
+        tuple: The path of the merged files, without their extensions,
+        and the number of the merged requests.
+    """
+    directory = window_directory(window_id)
+    samples, requests = Counter(), 0
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith('.collapsed'):
+            read_collapsed(os.path.join(directory, file_name), samples)
+            requests += 1
+
+    path = os.path.join(settings.PROFILE_DIR, f'window-{window_id}-merged')
+    write_collapsed(f'{path}.collapsed', samples)
+    write_speedscope(f'{path}.speedscope.json', samples,
+                     settings.PROFILING['INTERVAL'], f'window {window_id}')
+    return path, requests
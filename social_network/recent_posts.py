@@ -0,0 +1,126 @@
+from django.core.cache import caches
+from django.db.models import OuterRef, Subquery
+
+from .models import Post
+
+# The number of the newest Posts kept per User
+RECENT_POSTS_COUNT = 5
+
+
+def get_cache():
+    return caches['recent-posts']
+
+
+def recent_posts_key(user_id):
+    return f'recent-posts:{user_id}'
+
+
+def render_posts(posts):
+    from .serializers import PostSerializer
+    return PostSerializer(posts, many=True).data
+
+
+def load_recent_posts(user_ids):
+    """
+    Loads the newest Posts of all the Users with a single query.
+
+    Returns:
+        dict: The lists of the rendered Posts keyed by the User's id.
+    """
+    newest_ids = Post.objects.filter(
+        user=OuterRef('user')
+    ).order_by('-created_datetime', '-id').values('id')[:RECENT_POSTS_COUNT]
+
+    posts = Post.objects.filter(
+        user__in=user_ids, id__in=Subquery(newest_ids)
+    ).select_related(
+        'user'
+    ).prefetch_related(
+        'user__interests__interest'
+    ).order_by('user', '-created_datetime', '-id')
+
+    recent_posts = {user_id: [] for user_id in user_ids}
+    for post, payload in zip(posts, render_posts(posts)):
+        recent_posts[post.user_id].append(payload)
+    return recent_posts
+
+
+def get_recent_posts(users):
+    """
+    Gets the newest rendered Posts of the Users.
+
+    The cached lists are fetched with a single multi-get and used only if
+    their generation matches the User's version, which is bumped on every
+    write to the User's posts and profile. The stale and missing lists are
+    loaded with a single query and cached.
+
+    Args:
+        users (list): The User instances with their version loaded
+
+    Returns:
+        dict: The lists of the rendered Posts keyed by the User's id.
+    """
+    cache = get_cache()
+    entries = cache.get_many([recent_posts_key(user.id) for user in users])
+
+    recent_posts, stale = {}, []
+    for user in users:
+        entry = entries.get(recent_posts_key(user.id))
+        if entry is not None and entry['generation'] == user.version:
+            recent_posts[user.id] = entry['posts']
+        else:
+            stale.append(user)
+
+    if stale:
+        loaded = load_recent_posts([user.id for user in stale])
+        cache.set_many({
+            recent_posts_key(user.id): {
+                'generation': user.version, 'posts': loaded[user.id]
+            }
+            for user in stale
+        })
+        recent_posts.update(loaded)
+    return recent_posts
+
+
+def remember_post(post, previous_version, created=False):
+    """
+    Writes the created or updated Post through to its User's cached list.
+
+    Must be called after the User's version has been bumped from the
+    previous_version. The list is only updated if it is of the previous
+    version, otherwise a concurrent write might be missing from it and it
+    is dropped instead.
+
+    Args:
+        post (Post): The created or updated Post
+        previous_version (int): The User's version before the write
+        created (bool): Whether the Post has just been created
+
+    Returns:
+        None.
+    """
+    cache = get_cache()
+    key = recent_posts_key(post.user_id)
+    entry = cache.get(key)
+    if entry is None:
+        return
+    if entry['generation'] != previous_version:
+        cache.delete(key)
+        return
+
+    payload = render_posts([post])[0]
+    posts = [payload if cached['id'] == post.id else cached
+             for cached in entry['posts']]
+    if created:
+        posts = [payload, *posts][:RECENT_POSTS_COUNT]
+
+    cache.set(key, {'generation': previous_version + 1, 'posts': posts})
+
+
+def forget_recent_posts(*user_ids):
+    """
+    Drops the cached lists of the Users whose Posts have been deleted.
+    """
+    get_cache().delete_many([recent_posts_key(user_id)
+                             for user_id in user_ids if user_id is not None])
@@ -1,15 +1,233 @@
+from django.db import models
 from django.utils import timezone
+from django.core.exceptions import FieldDoesNotExist
 
 from rest_framework import serializers
+from rest_framework.authtoken.serializers import AuthTokenSerializer
 from django.contrib.auth.password_validation import validate_password
 
 from .token_generator import create_or_update_auth_token
-from .models import UserInterest, Country, City, Interest, Post, Subscription
+from .conditional import bump_user_versions
+from .fields import CachedPrimaryKeyRelatedField, RecentPostsField
+from .recent_posts import get_recent_posts, remember_post
+from .counters import SUBSCRIBERS, get_counter, get_counters
+from .batch import BATCH_MAX_REQUESTS, BATCH_REQUEST_HEADERS
+from .models import UserInterest, Country, City, Interest, Post, \
+    Subscription, AuthToken
 
 from django.contrib.auth import get_user_model
 User = get_user_model()
 
 
+class SparseFieldsetMixin:
+    """
+    Lets the clients select the fields of the response with the fields and
+    expand query parameters, for example: ?fields=id,username,interests
+
+    Once either parameter is given, only the listed fields are returned and
+    the nested serializers not listed in expand are rendered as the primary
+    keys. Without them the serializer returns all of its fields expanded.
+
+    The compact shape, selected with ?shape=compact, renders the nested
+    Users of the side_loaded_fields as their ids and returns each of them
+    once in the included map instead.
+    """
+    # The extra prefetch_related() lookups of the expanded nested fields
+    expand_lookups = {}
+    # The attribute of the related records rendered by the collapsed nested
+    # fields instead of their primary keys, such as the Interest's id of a
+    # UserInterest
+    collapsed_slugs = {}
+    # The nested Users returned in the included map of the compact shape
+    side_loaded_fields = ()
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None and expand is None:
+            return
+
+        selected, expanded = self.check_fieldset(self.fields, fields, expand)
+        for name in list(self.fields):
+            if name not in selected:
+                self.fields.pop(name)
+                continue
+
+            field = self.fields[name]
+            if is_nested(field) and name not in expanded \
+                    and hasattr(field, 'collapse'):
+                self.fields[name] = field.collapse()
+            elif is_nested(field) and name not in expanded:
+                kwargs = {
+                    'many': getattr(field, 'many', False),
+                    'read_only': True,
+                    'source': None if field.source == name else field.source,
+                }
+                if name in self.collapsed_slugs:
+                    self.fields[name] = serializers.SlugRelatedField(
+                        slug_field=self.collapsed_slugs[name], **kwargs
+                    )
+                else:
+                    self.fields[name] = \
+                        serializers.PrimaryKeyRelatedField(**kwargs)
+
+    @classmethod
+    def parse_fieldset(cls, query_params, compact=False):
+        """
+        Parses the fields and expand query parameters.
+
+        Args:
+            query_params (QueryDict): The query parameters
+            compact (bool): Whether the compact shape is requested, which
+                renders the side_loaded_fields as the ids
+
+        Returns:
+            dict: The fields and expand keyword arguments of the serializer,
+            empty if the client has not selected the fields.
+        """
+        fieldset = {}
+        for param in ('fields', 'expand', ):
+            value = query_params.get(param)
+            if value is not None:
+                fieldset[param] = [
+                    name.strip() for name in value.split(',') if name.strip()
+                ]
+
+        if compact:
+            fieldset['expand'] = [
+                name for name in fieldset.get('expand', [])
+                if name not in cls.side_loaded_fields
+            ]
+        return fieldset
+
+    @classmethod
+    def compact_data(cls, instances, **fieldset):
+        """
+        Serializes the instances into the compact shape:
+        {"data": [...], "included": {"users": {"<id>": {...}}}}
+
+        Args:
+            instances (iterable): The instances narrowed with the fieldset
+                parsed for the compact shape
+            fieldset (dict): The fields and expand keyword arguments
+
+        Returns:
+            dict: The compact response data.
+        """
+        data = cls(instances, many=True, **fieldset).data
+
+        user_ids = {
+            record[name] for record in data
+            for name in cls.side_loaded_fields
+            if record.get(name) is not None
+        }
+        users = UserSerializer.narrow_queryset(
+            User.objects.filter(id__in=user_ids)
+        ) if user_ids else []
+
+        return {
+            'data': data,
+            'included': {
+                'users': {
+                    user['id']: user
+                    for user in UserSerializer(users, many=True).data
+                },
+            },
+        }
+
+    @staticmethod
+    def check_fieldset(serializer_fields, fields, expand):
+        selected = list(serializer_fields) if fields is None else fields
+        expanded = expand or []
+
+        errors = {}
+        unknown = [name for name in selected if name not in serializer_fields]
+        if unknown:
+            errors['fields'] = [f'Unknown fields: {", ".join(unknown)}.']
+        not_nested = [
+            name for name in expanded
+            if name not in serializer_fields
+            or not is_nested(serializer_fields[name])
+        ]
+        if not_nested:
+            errors['expand'] = [
+                f'The fields cannot be expanded: {", ".join(not_nested)}.'
+            ]
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        # The expanded fields are always returned
+        return set(selected) | set(expanded), set(expanded)
+
+    @classmethod
+    def narrow_queryset(cls, queryset, fields=None, expand=None):
+        """
+        Narrows the queryset down to the selected fields.
+
+        Only the selected columns are loaded, the selected single relations
+        are joined when expanded and the selected multi-valued relations are
+        prefetched, so the unused relations cost no queries.
+        """
+        serializer_fields = cls().fields
+        fieldset_given = fields is not None or expand is not None
+        if fieldset_given:
+            selected, expanded = cls.check_fieldset(
+                serializer_fields, fields, expand
+            )
+        else:
+            selected = set(serializer_fields)
+            expanded = {name for name, field in serializer_fields.items()
+                        if is_nested(field)}
+
+        opts = queryset.model._meta
+        only, select_related, prefetch_related = [opts.pk.name], [], []
+        for name in selected:
+            field = serializer_fields[name]
+            only.extend(getattr(field, 'required_model_fields', ()))
+            try:
+                model_field = opts.get_field(field.source)
+            except FieldDoesNotExist:
+                continue
+
+            if model_field.many_to_one or model_field.one_to_one:
+                only.append(model_field.name)
+                if name in expanded:
+                    select_related.append(model_field.name)
+            elif model_field.is_relation:
+                prefetch_related.append(model_field.name)
+            else:
+                only.append(model_field.name)
+
+            if name in expanded:
+                prefetch_related.extend(cls.expand_lookups.get(name, ()))
+
+        if fieldset_given:
+            queryset = queryset.only(*only)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+
+def is_nested(field):
+    return isinstance(field, serializers.BaseSerializer) \
+        or hasattr(field, 'collapse')
+
+
+# The shapes of the list responses, see SparseFieldsetMixin
+RESPONSE_SHAPES = ('legacy', 'compact', )
+
+
+def parse_shape(query_params):
+    shape = query_params.get('shape') or 'legacy'
+    if shape not in RESPONSE_SHAPES:
+        raise serializers.ValidationError({
+            'shape': [f'The shape must be one of: '
+                      f'{", ".join(RESPONSE_SHAPES)}.']
+        })
+    return shape
+
+
 class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=True,
                                      validators=[validate_password])
@@ -37,7 +255,15 @@ class RegisterSerializer(serializers.ModelSerializer):
         return user
 
 
-class UserInterestSerializer(serializers.ModelSerializer):
+class LoginSerializer(AuthTokenSerializer):
+    device = serializers.CharField(
+        max_length=AuthToken._meta.get_field('device').max_length,
+        required=False, allow_blank=True, write_only=True
+    )
+
+
+class UserInterestSerializer(SparseFieldsetMixin,
+                             serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(many=False,
                                               queryset=User.objects.all())
 
@@ -52,7 +278,7 @@ class UserInterestCreateSerializer(serializers.ModelSerializer):
         many=False,
         queryset=User.objects.all()
     )
-    interest = serializers.PrimaryKeyRelatedField(
+    interest = CachedPrimaryKeyRelatedField(
         many=False,
         queryset=Interest.objects.all()
     )
@@ -69,8 +295,11 @@ class UserInterestForUserSerializer(serializers.ModelSerializer):
         depth = 1
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsetMixin,
+                     serializers.ModelSerializer):
     interests = UserInterestForUserSerializer(many=True)
+    expand_lookups = {'interests': ('interests__interest', )}
+    collapsed_slugs = {'interests': 'interest_id'}
 
     class Meta:
         model = User
@@ -90,6 +319,7 @@ class UserSerializer(serializers.ModelSerializer):
 
 class UserInterestUpdateSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(required=False)
+    interest = CachedPrimaryKeyRelatedField(queryset=Interest.objects.all())
 
     class Meta:
         model = UserInterest
@@ -99,6 +329,12 @@ class UserInterestUpdateSerializer(serializers.ModelSerializer):
 class UserUpdateSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(required=False)
     interests = UserInterestUpdateSerializer(many=True)
+    country = CachedPrimaryKeyRelatedField(
+        queryset=Country.objects.all(), allow_null=True, required=False
+    )
+    city = CachedPrimaryKeyRelatedField(
+        queryset=City.objects.all(), allow_null=True, required=False
+    )
 
     class Meta:
         model = User
@@ -149,10 +385,12 @@ class UserUpdateSerializer(serializers.ModelSerializer):
             if user_interest.id not in keep_user_interests:
                 user_interest.delete()
 
+        bump_user_versions(instance.id)
         return instance
 
 
-class CountrySerializer(serializers.ModelSerializer):
+class CountrySerializer(SparseFieldsetMixin,
+                        serializers.ModelSerializer):
     class Meta:
         model = Country
         fields = ('id', 'name', )
@@ -174,7 +412,8 @@ class CountryUpdateSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', )
 
 
-class CitySerializer(serializers.ModelSerializer):
+class CitySerializer(SparseFieldsetMixin,
+                     serializers.ModelSerializer):
     class Meta:
         model = City
         fields = ('id', 'name', 'country', 'is_capital', )
@@ -183,8 +422,8 @@ class CitySerializer(serializers.ModelSerializer):
 
 class CityCreateSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(required=False)
-    country = serializers.PrimaryKeyRelatedField(many=False,
-                                                 queryset=Country.objects.all())
+    country = CachedPrimaryKeyRelatedField(many=False,
+                                           queryset=Country.objects.all())
 
     class Meta:
         model = City
@@ -193,15 +432,16 @@ class CityCreateSerializer(serializers.ModelSerializer):
 
 class CityUpdateSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(required=False)
-    country = serializers.PrimaryKeyRelatedField(many=False,
-                                                 queryset=Country.objects.all())
+    country = CachedPrimaryKeyRelatedField(many=False,
+                                           queryset=Country.objects.all())
 
     class Meta:
         model = City
         fields = ('id', 'country', 'name', 'is_capital', )
 
 
-class InterestSerializer(serializers.ModelSerializer):
+class InterestSerializer(SparseFieldsetMixin,
+                         serializers.ModelSerializer):
     class Meta:
         model = Interest
         fields = ('id', 'name', )
@@ -223,8 +463,11 @@ class InterestUpdateSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', )
 
 
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(SparseFieldsetMixin,
+                     serializers.ModelSerializer):
     user = UserSerializer()
+    expand_lookups = {'user': ('user__interests__interest', )}
+    side_loaded_fields = ('user', )
 
     class Meta:
         model = Post
@@ -254,7 +497,10 @@ class PostCreateSerializer(serializers.ModelSerializer):
         validated_data['user'] = user
         validated_data['created_datetime'] = timezone.now()
         validated_data['created_by'] = user.id
-        return Post.objects.create(**validated_data)
+        post = Post.objects.create(**validated_data)
+        bump_user_versions(user.id)
+        remember_post(post, user.version, created=True)
+        return post
 
 
 class PostUpdateSerializer(serializers.ModelSerializer):
@@ -280,24 +526,82 @@ class PostUpdateSerializer(serializers.ModelSerializer):
         instance.modified_datetime = timezone.now()
         instance.modified_by = user.id
         instance.save()
+        previous_version = instance.user.version
+        bump_user_versions(instance.user_id)
+        remember_post(instance, previous_version)
         return instance
 
 
-class SubscriptionSerializer(serializers.ModelSerializer):
+class SubscriptionSerializer(SparseFieldsetMixin,
+                             serializers.ModelSerializer):
     user = UserSerializer()
     subscribed_to_user = UserSerializer()
+    expand_lookups = {
+        'user': ('user__interests__interest', ),
+        'subscribed_to_user': ('subscribed_to_user__interests__interest', ),
+    }
+    side_loaded_fields = ('user', 'subscribed_to_user', )
 
     class Meta:
         model = Subscription
         fields = ('id', 'user', 'subscribed_to_user', 'created_datetime', )
 
 
-class UserDetailedSerializer(serializers.ModelSerializer):
-    posts = PostSerializer(many=True, source='last_five_posts')
+def count_by_user(manager, user_field, user_ids):
+    """
+    Counts the rows of all the Users with a single grouped query.
+
+    Returns:
+        dict: The counts keyed by the User's id, 0 for the Users without
+        any rows.
+    """
+    counts = dict.fromkeys(user_ids, 0)
+    counts.update(
+        manager.filter(**{f'{user_field}__in': user_ids}).values_list(
+            user_field
+        ).annotate(count=models.Count('id')).order_by()
+    )
+    return counts
+
+
+class UserDetailedListSerializer(serializers.ListSerializer):
+    """
+    Fetches the newest Posts of all the Users with a single multi-get and
+    each of their counts with a single query before rendering them.
+    """
+    def to_representation(self, data):
+        users = list(data.all() if isinstance(data, models.Manager) else data)
+        user_ids = [user.id for user in users]
+        if 'posts' in self.child.fields:
+            recent_posts = get_recent_posts(users)
+            for user in users:
+                user._recent_posts = recent_posts[user.id]
+        if 'posts_count' in self.child.fields:
+            posts_counts = count_by_user(Post.objects, 'user', user_ids)
+            for user in users:
+                user._posts_count = posts_counts[user.id]
+        if 'subscriptions_count' in self.child.fields:
+            subscriptions_counts = count_by_user(
+                Subscription.objects, 'user', user_ids
+            )
+            for user in users:
+                user._subscriptions_count = subscriptions_counts[user.id]
+        if 'subscribers_count' in self.child.fields:
+            subscribers_counts = get_counters(user_ids, SUBSCRIBERS)
+            for user in users:
+                user._subscribers_count = subscribers_counts[user.id]
+        return super().to_representation(users)
+
+
+class UserDetailedSerializer(SparseFieldsetMixin,
+                             serializers.ModelSerializer):
+    posts = RecentPostsField()
     interests = UserInterestForUserSerializer(many=True)
     posts_count = serializers.SerializerMethodField()
     subscriptions_count = serializers.SerializerMethodField()
     subscribers_count = serializers.SerializerMethodField()
+    expand_lookups = {'interests': ('interests__interest', )}
+    collapsed_slugs = {'interests': 'interest_id'}
 
     class Meta:
         model = User
@@ -317,12 +621,50 @@ class UserDetailedSerializer(serializers.ModelSerializer):
             'subscriptions_count',
             'subscribers_count'
         )
+        list_serializer_class = UserDetailedListSerializer
 
     def get_posts_count(self, instance):
-        return Post.objects.filter(user=instance.id).count()
+        posts_count = getattr(instance, '_posts_count', None)
+        if posts_count is None:
+            posts_count = Post.objects.filter(user=instance.id).count()
+        return posts_count
 
     def get_subscriptions_count(self, instance):
-        return Subscription.objects.filter(user=instance.id).count()
+        subscriptions_count = getattr(instance, '_subscriptions_count', None)
+        if subscriptions_count is None:
+            subscriptions_count = Subscription.objects.filter(
+                user=instance.id
+            ).count()
+        return subscriptions_count
 
     def get_subscribers_count(self, instance):
-        return Subscription.objects.filter(subscribed_to_user=instance.id).count()  # noqa
+        subscribers_count = getattr(instance, '_subscribers_count', None)
+        if subscribers_count is None:
+            subscribers_count = get_counter(instance.id, SUBSCRIBERS)
+        return subscribers_count
+
+
+class BatchSubRequestSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(
+        choices=('GET', 'HEAD', 'POST', 'PUT', 'DELETE', )
+    )
+    path = serializers.CharField(max_length=2000)
+    body = serializers.JSONField(required=False)
+    headers = serializers.DictField(child=serializers.CharField(),
+                                    required=False)
+
+    def validate_headers(self, value):
+        allowed = {name.lower() for name in BATCH_REQUEST_HEADERS}
+        rejected = [name for name in value if name.lower() not in allowed]
+        if rejected:
+            raise serializers.ValidationError(
+                f'The headers {", ".join(rejected)} are not allowed, only '
+                f'{", ".join(BATCH_REQUEST_HEADERS)}.'
+            )
+        return value
+
+
+class BatchSerializer(serializers.Serializer):
+    requests = BatchSubRequestSerializer(many=True, allow_empty=False,
+                                         max_length=BATCH_MAX_REQUESTS)
+    parallel = serializers.BooleanField(default=False)
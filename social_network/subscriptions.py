@@ -0,0 +1,225 @@
+from django.db import connection, transaction, IntegrityError
+from django.utils import timezone
+
+from .models import Subscription
+from .conditional import bump_user_versions
+from .counters import SUBSCRIBERS, COUNTER_LOCK_NAMESPACE, choose_shard, \
+    counter_lock_key, increment_counter
+
+from django.contrib.auth import get_user_model
+User = get_user_model()
+
+# The highest number of the Subscriptions a single User can have
+MAX_SUBSCRIPTIONS = 100
+
+# The first key of the advisory locks taken for the Subscriptions of a User
+SUBSCRIPTION_LOCK_NAMESPACE = 41
+
+SUBSCRIBED = 'subscribed'
+ALREADY_SUBSCRIBED = 'already_subscribed'
+LIMIT_REACHED = 'limit_reached'
+SELF_SUBSCRIPTION = 'self_subscription'
+USER_NOT_FOUND = 'user_not_found'
+
+SUBSCRIBE_SQL = f'''
+SELECT pg_advisory_xact_lock({SUBSCRIPTION_LOCK_NAMESPACE}, %(lock_key)s);
+SELECT pg_advisory_xact_lock_shared({COUNTER_LOCK_NAMESPACE},
+                                    %(counter_lock_key)s);
+WITH inserted AS (
+    INSERT INTO social_network_subscription
+        (user_id, subscribed_to_user_id, created_datetime)
+    SELECT %(user_id)s, target.id, %(now)s
+    FROM social_network_user target
+    WHERE target.id = %(subscribed_to_user_id)s AND target.is_active
+    AND (
+        SELECT count(*) FROM social_network_subscription
+        WHERE user_id = %(user_id)s
+    ) < %(max_subscriptions)s
+    ON CONFLICT (user_id, subscribed_to_user_id) DO NOTHING
+    RETURNING subscribed_to_user_id
+), counted AS (
+    INSERT INTO social_network_usercountershard (user_id, name, shard, value)
+    SELECT subscribed_to_user_id, %(counter)s, %(shard)s, 1 FROM inserted
+    ON CONFLICT (user_id, name, shard)
+    DO UPDATE SET value = social_network_usercountershard.value + 1
+)
+SELECT target.username, EXISTS(SELECT 1 FROM inserted)
+FROM social_network_user target
+WHERE target.id = %(subscribed_to_user_id)s AND target.is_active
+'''
+
+UNSUBSCRIBE_SQL = f'''
+SELECT pg_advisory_xact_lock_shared({COUNTER_LOCK_NAMESPACE},
+                                    %(counter_lock_key)s);
+WITH deleted AS (
+    DELETE FROM social_network_subscription
+    WHERE user_id = %(user_id)s
+    AND subscribed_to_user_id = %(subscribed_to_user_id)s
+    RETURNING subscribed_to_user_id
+), counted AS (
+    INSERT INTO social_network_usercountershard (user_id, name, shard, value)
+    SELECT subscribed_to_user_id, %(counter)s, %(shard)s, -1 FROM deleted
+    ON CONFLICT (user_id, name, shard)
+    DO UPDATE SET value = social_network_usercountershard.value - 1
+)
+SELECT target.username
+FROM deleted JOIN social_network_user target
+ON target.id = deleted.subscribed_to_user_id
+'''
+
+
+def lock_subscriptions(user_ids):
+    """
+    Takes the advisory locks of the Users' Subscriptions held until the end
+    of the transaction, the same as the subscribes take, so the bulk writes
+    of the Subscriptions, such as the import, keep the MAX_SUBSCRIPTIONS
+    limit. The locks are taken in the order of the ids, so the concurrent
+    callers do not deadlock. The other databases serialize the write
+    transactions anyway.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for lock_key in sorted({user_id % 2 ** 31 for user_id in user_ids}):
+            cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)',
+                           [SUBSCRIPTION_LOCK_NAMESPACE, lock_key])
+
+
+def subscribe(user_id, subscribed_to_user_id):
+    """
+    Subscribes the User to the other User, unless the User already has
+    MAX_SUBSCRIPTIONS Subscriptions. The deactivated Users, whose accounts
+    are being deleted, can not be subscribed to.
+
+    On PostgreSQL the limit is checked and the Subscription is inserted by
+    a single INSERT ... SELECT ... ON CONFLICT DO NOTHING statement, which
+    also increments a shard of the subscribers counter. It is sent together
+    with the transaction-level advisory lock of the User, so the concurrent
+    subscribes of the same User never exceed the limit and wait only for
+    each other's single statement. The subscribes of the different Users
+    never wait at all, unless the counter of the User subscribed to is
+    being recounted, see lock_counters().
+
+    Args:
+        user_id (int): The id of the subscribing User
+        subscribed_to_user_id (int): The id of the User subscribed to
+
+    Returns:
+        tuple: The result, one of SUBSCRIBED, ALREADY_SUBSCRIBED,
+        LIMIT_REACHED, SELF_SUBSCRIPTION and USER_NOT_FOUND, and the username
+        of the User subscribed to or None if they do not exist.
+    """
+    if user_id == subscribed_to_user_id:
+        return SELF_SUBSCRIPTION, None
+
+    if connection.vendor == 'postgresql':
+        result, username = _subscribe_postgresql(user_id,
+                                                 subscribed_to_user_id)
+    else:
+        result, username = _subscribe_orm(user_id, subscribed_to_user_id)
+
+    # Only the subscriber's version, the popular Users' rows would be
+    # locked by every subscribe, see COUNTERS['MAX_AGE']
+    if result == SUBSCRIBED:
+        bump_user_versions(user_id)
+    return result, username
+
+
+def _subscribe_postgresql(user_id, subscribed_to_user_id):
+    params = {
+        'lock_key': user_id % 2 ** 31,
+        'counter_lock_key': counter_lock_key(subscribed_to_user_id),
+        'user_id': user_id,
+        'subscribed_to_user_id': subscribed_to_user_id,
+        'now': timezone.now(),
+        'max_subscriptions': MAX_SUBSCRIPTIONS,
+        'counter': SUBSCRIBERS,
+        'shard': choose_shard(),
+    }
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(SUBSCRIBE_SQL, params)
+            row = cursor.fetchone()
+
+            if row is None:
+                return USER_NOT_FOUND, None
+            username, inserted = row
+            if inserted:
+                return SUBSCRIBED, username
+
+            # Telling apart the rejected subscribes, still under the lock
+            cursor.execute(
+                'SELECT EXISTS(SELECT 1 FROM social_network_subscription '
+                'WHERE user_id = %s AND subscribed_to_user_id = %s)',
+                [user_id, subscribed_to_user_id]
+            )
+            if cursor.fetchone()[0]:
+                return ALREADY_SUBSCRIBED, username
+            return LIMIT_REACHED, username
+
+
+def _subscribe_orm(user_id, subscribed_to_user_id):
+    # The other databases, such as SQLite, serialize the write transactions
+    with transaction.atomic():
+        username = User.objects.filter(
+            id=subscribed_to_user_id, is_active=True
+        ).values_list('username', flat=True).first()
+        if username is None:
+            return USER_NOT_FOUND, None
+
+        if Subscription.objects.filter(
+                user_id=user_id,
+                subscribed_to_user_id=subscribed_to_user_id).exists():
+            return ALREADY_SUBSCRIBED, username
+
+        if Subscription.objects.filter(
+                user_id=user_id).count() >= MAX_SUBSCRIPTIONS:
+            return LIMIT_REACHED, username
+
+        try:
+            with transaction.atomic():
+                Subscription.objects.create(
+                    user_id=user_id,
+                    subscribed_to_user_id=subscribed_to_user_id,
+                    created_datetime=timezone.now()
+                )
+                increment_counter(subscribed_to_user_id, SUBSCRIBERS)
+        except IntegrityError:
+            return ALREADY_SUBSCRIBED, username
+        return SUBSCRIBED, username
+
+
+def unsubscribe(user_id, subscribed_to_user_id):
+    """
+    Unsubscribes the User from the other User with a single DELETE, which
+    also decrements a shard of the subscribers counter.
+
+    Returns:
+        str: The username of the User unsubscribed from or None if the
+        User has not been subscribed to them.
+    """
+    if connection.vendor == 'postgresql':
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(UNSUBSCRIBE_SQL, {
+                'counter_lock_key': counter_lock_key(subscribed_to_user_id),
+                'user_id': user_id,
+                'subscribed_to_user_id': subscribed_to_user_id,
+                'counter': SUBSCRIBERS,
+                'shard': choose_shard(),
+            })
+            row = cursor.fetchone()
+        username = row[0] if row else None
+    else:
+        with transaction.atomic():
+            deleted, _ = Subscription.objects.filter(
+                user_id=user_id, subscribed_to_user_id=subscribed_to_user_id
+            ).delete()
+            if deleted:
+                increment_counter(subscribed_to_user_id, SUBSCRIBERS, -1)
+        username = User.objects.filter(
+            id=subscribed_to_user_id
+        ).values_list('username', flat=True).first() if deleted else None
+
+    if username is not None:
+        bump_user_versions(user_id)
+    return username
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class QueryBudgetTestRunner(DiscoverRunner):
+    """
+    Runs the tests with the query and time budgets of the views enforced,
+    so every request of the test suite exceeding them fails.
+    """
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._budgets_override = override_settings(
+            QUERY_BUDGETS={**settings.QUERY_BUDGETS, 'ENFORCE': True}
+        )
+        self._budgets_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._budgets_override.disable()
+        super().teardown_test_environment(**kwargs)
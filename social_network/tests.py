@@ -1,3 +1,1488 @@
-from django.test import TestCase
+import io
+import os
+import csv
+import gzip
+import json
+import time
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import skipUnless, mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+
+from .models import Post, Subscription, UserCounterShard, Interest, \
+    UserInterest, AuthToken, Country, DeletionJob, HourlyActivity, \
+    DailyActivity, RollupWatermark, TrendingPost
+from .recent_posts import get_recent_posts
+from .subscriptions import subscribe, unsubscribe, MAX_SUBSCRIPTIONS, \
+    SUBSCRIBED, USER_NOT_FOUND
+from .deletion import enqueue_deletion, claim_job, \
+    delete_rows as delete_model_rows, lock_batch as delete_lock_batch, \
+    get_stages as get_deletion_stages
+from .counters import SUBSCRIBERS, get_counter, get_counters, \
+    compact_counters, increment_counter, lock_counters, recount_subscribers
+from .budgets import QueryBudgetExceeded, seed_budget_dataset, \
+    get_api_routes, measure_get_routes, get_budget
+from .views import CountriesView
+from .serializers import UserUpdateSerializer
+from .admin import EstimatedCountPaginator, \
+    estimate_count as admin_estimate_count
+from .archive import PostArchive, Segment, write_segment, SEGMENT_COLUMNS
+from .conditional import bump_user_versions
+from .filters import SubscriptionFilterSet
+from .analytics import POSTS, ALL_COUNTRIES, NO_COUNTRY, roll_up_batch
+from .trending import TRENDING_WATERMARK, score_post, decayed_score, \
+    refresh_trending, rebuild_trending
+from .fields import ReferenceData, CachedPrimaryKeyRelatedField, \
+    bump_reference_version
+from .token_generator import create_or_update_auth_token
+from .authentication import SignedAccessToken, SignedTokenAuthentication, \
+    revoke_access_tokens, revocation_cache_key
+
+from .batch import build_sub_request
+from .middleware import PROFILE_RESPONSE_HEADER
+from .profiling import write_collapsed, read_collapsed, write_speedscope
+from . import throttling, profiling
+
+from django.contrib.auth import get_user_model
+User = get_user_model()
+
+
+def reset_caches():
+    # The ids of the rolled back rows are reused by the following tests
+    for cache in caches.all():
+        cache.clear()
+    throttling._store = None
+
+
+class RecentPostsTestCase(TestCase):
+    def setUp(self):
+        caches['recent-posts'].clear()
+        self.author = User.objects.create(username='author')
+        self.reader = User.objects.create(username='reader')
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        self.reader_client = APIClient()
+        self.reader_client.force_authenticate(self.reader)
+
+    def create_post(self, title):
+        response = self.client.post(
+            '/api/posts/', {'title': title, 'text': 'text'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data['id']
+
+    def get_author_posts(self):
+        response = self.reader_client.get(
+            '/api/users/', {'username': 'author', 'fields': 'id,posts'}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data[0]['posts']
+
+    def test_cached_posts_are_reused(self):
+        self.create_post('first')
+        self.author.refresh_from_db()
+
+        # The Posts and the interests of their author
+        with self.assertNumQueries(2):
+            get_recent_posts([self.author])
+        with self.assertNumQueries(0):
+            posts = get_recent_posts([self.author])
+        self.assertEqual([post['title'] for post in posts[self.author.id]],
+                         ['first'])
+
+    def test_posts_are_fresh_after_create(self):
+        self.assertEqual(self.get_author_posts(), [])
+
+        post_ids = [self.create_post(f'post {index}') for index in range(7)]
+        self.assertEqual(self.get_author_posts(), post_ids[::-1][:5])
+
+    def test_posts_are_fresh_after_update(self):
+        post_id = self.create_post('before')
+        self.get_author_posts()
+
+        response = self.client.put(
+            '/api/posts/', {'id': post_id, 'title': 'after'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+        response = self.reader_client.get(
+            '/api/users/', {'username': 'author', 'fields': 'id,posts',
+                            'expand': 'posts'}
+        )
+        self.assertEqual(response.data[0]['posts'][0]['title'], 'after')
+
+    def test_posts_are_fresh_after_write_outside_the_api(self):
+        self.get_author_posts()
+        post = Post.objects.create(
+            user=self.author, title='imported', text='text',
+            created_datetime=timezone.now(), created_by=self.author.id
+        )
+        User.objects.filter(id=self.author.id).update(version=100)
+
+        self.assertEqual(self.get_author_posts(), [post.id])
+
+
+class SubscriptionsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='subscriber')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_subscribe_and_unsubscribe(self):
+        target = User.objects.create(username='target')
+        url = f'/api/my-subscriptions-manage/{target.id}/'
+
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 200)
+        self.assertEqual(get_counter(target.id, SUBSCRIBERS), 1)
+
+        self.assertEqual(self.client.delete(url).status_code, 201)
+        self.assertEqual(self.client.delete(url).status_code, 404)
+        self.assertFalse(Subscription.objects.exists())
+        self.assertEqual(get_counter(target.id, SUBSCRIBERS), 0)
+
+    def test_subscribers_counter_survives_compaction(self):
+        targets = User.objects.bulk_create([
+            User(username=f'target{index}') for index in range(3)
+        ])
+        for target in targets:
+            subscribe(self.user.id, target.id)
+        unsubscribe(self.user.id, targets[0].id)
+
+        compact_counters(0, max(target.id for target in targets) + 1)
+
+        self.assertEqual(
+            get_counters([target.id for target in targets], SUBSCRIBERS),
+            {targets[0].id: 0, targets[1].id: 1, targets[2].id: 1}
+        )
+        self.assertFalse(UserCounterShard.objects.exclude(shard=0).exists())
+
+    def test_recount_under_the_exclusive_lock(self):
+        targets = User.objects.bulk_create([
+            User(username=f'target{index}') for index in range(2)
+        ])
+        subscribe(self.user.id, targets[0].id)
+        increment_counter(targets[1].id, SUBSCRIBERS, 5)
+        target_ids = [target.id for target in targets]
+
+        with mock.patch('social_network.counters.lock_counters',
+                        wraps=lock_counters) as lock:
+            recount_subscribers(target_ids)
+        lock.assert_called_once_with(target_ids, shared=False)
+        self.assertEqual(get_counters(target_ids, SUBSCRIBERS),
+                         {targets[0].id: 1, targets[1].id: 0})
+
+    def test_rejected_subscribes(self):
+        self.assertEqual(self.client.post(
+            f'/api/my-subscriptions-manage/{self.user.id}/'
+        ).status_code, 403)
+        self.assertEqual(self.client.post(
+            '/api/my-subscriptions-manage/999999/'
+        ).status_code, 404)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Requires PostgreSQL')
+class ConcurrentSubscriptionsTestCase(TransactionTestCase):
+    def test_limit_holds_for_concurrent_subscribes(self):
+        user = User.objects.create(username='subscriber')
+        targets = User.objects.bulk_create([
+            User(username=f'target{index}')
+            for index in range(MAX_SUBSCRIPTIONS + 50)
+        ])
+
+        def run(target):
+            try:
+                # The duplicates must not fail either
+                return [subscribe(user.id, target.id)[0] for _ in range(2)]
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = [result for results in executor.map(run, targets)
+                       for result in results]
+
+        self.assertEqual(results.count(SUBSCRIBED), MAX_SUBSCRIPTIONS)
+        self.assertEqual(
+            Subscription.objects.filter(user=user).count(), MAX_SUBSCRIPTIONS
+        )
+
+
+class QueryBudgetsTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+
+    def test_views_declare_budgets(self):
+        for _, pattern, view_class in get_api_routes():
+            for method in view_class.http_method_names:
+                if method in ('head', 'options') \
+                        or not hasattr(view_class, method):
+                    continue
+                for name in ('query_budget', 'time_budget'):
+                    self.assertIsNotNone(
+                        get_budget(view_class, method.upper(), name),
+                        f'{view_class.__name__} {method} has no {name}'
+                    )
+
+    def test_seeded_routes_are_within_budgets(self):
+        user = seed_budget_dataset()
+        for path, view_class, response, check in measure_get_routes(
+                APIClient(), user):
+            self.assertEqual(response.status_code, 200, path)
+            self.assertIsNotNone(check, path)
+            self.assertEqual(check.violations(), [], path)
+
+    def test_exceeded_budget_fails_when_enforced(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username='reader'))
+        with override_settings(QUERY_BUDGETS={
+                **settings.QUERY_BUDGETS, 'ENABLED': True, 'ENFORCE': True}), \
+                mock.patch.object(CountriesView, 'query_budget', {'GET': 0}):
+            with self.assertRaises(QueryBudgetExceeded):
+                client.get('/api/countries/')
+
+    def test_exceeded_budget_is_logged_with_sql(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username='reader'))
+        with override_settings(QUERY_BUDGETS={
+                **settings.QUERY_BUDGETS, 'ENABLED': True, 'ENFORCE': False,
+                'SAMPLE_RATE': 1}), \
+                mock.patch.object(CountriesView, 'query_budget', {'GET': 0}):
+            with self.assertLogs(level='WARNING') as logs:
+                response = client.get('/api/countries/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('CountriesView exceeded its budget', logs.output[0])
+        self.assertIn('social_network_country', logs.output[0])
+
+
+class PostArchiveTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.now = timezone.now().replace(microsecond=123456)
+
+    def make_row(self, post_id, user_id, days_ago, title='title'):
+        created = self.now - timedelta(days=days_ago)
+        return (post_id, user_id, title, 'text ż', created, user_id, None,
+                None)
+
+    def test_segment_round_trip(self):
+        rows = [self.make_row(3, 2, 1), self.make_row(1, 1, 5, 'ąę'),
+                self.make_row(2, 2, 3)]
+        path = os.path.join(self.directory, 'posts.seg')
+        entry = write_segment(path, rows)
+        self.assertEqual((entry['min_id'], entry['max_id']), (1, 3))
+        self.assertEqual(
+            (entry['min_user_id'], entry['max_user_id']), (1, 2)
+        )
+
+        with Segment(path) as segment:
+            columns = {name: segment.column(name)
+                       for name, _ in SEGMENT_COLUMNS}
+            # The rows are sorted by their User and created datetime
+            self.assertEqual(columns['id'], [1, 2, 3])
+            self.assertEqual(list(segment.user_rows(2)), [1, 2])
+            self.assertEqual(list(segment.user_rows(3)), [])
+        self.assertEqual(columns['title'][0], 'ąę')
+        self.assertEqual(columns['created_datetime'][0], rows[1][4])
+        self.assertEqual(columns['modified_datetime'], [None] * 3)
+        self.assertEqual(columns['modified_by'], [None] * 3)
+
+    def test_remove_user(self):
+        archive = PostArchive(self.directory)
+        archive.append([self.make_row(1, 1, 10), self.make_row(2, 2, 10)])
+        archive.append([self.make_row(3, 2, 10)])
+        archive.append([self.make_row(4, 5, 10)])
+
+        self.assertEqual(archive.remove_user(2), 2)
+        self.assertEqual(archive.remove_user(2), 0)
+        self.assertEqual(archive.read(2), [])
+        self.assertEqual([post['id'] for post in archive.read(1)], [1])
+        self.assertEqual(
+            [entry['rows'] for entry in archive.load_manifest()['segments']],
+            [1, 1]
+        )
+        # The segment left empty is removed
+        self.assertEqual(len([name for name in os.listdir(self.directory)
+                              if name.endswith('.seg')]), 2)
+
+    def test_read_only_opens_segments_of_the_user(self):
+        archive = PostArchive(self.directory)
+        archive.append([self.make_row(1, 1, 10), self.make_row(2, 2, 10)])
+        archive.append([self.make_row(3, 5, 10), self.make_row(4, 6, 2)])
+
+        self.assertEqual(len(archive.segments(1)), 1)
+        self.assertFalse(archive.covers(3))
+        self.assertTrue(archive.covers(6))
+        self.assertFalse(archive.covers(
+            6, start=self.now - timedelta(days=1)
+        ))
+
+        with mock.patch('social_network.archive.Segment',
+                        wraps=Segment) as segment:
+            posts = archive.read(6, start=self.now - timedelta(days=5))
+        self.assertEqual(segment.call_count, 1)
+        self.assertEqual([post['id'] for post in posts], [4])
+        self.assertEqual(posts[0]['user_id'], 6)
+
+    def test_posts_merge_hot_and_archived(self):
+        user = User.objects.create(username='author')
+        hot = Post.objects.create(user=user, title='hot', text='text',
+                                  created_datetime=self.now,
+                                  created_by=user.id)
+        archived = Post.objects.create(
+            user=user, title='cold', text='text', created_by=user.id,
+            created_datetime=self.now - timedelta(days=30)
+        )
+        PostArchive(self.directory).append([
+            self.make_row(archived.id, user.id, 30, 'cold'),
+            # Still in the database after an interrupted archiving
+            self.make_row(hot.id, user.id, 0, 'stale'),
+        ])
+        archived.delete()
+
+        client = APIClient()
+        client.force_authenticate(user)
+        with override_settings(POST_ARCHIVE_DIR=self.directory):
+            response = client.get('/api/posts/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([post['title'] for post in response.data],
+                             ['hot', 'cold'])
+            self.assertEqual(response.data[1]['user']['id'], user.id)
+
+            response = client.get('/api/posts/', {'title': 'cold'})
+            self.assertEqual([post['title'] for post in response.data],
+                             ['cold'])
+
+
+class UserExportTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+        self.user = User.objects.create(username='exported')
+        self.other = User.objects.create(username='other')
+        interest = Interest.objects.create(name='Chess')
+        UserInterest.objects.create(user=self.user, interest=interest)
+        now = timezone.now()
+        self.post = Post.objects.create(user=self.user, title='hot',
+                                        text='text', created_datetime=now,
+                                        created_by=self.user.id)
+        Subscription.objects.create(user=self.user,
+                                    subscribed_to_user=self.other,
+                                    created_datetime=now)
+        PostArchive(self.directory).append([
+            (self.post.id - 1000, self.user.id, 'cold', 'text',
+             now - timedelta(days=400), self.user.id, None, None),
+        ])
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def export(self, path='/api/my-export/', **params):
+        with override_settings(POST_ARCHIVE_DIR=self.directory):
+            response = self.client.get(path, params)
+            content = b''.join(response.streaming_content) \
+                if response.streaming else None
+        return response, content
+
+    def test_ndjson_export(self):
+        response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(
+            [record['type'] for record in records],
+            ['profile', 'interest', 'post', 'post', 'subscription']
+        )
+        self.assertEqual(records[0]['username'], 'exported')
+        self.assertEqual(records[1]['interest__name'], 'Chess')
+        self.assertEqual([records[2]['title'], records[3]['title']],
+                         ['hot', 'cold'])
+        self.assertEqual(records[4]['subscribed_to_user__username'], 'other')
+
+    def test_gzipped_csv_export(self):
+        response, content = self.export(file_format='csv', gzip='1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('user-', response['Content-Disposition'])
+        rows = list(csv.reader(gzip.decompress(content).decode().splitlines()))
+        # Every record type starts with its own header row
+        headers = [row for row in rows if row[0] == 'type']
+        self.assertEqual(len(headers), 4)
+        self.assertEqual(
+            [row[2] for row in rows if row[0] == 'post'], ['hot', 'cold']
+        )
+
+    def test_archived_posts_are_read_lazily(self):
+        archive = PostArchive(self.directory)
+        posts = archive.iterate(self.user.id)
+        self.assertFalse(isinstance(posts, list))
+        self.assertEqual([post['title'] for post in posts], ['cold'])
+
+    def test_invalid_format_and_other_users(self):
+        response, _ = self.export(file_format='xml')
+        self.assertEqual(response.status_code, 400)
+
+        response, _ = self.export(f'/api/users/{self.other.id}/export/')
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_authenticate(
+            User.objects.create(username='staff', is_staff=True)
+        )
+        response, content = self.export(f'/api/users/{self.user.id}/export/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'"exported"', content)
+
+
+class ImportDataTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'import.ndjson')
+
+        self.user = User.objects.create(username='importer')
+        self.others = [
+            User.objects.create(username=f'target{index}')
+            for index in range(MAX_SUBSCRIPTIONS + 1)
+        ]
+
+    def run_import(self, lines):
+        with open(self.path, 'w') as input_file:
+            input_file.write('\n'.join(lines) + '\n')
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_data', self.path, workers=1, stdout=stdout,
+                     stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue().splitlines()
+
+    def subscription(self, target):
+        return json.dumps({'type': 'subscription', 'username': 'importer',
+                           'subscribed_to': target.username})
+
+    def test_counts_the_inserted_subscriptions_and_invalid_lines(self):
+        Subscription.objects.create(user=self.user,
+                                    subscribed_to_user=self.others[0],
+                                    created_datetime=timezone.now())
+        summary, errors = self.run_import([
+            self.subscription(self.others[0]),
+            self.subscription(self.others[1]),
+            self.subscription(self.others[1]),
+            '{"type": "subscription", ',
+        ])
+        self.assertIn('and 1 Subscriptions, skipped 1 invalid rows', summary)
+        self.assertEqual(errors, ['Line 4: invalid JSON'])
+        self.assertEqual(get_counter(self.others[1].id, SUBSCRIBERS), 1)
+
+    def test_keeps_the_subscriptions_limit(self):
+        summary, errors = self.run_import([
+            self.subscription(target) for target in self.others
+        ])
+        self.assertIn(f'and {MAX_SUBSCRIPTIONS} Subscriptions, skipped 1 '
+                      f'invalid rows', summary)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(
+            Subscription.objects.filter(user=self.user).count(),
+            MAX_SUBSCRIPTIONS
+        )
+
+
+class ThrottlingTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create(username='throttled')
+
+    def get_keys(self, **headers):
+        request = APIClient().get('/api/countries/', **headers) \
+            .renderer_context['request']
+        return throttling.TokenBucketThrottle().get_keys(request)
+
+    def test_keys_the_user_token_and_ip_address(self):
+        token = AuthToken.objects.create(user=self.user, key='k' * 40,
+                                         created_datetime=timezone.now())
+        keys = self.get_keys(HTTP_AUTHORIZATION=f'Token {token.key}',
+                             HTTP_X_FORWARDED_FOR='10.0.0.1',
+                             REMOTE_ADDR='192.0.2.1')
+        self.assertEqual(keys[:2], ['ip:192.0.2.1', f'user:{self.user.id}'])
+        self.assertTrue(keys[2].startswith('token:'))
+        self.assertNotIn(token.key, keys[2])
+
+    @override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK,
+                                       'NUM_PROXIES': 1})
+    def test_trusts_the_configured_proxies_only(self):
+        keys = self.get_keys(HTTP_X_FORWARDED_FOR='198.51.100.7',
+                             REMOTE_ADDR='192.0.2.1')
+        self.assertEqual(keys, ['ip:198.51.100.7'])
+
+    def test_refused_requests_take_no_tokens(self):
+        config = {**settings.THROTTLING, 'RATE': 0.001, 'CAPACITY': 2,
+                  'COSTS': {}}
+        for store in (throttling.LocalBucketStore(),
+                      throttling.CacheBucketStore('default')):
+            throttle = throttling.TokenBucketThrottle()
+            throttle.config, throttle.store = config, store
+            store.consume('user', 2, config['RATE'], config['CAPACITY'])
+
+            request = mock.Mock(resolver_match=None)
+            with mock.patch.object(throttle, 'get_keys',
+                                   return_value=['ip', 'user', 'token']):
+                self.assertFalse(throttle.allow_request(request, None))
+            self.assertGreater(throttle.wait(), 0)
+
+            # The IP address bucket is refunded, the token's one untouched
+            for key in ('ip', 'token'):
+                self.assertEqual(
+                    store.consume(key, 2, config['RATE'],
+                                  config['CAPACITY']), 0
+                )
+
+    def test_cache_store_spends_every_token_once(self):
+        store = throttling.CacheBucketStore('default')
+
+        def consume(_):
+            return store.consume('bucket', 1, 0.001, 50)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            waits = list(executor.map(consume, range(100)))
+        self.assertEqual(waits.count(0), 50)
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create(username='conditional')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_not_modified_until_the_user_changes(self):
+        response = self.client.get('/api/my-profile/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+        response = self.client.get('/api/my-profile/',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+        # The ETags of the other views and query parameters differ
+        response = self.client.get('/api/posts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        other = User.objects.create(username='subscribed')
+        subscribe(self.user.id, other.id)
+        self.client.force_authenticate(User.objects.get(id=self.user.id))
+        response = self.client.get('/api/my-profile/',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_subscribers_count_stale_for_max_age(self):
+        other = User.objects.create(username='subscriber')
+        etag = self.client.get('/api/my-profile-details/')['ETag']
+
+        # The version of the User subscribed to is not bumped
+        subscribe(other.id, self.user.id)
+        self.assertEqual(User.objects.get(id=self.user.id).version,
+                         self.user.version)
+        response = self.client.get('/api/my-profile-details/',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        later = timezone.now() + settings.COUNTERS['MAX_AGE']
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            response = self.client.get('/api/my-profile-details/',
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_subscribers_count'], 1)
+
+    def test_if_modified_since(self):
+        bump_user_versions(self.user.id)
+        self.client.force_authenticate(User.objects.get(id=self.user.id))
+        last_modified = self.client.get('/api/my-profile/')['Last-Modified']
+
+        response = self.client.get('/api/my-profile/',
+                                   HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(
+            '/api/my-profile/',
+            HTTP_IF_MODIFIED_SINCE='Mon, 01 Jan 2001 00:00:00 GMT'
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+# The fast hasher, the production ones take seconds per login on purpose
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']
+)
+class LoginTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create(username='login')
+        self.user.set_password('123EmbedPassword?!')
+        self.user.save()
+        self.client = APIClient()
+
+    def login(self, device=None, password='123EmbedPassword?!'):
+        data = {'username': 'login', 'password': password}
+        if device:
+            data['device'] = device
+        return self.client.post('/api/login/', data)
+
+    def test_issues_a_token_per_device(self):
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        first_key = response.data['token']
+
+        token = AuthToken.objects.get(key=first_key)
+        self.assertEqual((token.user_id, token.device),
+                         (self.user.id, 'default'))
+
+        # Logging in again on the same device replaces its token only
+        second_key = self.login().data['token']
+        phone_key = self.login(device='phone').data['token']
+        self.assertEqual(
+            set(AuthToken.objects.values_list('device', 'key')),
+            {('default', second_key), ('phone', phone_key)}
+        )
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {first_key}')
+        self.assertEqual(client.get('/api/my-profile/').status_code, 401)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {second_key}')
+        self.assertEqual(client.get('/api/my-profile/').status_code, 200)
+
+        self.assertEqual(client.post('/api/logout/').status_code, 200)
+        self.assertFalse(AuthToken.objects.filter(key=second_key).exists())
+        self.assertEqual(client.get('/api/my-profile/').status_code, 401)
+
+    def test_upserted_token_has_its_id(self):
+        created = create_or_update_auth_token(self.user, device='tablet')
+        updated = create_or_update_auth_token(self.user, device='tablet')
+        self.assertIsNotNone(created.pk)
+        self.assertEqual(created.pk, updated.pk)
+        self.assertEqual(AuthToken.objects.get(pk=updated.pk).key,
+                         updated.key)
+
+    def test_device_too_long(self):
+        response = self.login(device='d' * 101)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('device', response.data)
+        self.assertFalse(AuthToken.objects.exists())
+        self.assertEqual(self.login(device='d' * 100).status_code, 200)
+
+    def test_invalid_credentials(self):
+        response = self.login(password='wrong password')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(AuthToken.objects.exists())
+
+
+class SignedTokenAuthenticationTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        # The views read the authentication classes when they are defined
+        patcher = mock.patch.object(APIView, 'authentication_classes',
+                                    [SignedTokenAuthentication])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create(username='signed')
+        self.client = APIClient()
+        token = SignedAccessToken.issue(self.user.id)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token.key}')
+
+    def test_revoked_tokens_are_rejected(self):
+        self.assertEqual(self.client.get('/api/my-profile/').status_code, 200)
+        revoke_access_tokens(self.user.id)
+        self.assertIsNotNone(
+            caches['shared'].get(revocation_cache_key(self.user.id))
+        )
+        self.assertEqual(self.client.get('/api/my-profile/').status_code, 401)
+
+    def test_revocations_are_read_once_per_timeout(self):
+        shared = caches['shared']
+        with mock.patch.object(shared, 'get', wraps=shared.get) as get:
+            for _ in range(3):
+                self.assertEqual(
+                    self.client.get('/api/my-profile/').status_code, 200
+                )
+        get.assert_called_once_with(revocation_cache_key(self.user.id))
+
+        # Revoked by another worker, seen once the worker's copy expires
+        shared.set(revocation_cache_key(self.user.id),
+                   int(time.time() * 1000))
+        self.assertEqual(self.client.get('/api/my-profile/').status_code, 200)
+        caches['revocations'].clear()
+        self.assertEqual(self.client.get('/api/my-profile/').status_code, 401)
+
+    def test_deleted_users_are_rejected(self):
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        self.assertEqual(self.client.get('/api/my-profile/').status_code, 401)
+        Subscription.objects.filter(user=self.user).delete()
+        self.user.delete()
+        self.assertEqual(self.client.get('/api/my-profile/').status_code, 401)
+
+
+class FilterSetTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create(username='filtering')
+        self.author = User.objects.create(username='author')
+        self.silent = User.objects.create(username='silent')
+        now = timezone.now()
+        for title in ('Chess openings', 'Chess endgames', 'Cooking'):
+            Post.objects.create(user=self.author, title=title, text='text',
+                                created_datetime=now,
+                                created_by=self.author.id)
+        for user in (self.author, self.silent):
+            Subscription.objects.create(user=self.user,
+                                        subscribed_to_user=user,
+                                        created_datetime=now)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_unknown_and_invalid_parameters(self):
+        response = self.client.get('/api/posts/', {'tittle': 'Chess'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'tittle': ['Unknown filter.']})
+
+        response = self.client.get('/api/posts/', {'start_date': 'today'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('created', response.data)
+
+        response = self.client.get('/api/users/', {'country': 'Poland'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('country', response.data)
+
+        # The unindexed filters alone would scan the whole User table
+        response = self.client.get('/api/users/', {'first_name': 'a'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('filters', response.data)
+
+        # The views' own parameters are not filters
+        response = self.client.get('/api/posts/', {'shape': 'compact'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_subscription_filters_share_one_join(self):
+        filterset = SubscriptionFilterSet(
+            QueryDict('title=chess&text=text&start_date=2000-01-01'),
+            scoped=True
+        )
+        self.assertTrue(filterset.is_valid())
+        queryset = filterset.filter(
+            Subscription.objects.filter(user=self.user)
+        )
+        self.assertEqual(
+            str(queryset.query).count('JOIN "social_network_post"'), 1
+        )
+        # Both of the matching Posts are folded into their Subscription
+        self.assertEqual(list(queryset.values_list(
+            'subscribed_to_user__username', flat=True
+        )), ['author'])
+
+        response = self.client.get('/api/my-subscriptions/',
+                                   {'title': 'chess'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+
+
+class SparseFieldsetTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create(username='sparse', first_name='Sam')
+        # Keeping the ids of the Interests and the UserInterests apart
+        Interest.objects.bulk_create([Interest(name='Go'),
+                                      Interest(name='Poker')])
+        self.chess = Interest.objects.create(name='Chess')
+        self.music = Interest.objects.create(name='Music')
+        for interest in (self.music, self.chess):
+            UserInterest.objects.create(user=self.user, interest=interest)
+        self.client = APIClient()
+        # The Users View lists the other Users
+        self.client.force_authenticate(User.objects.create(username='viewer'))
+
+    def get_user(self, **params):
+        response = self.client.get('/api/users/',
+                                   {'username': 'sparse', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data[0]
+
+    def test_collapsed_interests_are_the_interest_ids(self):
+        user = self.get_user(fields='id,interests')
+        self.assertEqual(set(user), {'id', 'interests'})
+        self.assertEqual(sorted(user['interests']),
+                         sorted([self.chess.id, self.music.id]))
+
+    def test_expanded_interests(self):
+        user = self.get_user(fields='username', expand='interests')
+        self.assertEqual(set(user), {'username', 'interests'})
+        self.assertEqual(
+            sorted(interest['interest']['name']
+                   for interest in user['interests']),
+            ['Chess', 'Music']
+        )
+
+        # Without the parameters all the fields are expanded
+        user = self.get_user()
+        self.assertEqual(user['first_name'], 'Sam')
+        self.assertIsInstance(user['interests'][0]['interest'], dict)
+
+    def test_unselected_fields_cost_no_queries(self):
+        with CaptureQueriesContext(connection) as everything:
+            self.get_user()
+        with CaptureQueriesContext(connection) as sparse:
+            self.get_user(fields='id,username')
+        self.assertLess(len(sparse), len(everything))
+        self.assertFalse(any('social_network_userinterest' in query['sql']
+                             for query in sparse.captured_queries))
+
+    def test_invalid_fieldsets(self):
+        response = self.client.get('/api/users/', {'username': 'sparse',
+                                                   'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('fields', response.data)
+
+        response = self.client.get('/api/users/', {'username': 'sparse',
+                                                   'expand': 'username'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('expand', response.data)
+
+
+class ReferenceDataTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.poland = Country.objects.create(name='Poland')
+        self.spain = Country.objects.create(name='Spain')
+
+    def test_deleted_rows_are_rejected_by_every_worker(self):
+        # The copies of the two workers, sharing only the cache
+        worker, other_worker = ReferenceData(Country), ReferenceData(Country)
+        self.assertEqual(set(worker.resolve([self.poland.id, self.spain.id])),
+                         {self.poland.id, self.spain.id})
+        other_worker.resolve([self.spain.id])
+
+        self.spain.delete()
+        bump_reference_version(Country)
+        self.assertEqual(worker.resolve([self.spain.id]), {})
+        self.assertEqual(other_worker.resolve([self.spain.id]), {})
+
+    def test_new_rows_are_found_before_the_bump(self):
+        worker = ReferenceData(Country)
+        worker.resolve([self.poland.id])
+        france = Country.objects.create(name='France')
+        with self.assertNumQueries(2):
+            # The shared cache version and the missing row
+            self.assertEqual(worker.resolve([france.id])[france.id], france)
+
+    def test_unchanged_copy_costs_no_table_query(self):
+        worker = ReferenceData(Country)
+        worker.resolve([self.poland.id])
+        with CaptureQueriesContext(connection) as queries:
+            worker.resolve([self.poland.id])
+        self.assertFalse(any('social_network_country' in query['sql']
+                             for query in queries.captured_queries))
+
+    def test_nested_fields_check_the_version_once(self):
+        user = User.objects.create(username='interested')
+        interests = Interest.objects.bulk_create([
+            Interest(name=f'Interest {index}') for index in range(6)
+        ])
+
+        def count_queries(count):
+            serializer = UserUpdateSerializer(user, partial=True, data={
+                'country': self.poland.id,
+                'interests': [{'interest': interest.id}
+                              for interest in interests[:count]],
+            })
+            with CaptureQueriesContext(connection) as queries:
+                self.assertTrue(serializer.is_valid())
+            return len(queries)
+
+        count_queries(1)
+        self.assertEqual(count_queries(1), count_queries(6))
+
+    def test_field_rejects_the_deleted_ids(self):
+        field = CachedPrimaryKeyRelatedField(queryset=Country.objects.all())
+        self.assertEqual(field.to_internal_value(self.poland.id), self.poland)
+        self.poland.delete()
+        bump_reference_version(Country)
+        with self.assertRaises(ValidationError):
+            field.to_internal_value(self.poland.id)
+
+
+class DeletionJobTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        now = timezone.now()
+        self.user = User.objects.create(username='deleted')
+        self.followed = User.objects.create(username='followed')
+        self.follower = User.objects.create(username='follower')
+        AuthToken.objects.create(user=self.user, key='d' * 40,
+                                 created_datetime=now)
+        UserInterest.objects.create(
+            user=self.user, interest=Interest.objects.create(name='Chess')
+        )
+        Post.objects.create(user=self.user, title='title', text='text',
+                            created_datetime=now, created_by=self.user.id)
+        subscribe(self.user.id, self.followed.id)
+        subscribe(self.follower.id, self.user.id)
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        self.job = enqueue_deletion('user', self.user.id, self.user.id)
+
+    def run_jobs(self, *args):
+        call_command('run_deletion_jobs', '--sleep', '0', *args,
+                     stdout=io.StringIO())
+        self.job.refresh_from_db()
+
+    def test_deletes_the_account_and_decrements_the_counters(self):
+        self.assertEqual(get_counter(self.followed.id, SUBSCRIBERS), 1)
+        self.run_jobs()
+
+        self.assertEqual(self.job.status, DeletionJob.DONE)
+        self.assertEqual(self.job.progress['subscriptions'], 1)
+        self.assertEqual(self.job.progress['subscribers'], 1)
+        self.assertFalse(User.objects.filter(id=self.user.id).exists())
+        self.assertFalse(Subscription.objects.exists())
+        self.assertFalse(UserCounterShard.objects.filter(
+            user=self.user.id).exists())
+        self.assertEqual(get_counter(self.followed.id, SUBSCRIBERS), 0)
+
+    def test_deletes_the_archived_posts(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        archive = PostArchive(directory.name)
+        archive.append([
+            (post_id, user_id, 'title', 'text', timezone.now(), user_id,
+             None, None)
+            for post_id, user_id in ((1, self.user.id), (2, self.followed.id))
+        ])
+
+        with override_settings(POST_ARCHIVE_DIR=directory.name):
+            self.run_jobs()
+        self.assertEqual(self.job.status, DeletionJob.DONE)
+        self.assertEqual(self.job.progress['archived_posts'], 1)
+        self.assertEqual(archive.read(self.user.id), [])
+        self.assertEqual(len(archive.read(self.followed.id)), 1)
+
+    def test_country_stage_locks_without_joins(self):
+        # PostgreSQL can not lock the nullable side of an outer join
+        job = enqueue_deletion('country', 1)
+        for name, queryset, _ in get_deletion_stages(job):
+            with CaptureQueriesContext(connection) as queries:
+                delete_lock_batch(queryset, 10)
+            self.assertNotIn('JOIN', queries.captured_queries[0]['sql'])
+
+    def test_deactivated_users_can_not_be_subscribed_to(self):
+        other = User.objects.create(username='other')
+        self.assertEqual(subscribe(other.id, self.user.id),
+                         (USER_NOT_FOUND, None))
+
+    def test_claims_a_job_once(self):
+        self.assertTrue(claim_job(self.job))
+        self.assertFalse(claim_job(DeletionJob.objects.get(id=self.job.id)))
+
+        # The runner which stopped updating the job is taken over
+        DeletionJob.objects.filter(id=self.job.id).update(
+            updated_datetime=timezone.now() - timedelta(minutes=10)
+        )
+        self.assertTrue(claim_job(self.job))
+
+    def test_failed_job_is_resumed(self):
+        with mock.patch('social_network.deletion.delete_rows',
+                        side_effect=lambda model: delete_model_rows(model)
+                        if model is not Post else failing_apply):
+            self.run_jobs()
+        self.assertEqual(self.job.status, DeletionJob.FAILED)
+        self.assertEqual(self.job.stage, 'subscribers')
+        self.assertTrue(Post.objects.filter(user=self.user.id).exists())
+
+        # The failed jobs are left alone unless retried
+        self.run_jobs()
+        self.assertEqual(self.job.status, DeletionJob.FAILED)
+        self.run_jobs('--retry-failed')
+        self.assertEqual(self.job.status, DeletionJob.DONE)
+        self.assertEqual(self.job.error, '')
+        # The stages done before the failure are not repeated
+        self.assertEqual(self.job.progress['subscriptions'], 1)
+        self.assertEqual(get_counter(self.followed.id, SUBSCRIBERS), 0)
+
+    def test_waits_for_the_locked_rows(self):
+        # The first lock finds only the rows locked by the live requests
+        batches = [[]]
+
+        def lock_batch(queryset, batch_size):
+            if batches:
+                return batches.pop()
+            return delete_lock_batch(queryset, batch_size)
+
+        with mock.patch('social_network.deletion.lock_batch', lock_batch):
+            self.run_jobs()
+        self.assertEqual(self.job.status, DeletionJob.DONE)
+        self.assertEqual(self.job.progress['auth_tokens'], 1)
+        self.assertFalse(AuthToken.objects.exists())
+
+
+def failing_apply(ids):
+    raise RuntimeError('The database went away')
+
+
+class RollupsTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.poland = Country.objects.create(name='Poland')
+        bump_reference_version(Country)
+        self.author = User.objects.create(username='author',
+                                          country=self.poland)
+        self.nomad = User.objects.create(username='nomad')
+        self.staff = User.objects.create(username='staff', is_staff=True)
+        self.hour = (timezone.now() - timedelta(days=2)).replace(
+            minute=0, second=0, microsecond=0
+        )
+
+    def post(self, user, created_datetime):
+        return Post.objects.create(user=user, title='title', text='text',
+                                   created_datetime=created_datetime,
+                                   created_by=user.id)
+
+    def hourly(self, country_id, hour=None):
+        return HourlyActivity.objects.filter(
+            metric=POSTS, hour=hour or self.hour, country_id=country_id
+        ).values_list('value', flat=True).first()
+
+    def test_counts_every_row_once(self):
+        self.post(self.author, self.hour + timedelta(minutes=5))
+        self.post(self.author, self.hour + timedelta(minutes=10))
+        last = self.post(self.nomad, self.hour + timedelta(minutes=20))
+
+        self.assertEqual(roll_up_batch(POSTS), 3)
+        self.assertEqual(roll_up_batch(POSTS), 0)
+        self.assertEqual(RollupWatermark.objects.get(metric=POSTS).last_id,
+                         last.id)
+        self.assertEqual(self.hourly(self.poland.id), 2)
+        self.assertEqual(self.hourly(NO_COUNTRY), 1)
+        self.assertEqual(self.hourly(ALL_COUNTRIES), 3)
+
+        # The rows imported later with an old date are added to the counts
+        self.post(self.author, self.hour)
+        self.assertEqual(roll_up_batch(POSTS), 1)
+        self.assertEqual(self.hourly(ALL_COUNTRIES), 3 + 1)
+        self.assertEqual(DailyActivity.objects.get(
+            metric=POSTS, day=timezone.localdate(self.hour),
+            country_id=self.poland.id
+        ).value, 3)
+
+    def test_watermark_waits_for_the_young_rows_only(self):
+        old = self.post(self.author, self.hour)
+        self.post(self.author, timezone.now())
+        self.assertEqual(roll_up_batch(POSTS), 1)
+        self.assertEqual(RollupWatermark.objects.get(metric=POSTS).last_id,
+                         old.id)
+
+    def test_future_rows_do_not_stop_the_watermark(self):
+        future = self.post(self.author, timezone.now() + timedelta(days=30))
+        later = self.post(self.author, self.hour)
+        self.assertEqual(roll_up_batch(POSTS), 2)
+        self.assertEqual(RollupWatermark.objects.get(metric=POSTS).last_id,
+                         later.id)
+        # Counted at the current hour rather than in the future
+        self.assertFalse(HourlyActivity.objects.filter(
+            hour__gt=timezone.now()).exists())
+        self.assertEqual(future.id + 1, later.id)
+
+    def test_endpoints(self):
+        self.post(self.author, self.hour)
+        self.post(self.nomad, self.hour)
+        call_command('update_rollups', stdout=io.StringIO())
+
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        response = client.get('/api/analytics/posts/', {'interval': 'hour'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [{'hour': self.hour, POSTS: 2}])
+
+        response = client.get('/api/analytics/posts/',
+                              {'country': self.poland.id})
+        self.assertEqual(response.data,
+                         [{'day': timezone.localdate(self.hour), POSTS: 1}])
+
+        response = client.get('/api/analytics/active-countries/')
+        self.assertEqual(response.data, [
+            {'id': self.poland.id, 'name': 'Poland', POSTS: 1},
+        ])
+
+        response = client.get('/api/analytics/posts/', {'interval': 'week'})
+        self.assertEqual(response.status_code, 400)
+
+        client.force_authenticate(self.author)
+        response = client.get('/api/analytics/posts/')
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(TRENDING={**settings.TRENDING, 'SIZE': 2})
+class TrendingTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.poland = Country.objects.create(name='Poland')
+        self.star = User.objects.create(username='star', country=self.poland)
+        self.nobody = User.objects.create(username='nobody')
+        for index in range(50):
+            increment_counter(self.star.id, SUBSCRIBERS)
+        self.settled = timezone.now() - timedelta(hours=1)
+
+    def post(self, user, created_datetime=None, title='title'):
+        return Post.objects.create(
+            user=user, title=title, text='text',
+            created_datetime=created_datetime or self.settled,
+            created_by=user.id
+        )
+
+    def listed(self, country_id=ALL_COUNTRIES):
+        return list(TrendingPost.objects.filter(
+            country_id=country_id
+        ).order_by('-score').values_list('post_id', flat=True))
+
+    def test_scores(self):
+        now = timezone.now()
+        self.assertGreater(score_post(now, 50), score_post(now, 0))
+        self.assertGreater(score_post(now, 0),
+                           score_post(now - timedelta(hours=1), 0))
+        # Halved every HALF_LIFE
+        score = score_post(now, 0)
+        self.assertAlmostEqual(
+            decayed_score(score, now + settings.TRENDING['HALF_LIFE']),
+            decayed_score(score, now) / 2
+        )
+
+    def test_refresh_keeps_the_best_posts(self):
+        popular = self.post(self.star)
+        older = self.post(self.nobody, self.settled - timedelta(hours=1))
+        newer = self.post(self.nobody)
+        self.assertEqual(refresh_trending(), 3)
+        self.assertEqual(refresh_trending(), 0)
+
+        self.assertEqual(self.listed(), [popular.id, newer.id])
+        self.assertNotIn(older.id, self.listed())
+        self.assertEqual(self.listed(self.poland.id), [popular.id])
+
+    def test_refresh_waits_for_the_settled_posts(self):
+        settled = self.post(self.nobody)
+        young = self.post(self.nobody, timezone.now())
+        self.assertEqual(refresh_trending(), 1)
+        self.assertEqual(self.listed(), [settled.id])
+        self.assertEqual(
+            RollupWatermark.objects.get(metric=TRENDING_WATERMARK).last_id,
+            settled.id
+        )
+
+        # The rebuild leaves the young Posts to the refresh as well
+        rebuild_trending()
+        self.assertEqual(
+            RollupWatermark.objects.get(metric=TRENDING_WATERMARK).last_id,
+            young.id - 1
+        )
+
+    def test_prunes_the_aged_out_posts(self):
+        aged = self.post(self.star)
+        refresh_trending()
+        TrendingPost.objects.filter(post=aged).update(
+            created_datetime=timezone.now() - settings.TRENDING['MAX_AGE']
+            - timedelta(minutes=1)
+        )
+        self.post(self.nobody)
+        refresh_trending()
+        self.assertNotIn(aged.id, self.listed())
+
+    def test_endpoint(self):
+        popular = self.post(self.star, title='popular')
+        self.post(self.nobody, title='other')
+        call_command('refresh_trending', stdout=io.StringIO())
+
+        client = APIClient()
+        client.force_authenticate(self.nobody)
+        response = client.get('/api/trending/', {'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([post['id'] for post in response.data],
+                         [popular.id])
+        self.assertGreater(response.data[0]['score'], 0)
+
+        response = client.get('/api/trending/', {
+            'country': self.poland.id, 'limit': 2, 'fields': 'id,title'
+        })
+        self.assertEqual([post['title'] for post in response.data],
+                         ['popular'])
+
+        response = client.get('/api/trending/', {'limit': 3})
+        self.assertEqual(response.status_code, 400)
+
+
+class BatchTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create(username='batch')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, *requests, parallel=False):
+        return self.client.post('/api/batch/', {
+            'requests': list(requests), 'parallel': parallel
+        }, format='json')
+
+    def test_runs_the_requests_in_order(self):
+        response = self.batch(
+            {'method': 'POST', 'path': '/api/posts/',
+             'body': {'title': 'Hello', 'text': 'World'}},
+            {'method': 'GET', 'path': '/api/posts/?title=Hello'},
+            {'method': 'GET', 'path': '/api/batch/'},
+            {'method': 'GET', 'path': '/admin/'},
+        )
+        self.assertEqual(response.status_code, 200)
+        responses = response.data['responses']
+        self.assertEqual([item['status'] for item in responses],
+                         [200, 200, 404, 404])
+        self.assertEqual(responses[1]['body'][0]['title'], 'Hello')
+
+    def test_conditional_requests(self):
+        etag = self.batch(
+            {'method': 'GET', 'path': '/api/my-profile/'}
+        ).data['responses'][0]['headers']['ETag']
+        response = self.batch(
+            {'method': 'GET', 'path': '/api/my-profile/',
+             'headers': {'if-none-match': etag}}
+        )
+        self.assertEqual(response.data['responses'][0]['status'], 304)
+
+    def test_only_the_allowed_headers(self):
+        response = self.batch(
+            {'method': 'GET', 'path': '/api/my-profile/',
+             'headers': {'X-Forwarded-For': '10.0.0.1'}}
+        )
+        self.assertEqual(response.status_code, 400)
+
+        request = APIClient().get('/api/my-profile/').wsgi_request
+        request.user, request.auth = self.user, None
+        request.META['HTTP_X_FORWARDED_FOR'] = '10.0.0.2'
+        sub_request = build_sub_request(
+            request, 'GET', '/api/my-profile/',
+            headers={'X-Forwarded-For': '10.0.0.1',
+                     'Authorization': 'Token other',
+                     'Accept-Language': 'pl'}
+        )
+        self.assertEqual(sub_request.META['HTTP_X_FORWARDED_FOR'],
+                         '10.0.0.2')
+        self.assertNotIn('HTTP_AUTHORIZATION', sub_request.META)
+        self.assertEqual(sub_request.META['HTTP_ACCEPT_LANGUAGE'], 'pl')
+
+    def test_recorded_batches_run_in_one_thread(self):
+        # The query budgets are enforced in the test suite
+        with mock.patch('social_network.batch.ThreadPoolExecutor') as pool:
+            response = self.batch(
+                {'method': 'GET', 'path': '/api/my-profile/'},
+                {'method': 'GET', 'path': '/api/posts/'},
+                parallel=True
+            )
+        pool.assert_not_called()
+        self.assertEqual(
+            [item['status'] for item in response.data['responses']],
+            [200, 200]
+        )
+
+
+class ProfilingTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        profiling._active_window.update(checked=None, window=None)
+        self.staff = User.objects.create(username='profiling-staff',
+                                         is_staff=True)
+        self.user = User.objects.create(username='profiling-user')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def profile(self, client, path='/api/my-profile/'):
+        with override_settings(PROFILE_DIR=self.directory.name), \
+                mock.patch('social_network.middleware.SamplingProfiler',
+                           wraps=profiling.SamplingProfiler) as profiler:
+            response = client.get(path, HTTP_X_PROFILE='1')
+        return response, profiler
+
+    def token_client(self, user):
+        client = APIClient()
+        token = create_or_update_auth_token(user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+    def test_ignores_the_header_of_the_other_users(self):
+        response, profiler = self.profile(APIClient())
+        self.assertEqual(response.status_code, 401)
+        profiler.assert_not_called()
+
+        invalid = APIClient()
+        invalid.credentials(HTTP_AUTHORIZATION='Token invalid')
+        response, profiler = self.profile(invalid)
+        self.assertEqual(response.status_code, 401)
+        profiler.assert_not_called()
+
+        response, profiler = self.profile(self.token_client(self.user))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(PROFILE_RESPONSE_HEADER, response)
+        profiler.assert_not_called()
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_profiles_the_staff(self):
+        response, profiler = self.profile(self.token_client(self.staff))
+        self.assertEqual(response.status_code, 200)
+        profiler.assert_called_once()
+        name = response[PROFILE_RESPONSE_HEADER]
+        self.assertEqual(
+            sorted(os.listdir(self.directory.name)),
+            [f'{name}.collapsed', f'{name}.speedscope.json']
+        )
+
+        # The admin pages are authenticated by the session
+        client = APIClient()
+        client.force_login(self.staff)
+        response, profiler = self.profile(client, '/admin/')
+        profiler.assert_called_once()
+        self.assertIn(PROFILE_RESPONSE_HEADER, response)
+
+    def test_writers(self):
+        samples = Counter({
+            ('main', 'view', '[SQL] SELECT social_network_post'): 3,
+            ('main', 'render'): 1,
+        })
+        path = os.path.join(self.directory.name, 'profile')
+        write_collapsed(f'{path}.collapsed', samples)
+        with open(f'{path}.collapsed') as collapsed_file:
+            self.assertEqual(collapsed_file.read(), (
+                'main;render 1\n'
+                'main;view;[SQL] SELECT social_network_post 3\n'
+            ))
+        self.assertEqual(read_collapsed(f'{path}.collapsed'), samples)
+
+        write_speedscope(f'{path}.speedscope.json', samples, 0.005, 'test')
+        with open(f'{path}.speedscope.json') as speedscope_file:
+            speedscope = json.load(speedscope_file)
+        frames = [frame['name'] for frame in speedscope['shared']['frames']]
+        self.assertEqual(frames, ['main', 'render', 'view',
+                                  '[SQL] SELECT social_network_post'])
+        profile, = speedscope['profiles']
+        self.assertEqual(profile['samples'], [[0, 1], [0, 2, 3]])
+        self.assertEqual(profile['weights'], [0.005, 0.015])
+        self.assertAlmostEqual(profile['endValue'], 0.02)
+
+
+class UsersBatchTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.viewer = User.objects.create(username='viewer')
+        self.first = User.objects.create(username='first')
+        self.second = User.objects.create(username='second')
+        self.staff = User.objects.create(username='staff', is_staff=True)
+        self.inactive = User.objects.create(username='inactive',
+                                            is_active=False)
+        Post.objects.create(user=self.second, title='title', text='text',
+                            created_datetime=timezone.now(),
+                            created_by=self.second.id)
+        subscribe(self.viewer.id, self.second.id)
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def get(self, ids, **params):
+        return self.client.get('/api/users/batch/', {
+            'ids': ','.join(str(user_id) for user_id in ids), **params
+        })
+
+    def test_users_in_the_order_of_the_ids(self):
+        response = self.get([self.second.id, 999999, self.first.id,
+                             self.staff.id, self.inactive.id])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user['username'] for user in response.data['data']],
+                         ['second', 'first'])
+        self.assertEqual(response.data['missing'],
+                         [999999, self.staff.id, self.inactive.id])
+        self.assertNotIn('posts_count', response.data['data'][0])
+
+    def test_detailed(self):
+        response = self.get([self.first.id, self.second.id], detailed='1')
+        second = response.data['data'][1]
+        self.assertEqual((second['posts_count'], second['subscribers_count'],
+                          second['subscriptions_count']), (1, 1, 0))
+        self.assertEqual([post['title'] for post in second['posts']],
+                         ['title'])
+
+    def test_at_most_100_ids(self):
+        self.assertEqual(self.get(range(1, 102)).status_code, 400)
+        self.assertEqual(self.get(range(1, 101)).status_code, 200)
+        self.assertEqual(self.get([]).status_code, 400)
+        self.assertEqual(
+            self.client.get('/api/users/batch/', {'ids': 'a'}).status_code,
+            400
+        )
+
+
+@mock.patch.object(EstimatedCountPaginator, 'threshold', 3)
+class EstimatedCountPaginatorTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.author = User.objects.create(username='author')
+        self.other = User.objects.create(username='other')
+        now = timezone.now()
+        Post.objects.bulk_create([
+            Post(user=user, title='title', text='text', created_datetime=now,
+                 created_by=user.id)
+            for user in [self.author] * 5 + [self.other]
+        ])
+
+    def count(self, queryset):
+        return EstimatedCountPaginator(queryset.order_by('id'), 2).count
+
+    def test_filtered_count_is_capped(self):
+        with mock.patch('social_network.admin.estimate_count',
+                        return_value=1000000) as estimate:
+            self.assertEqual(self.count(Post.objects.filter(user=self.author)),
+                             3 + 1)
+            estimate.assert_not_called()
+            # The estimate is used for the unfiltered changelists only
+            self.assertEqual(self.count(Post.objects.all()), 1000000)
+        self.assertEqual(self.count(Post.objects.filter(user=self.other)), 1)
+
+    def test_counts_without_the_statistics(self):
+        # The other databases have no estimates, the count is capped
+        self.assertEqual(admin_estimate_count(Post), None)
+        self.assertEqual(self.count(Post.objects.all()), 3 + 1)
+        with mock.patch('social_network.admin.estimate_count',
+                        return_value=2):
+            self.assertEqual(self.count(Post.objects.all()), 3 + 1)
+
+    def test_searched_changelist(self):
+        admin_user = User.objects.create(username='admin', is_staff=True,
+                                         is_superuser=True)
+        client = APIClient()
+        client.force_login(admin_user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/admin/social_network/post/',
+                                  {'q': 'auth'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 3 + 1)
+        self.assertTrue(any(
+            'COUNT(*)' in query['sql'] and 'LIMIT 4' in query['sql']
+            for query in queries.captured_queries
+        ))
@@ -0,0 +1,201 @@
+import time
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from rest_framework.throttling import BaseThrottle
+
+
+class LocalBucketStore:
+    """
+    The in-process token bucket store.
+
+    The state of each bucket is a (tokens, updated) tuple which is replaced
+    by a single dictionary assignment, so the store needs no locks. Two
+    threads racing on the same bucket might lose one of the updates, which
+    only makes the throttling slightly more lenient.
+    """
+    # The number of buckets kept before the full ones are dropped
+    max_buckets = 100000
+
+    def __init__(self):
+        self._buckets = {}
+
+    def consume(self, key, cost, rate, capacity):
+        """
+        Takes the cost out of the bucket refilled with the rate tokens per
+        second up to the capacity.
+
+        Returns:
+            float: 0 if the request is allowed, otherwise the number of
+            seconds until the bucket has enough tokens.
+        """
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+
+        if tokens < cost:
+            self._buckets[key] = (tokens, now)
+            return (cost - tokens) / rate
+
+        if len(self._buckets) >= self.max_buckets:
+            self._prune(now, rate, capacity)
+        self._buckets[key] = (tokens - cost, now)
+        return 0
+
+    def refund(self, key, cost, rate, capacity):
+        """
+        Gives the cost taken by consume() back to the bucket.
+        """
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            tokens, updated = bucket
+            self._buckets[key] = (min(capacity, tokens + cost), updated)
+
+    def _prune(self, now, rate, capacity):
+        # The buckets idle long enough to be refilled are the same as new ones
+        full_after = capacity / rate
+        for key, (_, updated) in list(self._buckets.items()):
+            if now - updated >= full_after:
+                self._buckets.pop(key, None)
+
+
+class CacheBucketStore:
+    """
+    The token bucket store shared by all the workers through the shared
+    Django cache.
+
+    Every bucket is read and written under its own lock taken with the
+    atomic cache.add(), so the concurrent requests of the different workers
+    never spend the same tokens twice. The lock expires after lock_timeout
+    seconds in case its holder dies. The request which does not get the
+    lock within lock_wait seconds is throttled for lock_wait seconds rather
+    than let through unaccounted.
+    """
+    lock_timeout = 1
+    lock_wait = 0.05
+
+    def __init__(self, alias='shared'):
+        self.cache = caches[alias]
+
+    def lock(self, key):
+        """
+        Returns:
+            bool: Whether the bucket's lock has been taken within lock_wait.
+        """
+        deadline = time.monotonic() + self.lock_wait
+        while not self.cache.add(f'throttle-lock:{key}', 1,
+                                 self.lock_timeout):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def unlock(self, key):
+        self.cache.delete(f'throttle-lock:{key}')
+
+    def consume(self, key, cost, rate, capacity):
+        cache_key = f'throttle:{key}'
+        if not self.lock(key):
+            return self.lock_wait
+
+        try:
+            now = time.time()
+            tokens, updated = self.cache.get(cache_key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            timeout = int(capacity / rate) + 1
+
+            if tokens < cost:
+                self.cache.set(cache_key, (tokens, now), timeout)
+                return (cost - tokens) / rate
+
+            self.cache.set(cache_key, (tokens - cost, now), timeout)
+            return 0
+        finally:
+            self.unlock(key)
+
+    def refund(self, key, cost, rate, capacity):
+        # Without the lock the tokens are not refunded, which only makes the
+        # throttling slightly stricter
+        cache_key = f'throttle:{key}'
+        if not self.lock(key):
+            return
+        try:
+            bucket = self.cache.get(cache_key)
+            if bucket is not None:
+                tokens, updated = bucket
+                self.cache.set(cache_key,
+                               (min(capacity, tokens + cost), updated),
+                               int(capacity / rate) + 1)
+        finally:
+            self.unlock(key)
+
+
+_store = None
+
+
+def get_bucket_store():
+    global _store
+    if _store is None:
+        _store = import_string(settings.THROTTLING['STORE'])()
+    return _store
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttles the requests with the token buckets of the User, the
+    Authentication Token and the client's IP address.
+
+    Every route drains the buckets by its cost from THROTTLING['COSTS']
+    (keyed by the URL name), so the expensive routes such as the login are
+    exhausted faster than the cheap ones. The client's IP address is taken
+    from the X-Forwarded-For header only behind the REST_FRAMEWORK
+    ['NUM_PROXIES'] trusted proxies, otherwise the clients could choose it.
+    """
+    def __init__(self):
+        self.config = settings.THROTTLING
+        self.store = get_bucket_store()
+        self.wait_seconds = 0
+
+    def get_keys(self, request):
+        keys = [f'ip:{self.get_ident(request)}']
+        if request.user and request.user.is_authenticated:
+            keys.append(f'user:{request.user.pk}')
+        if request.auth is not None:
+            # The token keys are secret, so the buckets are keyed by hashes
+            token = getattr(request.auth, 'key', request.auth)
+            keys.append(
+                f'token:{hashlib.sha256(str(token).encode()).hexdigest()}'
+            )
+        return keys
+
+    def get_cost(self, request):
+        resolver_match = request.resolver_match
+        url_name = resolver_match.url_name if resolver_match else None
+        return self.config['COSTS'].get(url_name, 1)
+
+    def allow_request(self, request, view):
+        if not self.config.get('ENABLED', True):
+            return True
+
+        # The refused request takes no tokens, the ones taken from the
+        # buckets before the refusing one are given back
+        cost = self.get_cost(request)
+        rate, capacity = self.config['RATE'], self.config['CAPACITY']
+        consumed = []
+        for key in self.get_keys(request):
+            wait = self.store.consume(key, cost, rate, capacity)
+            if wait:
+                for consumed_key in consumed:
+                    self.store.refund(consumed_key, cost, rate, capacity)
+                self.wait_seconds = wait
+                return False
+            consumed.append(key)
+
+        self.wait_seconds = 0
+        return True
+
+    def wait(self):
+        return self.wait_seconds
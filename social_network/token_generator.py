@@ -1,41 +1,85 @@
 import logging
-import hashlib
+import secrets
 
-from rest_framework.authtoken.models import Token
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
 
+from .models import AuthToken
 
-def create_or_update_auth_token(user):
+UPSERT_AUTH_TOKEN_SQL = '''
+INSERT INTO social_network_authtoken
+    (key, user_id, device, created_datetime, expires_datetime)
+VALUES (%(key)s, %(user_id)s, %(device)s, %(now)s, %(expires)s)
+ON CONFLICT (user_id, device) DO UPDATE SET
+    key = EXCLUDED.key,
+    created_datetime = EXCLUDED.created_datetime,
+    expires_datetime = EXCLUDED.expires_datetime
+RETURNING id
+'''
+
+
+def generate_key():
+    """
+    Generates a new random Authentication Token key of 40 hex characters.
+    """
+    return secrets.token_hex(20)
+
+
+def get_expires_datetime(now):
+    ttl = settings.AUTH_TOKEN['TTL']
+    return now + ttl if ttl else None
+
+
+def create_or_update_auth_token(user, device='default'):
     """
-    Creates or updates the authentication Token for the User
+    Creates or updates the authentication Token for the User's device
+
+    On PostgreSQL the token is issued with a single INSERT ... ON CONFLICT
+    DO UPDATE ... RETURNING statement, so the login costs one round trip
+    regardless of whether the device already has a token, and the returned
+    token carries the id of its row, either new or updated.
 
     Args:
         user (request.user): The User
+        device (str): The name of the User's device
 
     Returns:
-        None.
+        AuthToken: The issued token or None if it failed.
     """
     try:
-        token = Token.objects.filter(user=user)
-
-        if not token:
-            # Create a new authentication token
-            token = Token.objects.get_or_create(user=user)
-        else:
-            # Update an existing authentication token
-            token = Token.objects.filter(user=user)
-            new_key = token[0].generate_key()
-
-            # Encrypt random string using SHA1
-            sha1_algorithm = hashlib.sha1()
-            sha1_algorithm.update(new_key.encode('utf-8'))
-            first_level_value = sha1_algorithm.hexdigest()
-
-            # Encrypt random string using MD5
-            md5_algorithm = hashlib.md5()
-            md5_algorithm.update(first_level_value.encode('utf-8'))
-            second_level_value = md5_algorithm.hexdigest()
-
-            token.update(key=second_level_value)
+        now = timezone.now()
+        token = AuthToken(
+            key=generate_key(),
+            user=user,
+            device=device,
+            created_datetime=now,
+            expires_datetime=get_expires_datetime(now)
+        )
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(UPSERT_AUTH_TOKEN_SQL, {
+                    'key': token.key,
+                    'user_id': user.id,
+                    'device': device,
+                    'now': now,
+                    'expires': token.expires_datetime,
+                })
+                token.id = cursor.fetchone()[0]
+            return token
+
+        # The bulk_create() with update_conflicts does not set the id
+        AuthToken.objects.bulk_create(
+            [token],
+            update_conflicts=True,
+            # Django 4.1 puts the unique_fields names into the ON CONFLICT
+            # clause as they are, so the column name of the User is used
+            unique_fields=['user_id', 'device'],
+            update_fields=['key', 'created_datetime', 'expires_datetime']
+        )
+        token.id = AuthToken.objects.filter(
+            key=token.key
+        ).values_list('id', flat=True).get()
         return token
 
     except Exception as e:
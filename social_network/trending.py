@@ -0,0 +1,191 @@
+import math
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Post, TrendingPost, RollupWatermark
+from .analytics import ALL_COUNTRIES, is_unsettled
+from .counters import SUBSCRIBERS, get_counters
+
+# The watermark of the last Post added to the trending lists
+TRENDING_WATERMARK = 'trending'
+
+
+def get_decay_seconds():
+    # The scores decay by e every this many seconds
+    return settings.TRENDING['HALF_LIFE'].total_seconds() / math.log(2)
+
+
+def score_post(created_datetime, followers, engagement=0):
+    """
+    Scores the Post by the followers of its author and its engagement,
+    once it is recorded, decaying with its age.
+
+    The score is the logarithm of the Post's weight shifted by its created
+    time, so the decayed score at any time is exp(score - time / decay).
+    All the scores decay alike, so the order of the Posts never changes as
+    they age and the lists are only refreshed with the new Posts.
+
+    Returns:
+        float: The time-invariant score.
+    """
+    weight = 1 + math.log1p(followers) + engagement
+    return math.log(weight) + created_datetime.timestamp() / get_decay_seconds()
+
+
+def decayed_score(score, now=None):
+    now = now or timezone.now()
+    return math.exp(score - now.timestamp() / get_decay_seconds())
+
+
+def add_posts(rows):
+    """
+    Merges the Posts into the trending lists of all the Countries and the
+    Countries of their authors, keeping only the TRENDING['SIZE'] best
+    Posts of every list.
+
+    Args:
+        rows (list): The (id, user id, country id, created datetime) tuples
+        of the Posts
+
+    Returns:
+        int: The number of the Posts added to any list.
+    """
+    size = settings.TRENDING['SIZE']
+    now = timezone.now()
+    cutoff = now - settings.TRENDING['MAX_AGE']
+    # The Posts dated in the future would top the lists until then
+    rows = [(post_id, user_id, country_id, min(created_datetime, now))
+            for post_id, user_id, country_id, created_datetime in rows
+            if created_datetime >= cutoff]
+    if not rows:
+        return 0
+
+    followers = get_counters({user_id for _, user_id, _, _ in rows},
+                             SUBSCRIBERS)
+    candidates = {}
+    for post_id, user_id, country_id, created_datetime in rows:
+        score = score_post(created_datetime, followers[user_id])
+        for list_id in {ALL_COUNTRIES, country_id or ALL_COUNTRIES}:
+            candidates.setdefault(list_id, []).append(
+                (score, post_id, created_datetime)
+            )
+
+    added = set()
+    for list_id, posts in candidates.items():
+        posts = sorted(posts, reverse=True)[:size]
+
+        # The Posts scored below the full list's last one would be trimmed
+        lowest = TrendingPost.objects.filter(
+            country_id=list_id
+        ).order_by('-score').values_list('score', flat=True)[size - 1:size]
+        lowest = next(iter(lowest), None)
+        if lowest is not None:
+            posts = [post for post in posts if post[0] > lowest]
+        if not posts:
+            continue
+
+        TrendingPost.objects.bulk_create([
+            TrendingPost(country_id=list_id, post_id=post_id, score=score,
+                         created_datetime=created_datetime)
+            for score, post_id, created_datetime in posts
+        ], ignore_conflicts=True)
+        trimmed = TrendingPost.objects.filter(
+            country_id=list_id
+        ).order_by('-score', 'post_id').values_list('id', flat=True)[size:]
+        TrendingPost.objects.filter(id__in=list(trimmed)).delete()
+        added.update(post_id for _, post_id, _ in posts)
+    return len(added)
+
+
+def post_rows(queryset):
+    return list(queryset.values_list('id', 'user_id', 'user__country_id',
+                                     'created_datetime'))
+
+
+def refresh_trending(batch_size=10000):
+    """
+    Adds the next batch of the Posts created since the watermark to the
+    trending lists and removes the Posts older than TRENDING['MAX_AGE'].
+    The same as the rollups, the batch stops before the first Post younger
+    than the ROLLUP_LAG, so the Posts committed late with the lower ids are
+    not skipped by the watermark.
+
+    Returns:
+        int: The number of the read Posts, 0 once the lists are up to date.
+    """
+    with transaction.atomic():
+        watermark, _ = RollupWatermark.objects.select_for_update(
+        ).get_or_create(metric=TRENDING_WATERMARK)
+
+        rows = post_rows(Post.objects.filter(
+            id__gt=watermark.last_id
+        ).order_by('id')[:batch_size])
+        now = timezone.now()
+        for index, row in enumerate(rows):
+            if is_unsettled(row[3], now):
+                rows = rows[:index]
+                break
+        prune_trending()
+        if not rows:
+            return 0
+
+        add_posts(rows)
+        watermark.last_id = rows[-1][0]
+        watermark.updated_datetime = timezone.now()
+        watermark.save(update_fields=['last_id', 'updated_datetime'])
+        return len(rows)
+
+
+def rebuild_trending(batch_size=10000):
+    """
+    Recomputes the trending lists from the Posts younger than
+    TRENDING['MAX_AGE'] with the current followers counts.
+
+    The Posts are read from the newest by their ids, so only the young
+    Posts are read, without an index on their created datetime. The Posts
+    younger than the ROLLUP_LAG are left to the refresh, whose watermark is
+    set below them. Adding a Post twice changes nothing.
+
+    Returns:
+        int: The number of the read Posts.
+    """
+    now = timezone.now()
+    cutoff = now - settings.TRENDING['MAX_AGE']
+    with transaction.atomic():
+        watermark, _ = RollupWatermark.objects.select_for_update(
+        ).get_or_create(metric=TRENDING_WATERMARK)
+        TrendingPost.objects.all().delete()
+
+        last_id, count, before_id = None, 0, None
+        while True:
+            posts = Post.objects.order_by('-id')
+            if before_id is not None:
+                posts = posts.filter(id__lt=before_id)
+            rows = post_rows(posts[:batch_size])
+            if not rows:
+                break
+
+            if last_id is None:
+                last_id = rows[0][0]
+            before_id, oldest = rows[-1][0], rows[-1][3]
+            unsettled = [row[0] for row in rows if is_unsettled(row[3], now)]
+            if unsettled:
+                last_id = min(last_id, min(unsettled) - 1)
+                rows = [row for row in rows if row[0] not in unsettled]
+            count += len(rows)
+            add_posts(rows)
+            if oldest < cutoff:
+                break
+
+        if last_id is not None:
+            watermark.last_id = last_id
+        watermark.updated_datetime = timezone.now()
+        watermark.save(update_fields=['last_id', 'updated_datetime'])
+        return count
+
+
+def prune_trending():
+    cutoff = timezone.now() - settings.TRENDING['MAX_AGE']
+    TrendingPost.objects.filter(created_datetime__lt=cutoff).delete()
@@ -1,10 +1,11 @@
+from django.conf import settings
 from django.urls import path, include
-from rest_framework.authtoken import views
 
 from .views import \
     RegisterView, \
     LoginView, \
     LogoutView, \
+    TokenRefreshView, \
     UserProfileView, \
     CountriesView, \
     CitiesView, \
@@ -16,14 +17,21 @@ from .views import \
     UserSubscribersView, \
     UserProfileDetailsView, \
     UsersView, \
-    TopTwentyUsersView
+    UsersBatchView, \
+    TopTwentyUsersView, \
+    UserExportView, \
+    PostsActivityView, \
+    SubscribersActivityView, \
+    ActiveCountriesView, \
+    TrendingPostsView, \
+    BatchView
 
 
 urlpatterns = [
-    path('__debug__/', include('debug_toolbar.urls')),
     path('register/', RegisterView.as_view(), name='register'),
     path('login/', LoginView.as_view(), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
+    path('token-refresh/', TokenRefreshView.as_view(), name='token-refresh'),
     path('my-profile/', UserProfileView.as_view(), name='my-profile'),
     path('countries/', CountriesView.as_view(), name='countries'),
     path('cities/', CitiesView.as_view(), name='cities'),
@@ -42,10 +50,28 @@ urlpatterns = [
     path('my-profile-details/', UserProfileDetailsView.as_view(),
          name='my-profile-details/'),
     path('users/', UsersView.as_view(), name='users'),
+    path('users/batch/', UsersBatchView.as_view(), name='users-batch'),
     path('top-twenty-users/', TopTwentyUsersView.as_view(),
-         name='top-twenty-users')
+         name='top-twenty-users'),
+    path('my-export/', UserExportView.as_view(), name='my-export'),
+    path('users/<int:user_id>/export/', UserExportView.as_view(),
+         name='user-export'),
+    path('trending/', TrendingPostsView.as_view(), name='trending'),
+    path('batch/', BatchView.as_view(), name='batch'),
+    path('analytics/posts/', PostsActivityView.as_view(),
+         name='analytics-posts'),
+    path('analytics/subscribers/', SubscribersActivityView.as_view(),
+         name='analytics-subscribers'),
+    path('analytics/active-countries/', ActiveCountriesView.as_view(),
+         name='analytics-active-countries')
 ]
 
 urlpatterns += [
-    path('api-token-auth/', views.obtain_auth_token)
+    path('api-token-auth/', LoginView.as_view(), name='api-token-auth')
 ]
+
+# The debug toolbar is not installed in the production settings
+if 'debug_toolbar' in settings.INSTALLED_APPS:
+    urlpatterns += [
+        path('__debug__/', include('debug_toolbar.urls')),
+    ]
@@ -1,20 +1,19 @@
 import logging
-
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.authentication import TokenAuthentication
-from rest_framework.authtoken.serializers import AuthTokenSerializer
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework import generics
 
+from django.conf import settings
 from django.utils import timezone
-from django.http import Http404, HttpResponseServerError
-from django.db.models import Count
+from django.http import Http404, StreamingHttpResponse
+from django.db.models import Count, F, Sum, prefetch_related_objects
 from django.contrib.auth import login, logout
 
 from .serializers import \
     RegisterSerializer, \
+    LoginSerializer, \
     UserSerializer, \
     UserUpdateSerializer, \
     UserDetailedSerializer, \
@@ -32,15 +31,38 @@ from .serializers import \
     PostSerializer, \
     PostCreateSerializer, \
     PostUpdateSerializer, \
-    SubscriptionSerializer
+    SubscriptionSerializer, \
+    BatchSerializer, \
+    parse_shape
 
-from .models import Country, City, Interest, UserInterest, Post, Subscription
+from .models import Country, City, Interest, UserInterest, Post, \
+    Subscription, AuthToken, HourlyActivity, DailyActivity, TrendingPost
 
 from .token_generator import create_or_update_auth_token
+from .authentication import ExpiringTokenAuthentication, SignedAccessToken, \
+    revoke_access_tokens
+from .archive import PostArchive
+from .exporters import EXPORT_FORMATS, stream_export
+from .conditional import conditional_user_get, bump_user_versions
+from .fields import bump_reference_version, ReferenceData
+from .deletion import enqueue_deletion
+from .analytics import POSTS, SUBSCRIPTIONS, ALL_COUNTRIES, \
+    parse_interval, parse_limit
+from .trending import decayed_score
+from .batch import BATCH_MAX_REQUESTS, dispatch_batch
+from .counters import SUBSCRIBERS, get_counter
+from .subscriptions import subscribe, unsubscribe, MAX_SUBSCRIPTIONS, \
+    SELF_SUBSCRIPTION, USER_NOT_FOUND, LIMIT_REACHED, ALREADY_SUBSCRIBED
+from .filters import PostFilterSet, SubscriptionFilterSet, UserFilterSet, \
+    UserInterestFilterSet, DailyActivityFilterSet, HourlyActivityFilterSet, \
+    TopCountriesFilterSet, TrendingPostFilterSet, parse_id_list
 
 from django.contrib.auth import get_user_model
 User = get_user_model()
 
+# The highest number of the Users retrieved by a single batch request
+BATCH_USERS_MAX = 100
+
 
 class RegisterView(generics.CreateAPIView):
     """
@@ -58,6 +80,9 @@ class RegisterView(generics.CreateAPIView):
     """
     permission_classes = (AllowAny, )
     serializer_class = RegisterSerializer
+    query_budget = {'POST': 5}
+    # Hashing the password takes most of the time
+    time_budget = 5.0
 
 
 class LoginView(APIView):
@@ -69,18 +94,67 @@ class LoginView(APIView):
     each other.
 
     If the login succeeds, then a new Authentication Token is issued
-    for each user.
+    for the User's device given by the optional device field, so the User
+    stays logged in on their other devices.
     """
-    permissions_classes = (AllowAny, )
+    permission_classes = (AllowAny, )
+    query_budget = {'POST': 8}
+    time_budget = 5.0
 
     def post(self, request):
-        content = {'message': 'Login success'}
-        serializer = AuthTokenSerializer(data=request.data)
+        serializer = LoginSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
-        login(request, user)
+        # The token-only API profile runs without the sessions
+        if hasattr(request, 'session'):
+            login(request, user)
         # Creating a new token each time when the User logs in
-        _ = create_or_update_auth_token(user=user)
+        token = create_or_update_auth_token(
+            user=user,
+            device=serializer.validated_data.get('device') or 'default'
+        )
+        if token is None:
+            return Response({'message': 'Login failed'},
+                            status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        content = {
+            'message': 'Login success',
+            'token': token.key,
+            'expires': token.expires_datetime,
+        }
+        if settings.SIGNED_TOKEN_AUTH['ENABLED']:
+            access_token = SignedAccessToken.issue(user.id, token.device)
+            content['access_token'] = access_token.key
+        return Response(content, status.HTTP_200_OK)
+
+
+class TokenRefreshView(APIView):
+    """
+    This view is used for to issue a new short-lived signed access token
+    in exchange for the User's Authentication Token given as the
+    refresh_token.
+    """
+    authentication_classes = ()
+    permission_classes = (AllowAny, )
+    query_budget = {'POST': 3}
+    time_budget = 1.0
+
+    def post(self, request):
+        refresh_token = request.data.get('refresh_token')
+        if not refresh_token:
+            content = {'message': 'The refresh_token is required'}
+            return Response(content, status=status.HTTP_400_BAD_REQUEST)
+
+        user, token = ExpiringTokenAuthentication().authenticate_credentials(
+            refresh_token
+        )
+        access_token = SignedAccessToken.issue(user.id, token.device)
+        content = {
+            'access_token': access_token.key,
+            'expires_in': settings.SIGNED_TOKEN_AUTH[
+                'ACCESS_TTL'
+            ].total_seconds(),
+        }
         return Response(content, status.HTTP_200_OK)
 
 
@@ -88,15 +162,25 @@ class LogoutView(APIView):
     """
     This view is used for to log out the specific User from the site.
 
-    On logout the Authentication Token is removed from each user and
-    the new Authentication Token is issued on their next login.
+    On logout the Authentication Token of the User's current device is
+    removed and the new Authentication Token is issued on their next login.
     """
     permission_classes = (AllowAny, )
+    query_budget = {'POST': 5}
+    time_budget = 1.0
 
     def post(self, request):
         content = {'message': 'Logout success'}
-        request.user.auth_token.delete()
-        logout(request)
+        if isinstance(request.auth, SignedAccessToken):
+            # Logging out the device and revoking its access tokens
+            AuthToken.objects.filter(
+                user=request.auth.user_id, device=request.auth.device
+            ).delete()
+            revoke_access_tokens(request.auth.user_id)
+        elif request.auth is not None:
+            request.auth.delete()
+        if hasattr(request, 'session'):
+            logout(request)
         return Response(content, status.HTTP_200_OK)
 
 
@@ -113,13 +197,23 @@ class UserProfileView(APIView):
     6. biography
     7. birth_date
     8. The list of interests
+
+    Using the DELETE method the users are able to delete their account. The
+    account is deactivated and logged out at once, its data is deleted by
+    the queued DeletionJob.
     """
-    authentication_classes = (TokenAuthentication, )
     permission_classes = (IsAuthenticated, )
+    # The updated Interests are saved one by one
+    query_budget = {'GET': 4, 'PUT': 20, 'DELETE': 8}
+    time_budget = 1.0
 
+    @conditional_user_get
     def get(self, request):
-        user = User.objects.get(id=request.user.id)
-        serializer = UserSerializer(user)
+        fieldset = UserSerializer.parse_fieldset(request.GET)
+        user = UserSerializer.narrow_queryset(
+            User.objects.all(), **fieldset
+        ).get(id=request.user.id)
+        serializer = UserSerializer(user, **fieldset)
         return Response(serializer.data)
 
     def put(self, request):
@@ -129,6 +223,21 @@ class UserProfileView(APIView):
         serializer.save()
         return Response(serializer.data)
 
+    def delete(self, request):
+        user_id = request.user.id
+        User.objects.filter(id=user_id).update(
+            is_active=False,
+            version=F('version') + 1,
+            modified_datetime=timezone.now()
+        )
+        AuthToken.objects.filter(user=user_id).delete()
+        revoke_access_tokens(user_id)
+        if hasattr(request, 'session'):
+            logout(request)
+
+        job = enqueue_deletion('user', user_id, user_id)
+        return Response({'job_id': job.id}, status.HTTP_202_ACCEPTED)
+
 
 class CountriesView(APIView):
     """
@@ -137,20 +246,27 @@ class CountriesView(APIView):
     1. Retrieve all available Countries list
     2. Add a new Country
     3. Update the existing Country's name
-    4. Remove the specific Country
+    4. Queue the deletion of the specific Country, see DeletionJob
     """
-    authentication_classes = (TokenAuthentication, )
     permission_classes = (IsAuthenticated, )
+    # The writes bump the version in the shared cache, which costs up to 4
+    # queries when it is the database cache
+    query_budget = {'GET': 2, 'POST': 8, 'PUT': 9, 'DELETE': 6}
+    time_budget = 1.0
 
     def get(self, request):
-        countries = Country.objects.all()
-        serializer = CountrySerializer(countries, many=True)
+        fieldset = CountrySerializer.parse_fieldset(request.GET)
+        countries = CountrySerializer.narrow_queryset(
+            Country.objects.all(), **fieldset
+        )
+        serializer = CountrySerializer(countries, many=True, **fieldset)
         return Response(serializer.data)
 
     def post(self, request):
         serializer = CountryCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        bump_reference_version(Country)
         return Response(serializer.data)
 
     def put(self, request):
@@ -160,12 +276,13 @@ class CountriesView(APIView):
         )
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        bump_reference_version(Country)
         return Response(serializer.data)
 
     def delete(self, request):
         country = Country.objects.get(id=request.data.get('id'))
-        country.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        job = enqueue_deletion('country', country.id, request.user.id)
+        return Response({'job_id': job.id}, status.HTTP_202_ACCEPTED)
 
 
 class CitiesView(APIView):
@@ -175,22 +292,27 @@ class CitiesView(APIView):
     1. Retrieve all available Cities with their Countries list
     2. Add a new City
     3. Update the existing City's name
-    4. Remove the specific City
+    4. Queue the deletion of the specific City, see DeletionJob
     """
-    authentication_classes = (TokenAuthentication, )
     permission_classes = (IsAuthenticated, )
+    # The writes bump the version in the shared cache, which costs up to 4
+    # queries when it is the database cache
+    query_budget = {'GET': 2, 'POST': 8, 'PUT': 9, 'DELETE': 6}
+    time_budget = 1.0
 
     def get(self, request):
-        cities = City.objects.select_related(
-            'country'
-        ).all()
-        serializer = CitySerializer(cities, many=True)
+        fieldset = CitySerializer.parse_fieldset(request.GET)
+        cities = CitySerializer.narrow_queryset(
+            City.objects.all(), **fieldset
+        )
+        serializer = CitySerializer(cities, many=True, **fieldset)
         return Response(serializer.data)
 
     def post(self, request):
         serializer = CityCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        bump_reference_version(City)
         return Response(serializer.data)
 
     def put(self, request):
@@ -200,12 +322,13 @@ class CitiesView(APIView):
         )
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        bump_reference_version(City)
         return Response(serializer.data)
 
     def delete(self, request):
         city = City.objects.get(id=request.data.get('id'))
-        city.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        job = enqueue_deletion('city', city.id, request.user.id)
+        return Response({'job_id': job.id}, status.HTTP_202_ACCEPTED)
 
 
 class InterestsView(APIView):
@@ -215,20 +338,27 @@ class InterestsView(APIView):
     1. Retrieve all available Interests list
     2. Add a new Interest
     3. Update the existing Interest's name
-    4. Remove the specific Interest
+    4. Queue the deletion of the specific Interest, see DeletionJob
     """
-    authentication_classes = (TokenAuthentication, )
     permission_classes = (IsAuthenticated, )
+    # The writes bump the version in the shared cache, which costs up to 4
+    # queries when it is the database cache
+    query_budget = {'GET': 2, 'POST': 8, 'PUT': 9, 'DELETE': 6}
+    time_budget = 1.0
 
     def get(self, request):
-        interests = Interest.objects.all()
-        serializer = InterestSerializer(interests, many=True)
+        fieldset = InterestSerializer.parse_fieldset(request.GET)
+        interests = InterestSerializer.narrow_queryset(
+            Interest.objects.all(), **fieldset
+        )
+        serializer = InterestSerializer(interests, many=True, **fieldset)
         return Response(serializer.data)
 
     def post(self, request):
         serializer = InterestCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        bump_reference_version(Interest)
         return Response(serializer.data)
 
     def put(self, request):
@@ -238,53 +368,77 @@ class InterestsView(APIView):
         )
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        bump_reference_version(Interest)
+        self.bump_interested_users(interest)
         return Response(serializer.data)
 
     def delete(self, request):
         interest = Interest.objects.get(id=request.data.get('id'))
-        interest.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        job = enqueue_deletion('interest', interest.id, request.user.id)
+        return Response({'job_id': job.id}, status.HTTP_202_ACCEPTED)
+
+    def bump_interested_users(self, interest):
+        # The User profiles embed the names of their Interests
+        User.objects.filter(interests__interest=interest).update(
+            version=F('version') + 1,
+            modified_datetime=timezone.now()
+        )
 
 
 class UserInterestsView(APIView):
     """
     This view is used for to:
 
-    1. Retrieve all available UserInterests list
+    1. Retrieve all available UserInterests list filtered by the given
+    user and interest lists
     2. Add a new Interest to specific User
     3. Update the existing specific User's Interest's name
     4. Remove the specific User's specific Interest
     """
-    authentication_classes = (TokenAuthentication, )
     permission_classes = (IsAuthenticated, )
+    query_budget = {'GET': 2, 'POST': 7, 'PUT': 9, 'DELETE': 4}
+    time_budget = 1.0
 
     def get(self, request, user_id=None):
+        user_interests = UserInterest.objects.all()
         if user_id:
-            user_interests = UserInterest.objects.filter(user=user_id)
-        else:
-            user_interests = UserInterest.objects.all()
+            user_interests = user_interests.filter(user=user_id)
+
+        filterset = UserInterestFilterSet(request.GET)
+        filterset.is_valid(raise_exception=True)
+        user_interests = filterset.filter(user_interests)
 
-        serializer = UserInterestSerializer(user_interests, many=True)
+        fieldset = UserInterestSerializer.parse_fieldset(request.GET)
+        user_interests = UserInterestSerializer.narrow_queryset(
+            user_interests, **fieldset
+        )
+        serializer = UserInterestSerializer(
+            user_interests, many=True, **fieldset
+        )
         return Response(serializer.data)
 
     def post(self, request):
         serializer = UserInterestCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        user_interest = serializer.save()
+        bump_user_versions(user_interest.user_id)
         return Response(serializer.data)
 
     def put(self, request):
         user_interest = UserInterest.objects.get(id=request.data.get('id'))
+        previous_user_id = user_interest.user_id
         serializer = UserInterestCreateSerializer(
             user_interest, data=request.data, partial=True
         )
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        bump_user_versions(previous_user_id, user_interest.user_id)
         return Response(serializer.data)
 
     def delete(self, request):
         user_interest = UserInterest.objects.get(id=request.data.get('id'))
         user_interest.delete()
+        bump_user_versions(user_interest.user_id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -297,41 +451,64 @@ class PostsView(APIView):
     parameters
     2. Create a new Post
     3. Update the existing Post
+
+    The shape=compact parameter returns the author once in the included
+    map instead of in every Post.
     """
-    authentication_classes = (TokenAuthentication, )
     permission_classes = (IsAuthenticated, )
+    # Reading the archive loads the author's Interests once more
+    query_budget = {'GET': 6, 'POST': 8, 'PUT': 10}
+    time_budget = 1.0
 
+    @conditional_user_get
     def get(self, request):
-        title = request.GET.get('title')
-        text = request.GET.get('text')
-        start_date = request.GET.get('start_date')
-        end_date = request.GET.get('end_date')
-
-        posts = Post.objects.select_related(
-            'user'
-        ).filter(
-            user__id=request.user.id
+        filterset = PostFilterSet(request.GET, scoped=True)
+        filterset.is_valid(raise_exception=True)
+
+        compact = parse_shape(request.GET) == 'compact'
+        fieldset = PostSerializer.parse_fieldset(request.GET, compact)
+        posts = PostSerializer.narrow_queryset(
+            filterset.filter(Post.objects.filter(user__id=request.user.id)),
+            **fieldset
         ).order_by('-created_datetime')
 
-        if title:
-            posts = posts.filter(title__icontains=title)
-
-        if text:
-            posts = posts.filter(text__icontains=text)
-
-        if start_date and end_date:
-            posts = posts.filter(created_datetime__gte=start_date)
-            posts = posts.filter(created_datetime__lte=end_date)
-
-        elif start_date and not end_date:
-            posts = posts.filter(created_datetime__gte=start_date)
-
-        elif not start_date and end_date:
-            posts = posts.filter(created_datetime__lte=end_date)
+        posts = self.merge_archived_posts(
+            request, posts, **filterset.cleaned_data
+        )
 
-        serializer = PostSerializer(posts, many=True)
+        if compact:
+            return Response(PostSerializer.compact_data(posts, **fieldset))
+        serializer = PostSerializer(posts, many=True, **fieldset)
         return Response(serializer.data)
 
+    def merge_archived_posts(self, request, posts, title=None, text=None,
+                             created=(None, None)):
+        """
+        Appends the archived Posts of the User to the Posts from the database
+        when the requested date range reaches into the archive.
+        """
+        start, end = created
+
+        archive = PostArchive()
+        if not archive.covers(request.user.id, start=start, end=end):
+            return posts
+
+        posts = list(posts)
+        hot_ids = {post.id for post in posts}
+        # The archived Posts share their author, whose Interests are loaded
+        # once instead of for every archived Post
+        prefetch_related_objects([request.user], 'interests__interest')
+        for archived_post in archive.read(request.user.id, start=start,
+                                          end=end, title=title, text=text):
+            # The Post is still in the database if its archiving was
+            # interrupted before the delete
+            if archived_post['id'] in hot_ids:
+                continue
+            posts.append(Post(user=request.user, **archived_post))
+
+        posts.sort(key=lambda post: post.created_datetime, reverse=True)
+        return posts
+
     def post(self, request):
         serializer = PostCreateSerializer(
             data=request.data, context={'request': request}
@@ -358,60 +535,30 @@ class UserSubscriptionsView(APIView):
     by filtering them by the given usernames list, title, text, start_date
     and end_date parameters
     """
-    authentication_classes = (TokenAuthentication, )
     permission_classes = (IsAuthenticated, )
+    query_budget = {'GET': 6}
+    time_budget = 1.0
 
     def get(self, request):
-        usernames = request.GET.getlist('username')
-        title = request.GET.get('title')
-        text = request.GET.get('text')
-        start_date = request.GET.get('start_date')
-        end_date = request.GET.get('end_date')
-
-        subscriptions = Subscription.objects.select_related(
-            'user',
-            'subscribed_to_user'
-        ).prefetch_related(
-            'subscribed_to_user__posts'
-        ).filter(
-            user=request.user.id
+        filterset = SubscriptionFilterSet(request.GET, scoped=True)
+        filterset.is_valid(raise_exception=True)
+
+        compact = parse_shape(request.GET) == 'compact'
+        fieldset = SubscriptionSerializer.parse_fieldset(request.GET, compact)
+        subscriptions = SubscriptionSerializer.narrow_queryset(
+            filterset.filter(
+                Subscription.objects.filter(user=request.user.id)
+            ),
+            **fieldset
         ).order_by('-created_datetime')
 
-        # Making sure that the list of usernames to have up to 10 usernames
-        if usernames and isinstance(usernames, list) and len(usernames) <= 10:
-            subscriptions = subscriptions.filter(
-                subscribed_to_user__username__in=usernames
-            )
-
-        if title:
-            subscriptions = subscriptions.filter(
-                subscribed_to_user__posts__title__icontains=title
-            )
-
-        if text:
-            subscriptions = subscriptions.filter(
-                subscribed_to_user__posts__text__icontains=text
-            )
-
-        if start_date and end_date:
-            subscriptions = subscriptions.filter(
-                subscribed_to_user__posts__created_datetime__gte=start_date
+        if compact:
+            return Response(
+                SubscriptionSerializer.compact_data(subscriptions, **fieldset)
             )
-            subscriptions = subscriptions.filter(
-                subscribed_to_user__posts__created_datetime__lte=end_date
-            )
-
-        elif start_date and not end_date:
-            subscriptions = subscriptions.filter(
-                subscribed_to_user__posts__created_datetime__gte=start_date
-            )
-
-        elif not start_date and end_date:
-            subscriptions = subscriptions.filter(
-                subscribed_to_user__posts__created_datetime__lte=end_date
-            )
-
-        serializer = SubscriptionSerializer(subscriptions, many=True)
+        serializer = SubscriptionSerializer(
+            subscriptions, many=True, **fieldset
+        )
         return Response(serializer.data)
 
 
@@ -421,91 +568,67 @@ class ManageUserSubscriptionsView(APIView):
 
     1. Subscribe to a new User
     2. Unsubscribe from the previously subscribed User
+
+    The User can have at most 100 Subscriptions, the limit holds even for
+    the concurrent requests, see social_network.subscriptions.
     """
-    authentication_classes = (TokenAuthentication, )
     permission_classes = (IsAuthenticated, )
+    query_budget = {'POST': 15, 'DELETE': 11}
+    time_budget = 1.0
 
-    def get_user_object(self, user_id):
-        try:
-            return User.objects.get(id=user_id)
-        except User.DoesNotExist:
-            logging.error(
-                msg='Subscribing to User.DoesNotExist',
-                stacklevel=logging.CRITICAL
-            )
-            raise Http404
-        except User.MultipleObjectsReturned:
-            logging.error(
-                msg='Subscribing to User.MultipleObjectsReturned',
-                stacklevel=logging.CRITICAL
-            )
-            raise HttpResponseServerError
+    def post(self, request, subscribed_to_user_id):
+        user = request.user
+        result, username = subscribe(user.id, subscribed_to_user_id)
 
-    def get_subscription_object(self, user_id, subscribed_to_user_id):
-        try:
-            return Subscription.objects.get(
-                user_id=user_id,
-                subscribed_to_user_id=subscribed_to_user_id
-            )
-        except Subscription.DoesNotExist:
+        if result == USER_NOT_FOUND:
             logging.error(
-                msg='Subscription.DoesNotExist',
+                msg='Subscribing to User.DoesNotExist',
                 stacklevel=logging.CRITICAL
             )
             raise Http404
-        except Subscription.MultipleObjectsReturned:
-            logging.error(
-                msg='Subscription.MultipleObjectsReturned',
-                stacklevel=logging.CRITICAL
-            )
-            raise HttpResponseServerError
-
-    def post(self, request, subscribed_to_user_id):
-        content = {
-            'message': 'It is forbidden to have more than 100 Subscriptions'
-        }
 
-        user = request.user
-
-        # If the current User's total count of Subscription is more than 100
-        if Subscription.objects.filter(user=user.id).count() >= 100:
+        if result == LIMIT_REACHED:
+            content = {
+                'message': f'It is forbidden to have more than '
+                           f'{MAX_SUBSCRIPTIONS} Subscriptions'
+            }
             return Response(content, status=status.HTTP_403_FORBIDDEN)
 
-        subscribe_to_user = self.get_user_object(user_id=subscribed_to_user_id)
-
         # If the current User's tries to Subscribe to itself
-        if user.id == subscribe_to_user.id:
+        if result == SELF_SUBSCRIPTION:
             content = {
                 'message': 'It is forbidden to Subscribe to yourself'
             }
             return Response(content, status=status.HTTP_403_FORBIDDEN)
 
-        Subscription.objects.create(
-            user=user,
-            subscribed_to_user=subscribe_to_user,
-            created_datetime=timezone.now()
-        )
+        if result == ALREADY_SUBSCRIBED:
+            content = {
+                'message': f'The User: {user.username} is already '
+                           f'Subscribed to the User: {username}'
+            }
+            return Response(content, status=status.HTTP_200_OK)
 
         content = {
             'message': f'The User: {user.username} successfully Subscribed '
-                       f'to the User: {subscribe_to_user.username}'
+                       f'to the User: {username}'
         }
 
         return Response(content, status=status.HTTP_201_CREATED)
 
     def delete(self, request, subscribed_to_user_id=None):
         user = request.user
-        subscribed_to_user = self.get_user_object(user_id=subscribed_to_user_id)
+        username = unsubscribe(user.id, subscribed_to_user_id)
 
-        subscription = self.get_subscription_object(
-            user_id=user,
-            subscribed_to_user_id=subscribed_to_user.id
-        )
-        subscription.delete()
+        if username is None:
+            logging.error(
+                msg='Subscription.DoesNotExist',
+                stacklevel=logging.CRITICAL
+            )
+            raise Http404
 
         content = {
             'message': f'The User: {user.username} successfully Unsubscribed '
-                       f'from the User: {subscribed_to_user.username}'
+                       f'from the User: {username}'
         }
 
         return Response(content, status=status.HTTP_201_CREATED)
@@ -516,14 +639,24 @@ class UserSubscribersView(APIView):
     This view is used for to retrieve the list of Subscribers the specific
     User currently has.
     """
-    authentication_classes = (TokenAuthentication, )
     permission_classes = (IsAuthenticated, )
+    query_budget = {'GET': 6}
+    time_budget = 1.0
 
     def get(self, request):
-        subscriptions = Subscription.objects.filter(
-            subscribed_to_user=request.user.id
+        compact = parse_shape(request.GET) == 'compact'
+        fieldset = SubscriptionSerializer.parse_fieldset(request.GET, compact)
+        subscriptions = SubscriptionSerializer.narrow_queryset(
+            Subscription.objects.filter(subscribed_to_user=request.user.id),
+            **fieldset
+        )
+        if compact:
+            return Response(
+                SubscriptionSerializer.compact_data(subscriptions, **fieldset)
+            )
+        serializer = SubscriptionSerializer(
+            subscriptions, many=True, **fieldset
         )
-        serializer = SubscriptionSerializer(subscriptions, many=True)
         return Response(serializer.data)
 
 
@@ -532,9 +665,13 @@ class UserProfileDetailsView(APIView):
     This view is used for to retrieve the total number of Posts, Subscriptions
     and Subscribers the specific User currently has.
     """
-    authentication_classes = (TokenAuthentication, )
     permission_classes = (IsAuthenticated, )
+    query_budget = {'GET': 4}
+    time_budget = 1.0
+    # The subscribers counter does not bump the User's version
+    shows_counters = True
 
+    @conditional_user_get
     def get(self, request):
         return Response(
             {
@@ -544,9 +681,9 @@ class UserProfileDetailsView(APIView):
                 'total_subscriptions_count': Subscription.objects.filter(
                     user=request.user.id
                 ).count(),
-                'total_subscribers_count': Subscription.objects.filter(
-                    subscribed_to_user=request.user.id
-                ).count(),
+                'total_subscribers_count': get_counter(
+                    request.user.id, SUBSCRIBERS
+                ),
             }
         )
 
@@ -555,34 +692,295 @@ class UsersView(APIView):
     """
     This view is used for to retrieve the User Profiles Info, how many
     subscribers they currently have and their last 5 posts.
+
+    The Users are filtered by the given username, country, city and
+    interest lists and the first_name and last_name parameters.
     """
-    authentication_classes = (TokenAuthentication, )
     permission_classes = (IsAuthenticated, )
+    query_budget = {'GET': 10}
+    time_budget = 1.0
 
     def get(self, request):
-        users = User.objects.filter(is_staff=False).exclude(id=request.user.id)
-        serializer = UserDetailedSerializer(users, many=True)
+        filterset = UserFilterSet(request.GET)
+        filterset.is_valid(raise_exception=True)
+
+        fieldset = UserDetailedSerializer.parse_fieldset(request.GET)
+        users = UserDetailedSerializer.narrow_queryset(
+            filterset.filter(
+                User.objects.filter(is_staff=False).exclude(
+                    id=request.user.id
+                )
+            ),
+            **fieldset
+        )
+        serializer = UserDetailedSerializer(users, many=True, **fieldset)
         return Response(serializer.data)
 
 
+class UsersBatchView(APIView):
+    """
+    This view is used for to retrieve the User Profiles Info of up to 100
+    Users by the given ids parameter, in the order of the ids, with a fixed
+    number of queries.
+
+    The detailed=1 parameter adds how many posts, subscriptions and
+    subscribers the Users have and their last 5 posts, the same as the
+    users view. The ids of the Users not found, and of the staff members
+    who are not shown by the users view either, are listed as missing.
+    """
+    permission_classes = (IsAuthenticated, )
+    query_budget = {'GET': 10}
+    time_budget = 1.0
+
+    def get(self, request):
+        user_ids = parse_id_list(request.GET, max_values=BATCH_USERS_MAX)
+        serializer_class = UserDetailedSerializer \
+            if request.GET.get('detailed') == '1' else UserSerializer
+
+        fieldset = serializer_class.parse_fieldset(request.GET)
+        users = serializer_class.narrow_queryset(
+            User.objects.filter(is_active=True, is_staff=False), **fieldset
+        ).in_bulk(user_ids)
+
+        found = [users[user_id] for user_id in user_ids if user_id in users]
+        serializer = serializer_class(found, many=True, **fieldset)
+        return Response({
+            'data': serializer.data,
+            'missing': [user_id for user_id in user_ids
+                        if user_id not in users],
+        })
+
+
 class TopTwentyUsersView(APIView):
     """
     This view is used for to retrieve the top 20 most popular User
     Profiles Info, how many subscribers they currently have and their
     last 5 posts.
     """
-    authentication_classes = (TokenAuthentication, )
     permission_classes = (IsAuthenticated, )
+    query_budget = {'GET': 8}
+    time_budget = 1.0
 
     def get(self, request):
+        fieldset = UserDetailedSerializer.parse_fieldset(request.GET)
+
         # Filtering the top twenty users with the most subscribers and posts
-        top_twenty_users = User.objects.filter(
+        top_twenty_users = UserDetailedSerializer.narrow_queryset(
+            User.objects.all(), **fieldset
+        ).filter(
             is_staff=False
         ).annotate(
             number_of_subscribers=Count('subscribers')
         ).annotate(
             number_of_posts=Count('posts')
         ).order_by('-subscribers').order_by('-number_of_posts')[:20]
-        serializer = UserDetailedSerializer(top_twenty_users, many=True)
+        serializer = UserDetailedSerializer(
+            top_twenty_users, many=True, **fieldset
+        )
         return Response(serializer.data)
 
+
+class TrendingPostsView(APIView):
+    """
+    This view is used for to retrieve the Posts trending right now, of all
+    the Countries or of the given country of their authors, scored by the
+    followers of their authors and decaying with their age. The lists are
+    precomputed by the refresh_trending command.
+    """
+    permission_classes = (IsAuthenticated, )
+    query_budget = {'GET': 5}
+    time_budget = 1.0
+
+    def get(self, request):
+        limit = parse_limit(request.GET, default=20,
+                            maximum=settings.TRENDING['SIZE'])
+        filterset = TrendingPostFilterSet(request.GET, scoped=True)
+        filterset.is_valid(raise_exception=True)
+
+        trending = TrendingPost.objects.all()
+        if 'country' not in filterset.cleaned_data:
+            trending = trending.filter(country_id=ALL_COUNTRIES)
+        trending = filterset.filter(trending).order_by(
+            '-score', 'post_id'
+        ).values_list('post_id', 'score')[:limit]
+        scores = dict(trending)
+
+        fieldset = PostSerializer.parse_fieldset(request.GET)
+        posts = PostSerializer.narrow_queryset(
+            Post.objects.filter(id__in=scores), **fieldset
+        )
+        # The Posts deleted since the last refresh are left out
+        posts = sorted(posts, key=lambda post: (-scores[post.id], post.id))
+
+        now = timezone.now()
+        data = PostSerializer(posts, many=True, **fieldset).data
+        for post, item in zip(posts, data):
+            item['score'] = round(decayed_score(scores[post.id], now), 4)
+        return Response(data)
+
+
+class ActivityView(APIView):
+    """
+    The base of the views of the charts read from the hourly or daily
+    rollups of the metric, see the update_rollups command.
+    """
+    permission_classes = (IsAdminUser, )
+    metric = None
+    query_budget = {'GET': 2}
+    time_budget = 1.0
+
+    def get(self, request):
+        interval = parse_interval(request.GET)
+        if interval == 'hour':
+            model, filterset_class = HourlyActivity, HourlyActivityFilterSet
+        else:
+            model, filterset_class = DailyActivity, DailyActivityFilterSet
+        filterset = filterset_class(request.GET, scoped=True)
+        filterset.is_valid(raise_exception=True)
+
+        rows = model.objects.filter(metric=self.metric)
+        if 'country' not in filterset.cleaned_data:
+            rows = rows.filter(country_id=ALL_COUNTRIES)
+        rows = filterset.filter(rows).order_by(interval).values_list(
+            interval, 'value'
+        )
+        return Response([{interval: period, self.metric: value}
+                         for period, value in rows])
+
+
+class PostsActivityView(ActivityView):
+    """
+    This view is used for to retrieve the number of the Posts created per
+    day, or per hour with the interval=hour parameter, optionally filtered
+    by the given start_date, end_date and country parameters.
+    """
+    metric = POSTS
+
+
+class SubscribersActivityView(ActivityView):
+    """
+    This view is used for to retrieve the number of the new subscribers
+    per day, or per hour with the interval=hour parameter, optionally
+    filtered by the given start_date, end_date and country of the Users
+    subscribed to.
+    """
+    metric = SUBSCRIPTIONS
+
+
+class ActiveCountriesView(APIView):
+    """
+    This view is used for to retrieve the Countries whose Users have
+    created the most Posts between the given start_date and end_date.
+    """
+    permission_classes = (IsAdminUser, )
+    # The Countries are resolved with the shared cache version check
+    query_budget = {'GET': 4}
+    time_budget = 1.0
+
+    def get(self, request):
+        limit = parse_limit(request.GET)
+        filterset = TopCountriesFilterSet(request.GET, scoped=True)
+        filterset.is_valid(raise_exception=True)
+
+        # The Users without a Country and the totals have negative or 0 ids
+        totals = filterset.filter(
+            DailyActivity.objects.filter(metric=POSTS, country_id__gt=0)
+        ).values_list('country_id').annotate(
+            total=Sum('value')
+        ).order_by('-total', 'country_id')[:limit]
+
+        totals = list(totals)
+        countries = ReferenceData.get(Country).resolve(
+            [country_id for country_id, _ in totals]
+        )
+        return Response([
+            {
+                'id': country_id,
+                'name': countries[country_id].name
+                if country_id in countries else None,
+                POSTS: total,
+            }
+            for country_id, total in totals
+        ])
+
+
+class BatchView(APIView):
+    """
+    This view is used for to run up to 20 requests to the other API
+    endpoints in a single round trip, authenticated once, and to return
+    all their responses together in the order of the requests.
+
+    With parallel set, the batches of GET requests run at the same time.
+    """
+    permission_classes = (IsAuthenticated, )
+    # The batch itself cannot be a part of a batch
+    batchable = False
+    # The sub-requests run in the batch's own budget
+    query_budget = {'POST': BATCH_MAX_REQUESTS * 10}
+    time_budget = 5.0
+
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        responses = dispatch_batch(
+            request,
+            serializer.validated_data['requests'],
+            parallel=serializer.validated_data['parallel']
+        )
+        return Response({'responses': responses})
+
+
+class UserExportView(APIView):
+    """
+    This view is used for to stream the export of the User's profile,
+    interests, posts and subscriptions.
+
+    The file_format parameter selects between ndjson (default) and csv and
+    the gzip parameter compresses the export on the fly.
+
+    The staff members are able to export any User by its id.
+    """
+    permission_classes = (IsAuthenticated, )
+    # The queries of the streamed export run after the view returns
+    query_budget = {'GET': 3}
+    time_budget = 1.0
+
+    def get_permissions(self):
+        if self.kwargs.get('user_id') is not None:
+            return [IsAdminUser()]
+        return super().get_permissions()
+
+    def get(self, request, user_id=None):
+        file_format = request.GET.get('file_format', 'ndjson')
+        compress = request.GET.get('gzip') in ('1', 'true')
+
+        if file_format not in EXPORT_FORMATS:
+            content = {
+                'message': f'The file_format must be one of: '
+                           f'{", ".join(EXPORT_FORMATS)}'
+            }
+            return Response(content, status=status.HTTP_400_BAD_REQUEST)
+
+        if user_id is None:
+            user = request.user
+        else:
+            try:
+                user = User.objects.get(id=user_id)
+            except User.DoesNotExist:
+                raise Http404
+
+        filename = f'user-{user.id}.{file_format}'
+        if compress:
+            content_type = 'application/gzip'
+            filename += '.gz'
+        elif file_format == 'csv':
+            content_type = 'text/csv'
+        else:
+            content_type = 'application/x-ndjson'
+
+        response = StreamingHttpResponse(
+            stream_export(user, file_format=file_format, compress=compress),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response